@@ -0,0 +1,170 @@
+"""Пакетное моделирование: одна программа на множестве входных потоков.
+
+Программа загружается один раз в родительском процессе. Рабочие процессы создаются через `fork`
+и получают образ программы копированием при записи, без повторного чтения и разбора файла.
+Входные данные подаются потоком (пакетами по `chunksize`), одновременно в работе находится не более `window` пакетов,
+результаты выдаются по мере готовности -- в порядке входов или в порядке завершения.
+
+Каждый запуск моделирует программу с нуля (свои `DataPath` и `ControlUnit`), поэтому результат
+не зависит от числа рабочих процессов. Исключение -- ограничение по времени (`--time-budget`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import NamedTuple
+
+from data_path import DataPath
+from isa import ProgramImage, read_data_and_code
+from models import DEFAULT_ENGINES, MODELS, make_control_unit
+from stop_conditions import StopConditions, add_stop_arguments, stop_conditions_from_args
+
+
+class BatchResult(NamedTuple):
+    index: int
+    output: str
+    instr_counter: int
+    ticks: int
+
+
+class BatchJob:
+    """Программа и параметры моделирования, общие для всех входов."""
+
+    data = None
+    program = None
+    model = None
+    engine = None
+    stop = None
+
+    def __init__(self, data: list[int], code, model: str = "hw", engine: str | None = None, stop=None):
+        assert model in MODELS, f"Unknown model: {model}"
+        self.data: list[int] = data
+        self.program: ProgramImage = ProgramImage.from_code(code)
+        self.model: str = model
+        self.engine: str = engine or DEFAULT_ENGINES[model]
+        self.stop: StopConditions = stop or StopConditions()
+
+    def run(self, input_text: str):
+        control_unit = make_control_unit(self.model, self.program, DataPath(list(self.data), input_text), self.engine)
+        return control_unit.run(stop=self.stop)
+
+
+# Задание рабочего процесса. Устанавливается инициализатором пула (_init_worker), поэтому у каждого пула свое
+_job: BatchJob | None = None
+
+
+def _init_worker(job: BatchJob):
+    global _job
+    _job = job
+
+
+def _run_chunk(first_index: int, input_texts: list[str]):
+    return [BatchResult(first_index + offset, *_job.run(text)) for offset, text in enumerate(input_texts)]
+
+
+def chunked(inputs, chunksize: int):
+    """Разбивает поток входов на списки по chunksize, выдает (индекс первого входа, список)."""
+    chunk = []
+    first_index = 0
+    for index, input_text in enumerate(inputs):
+        if not chunk:
+            first_index = index
+        chunk.append(input_text)
+        if len(chunk) == chunksize:
+            yield first_index, chunk
+            chunk = []
+    if chunk:
+        yield first_index, chunk
+
+
+def run_batch(
+    job: BatchJob,
+    inputs,
+    workers: int | None = None,
+    ordered: bool = True,
+    chunksize: int = 1,
+    window: int | None = None,
+):
+    """
+    Моделирует программу на каждом входе из inputs (итератор строк), выдает BatchResult.
+     workers -- число рабочих процессов (None -- по числу ядер, 0 -- в текущем процессе);
+     ordered -- выдавать результаты в порядке входов, иначе в порядке завершения;
+     chunksize -- сколько входов передается рабочему процессу за раз;
+     window -- сколько пакетов входов одновременно находится в работе (по умолчанию 4 на процесс).
+    """
+    if workers == 0:
+        for index, input_text in enumerate(inputs):
+            yield BatchResult(index, *job.run(input_text))
+        return
+
+    workers = workers or os.cpu_count()
+    window = window or 4 * workers
+    # при fork аргументы инициализатора передаются рабочим процессам без сериализации
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(job,),
+    ) as pool:
+        pending = deque()
+        for first_index, chunk in chunked(inputs, chunksize):
+            pending.append(pool.submit(_run_chunk, first_index, chunk))
+            if len(pending) >= window:
+                yield from _collect(pending, ordered)
+        while pending:
+            yield from _collect(pending, ordered)
+
+
+def _collect(pending: deque, ordered: bool):
+    """Забирает из очереди хотя бы один готовый пакет результатов (при ordered -- только по порядку)."""
+    if ordered:
+        yield from pending.popleft().result()
+        while pending and pending[0].done():
+            yield from pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield from future.result()
+
+
+def read_inputs(filenames):
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as file:
+            yield file.read()
+
+
+def main(code_file, input_files, model="hw", engine=None, stop=None, workers=None, ordered=True, chunksize=1):
+    data, code = read_data_and_code(code_file)
+    job = BatchJob(data, code, model, engine, stop)
+    for result in run_batch(job, read_inputs(input_files), workers, ordered, chunksize):
+        print(f"{input_files[result.index]}\t{result.instr_counter}\t{result.ticks}\t{result.output!r}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Пакетное моделирование программы на множестве входов")
+    parser.add_argument("code_file")
+    parser.add_argument("input_files", nargs="+")
+    parser.add_argument("--model", choices=MODELS, default="hw")
+    parser.add_argument("--engine", default=None, help="engine of the chosen model (default: dispatch / compiled)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 0 - run in this process")
+    parser.add_argument("--unordered", action="store_true", help="print results in completion order")
+    parser.add_argument("--chunksize", type=int, default=1, help="inputs sent to a worker at once")
+    add_stop_arguments(parser)
+    args = parser.parse_args()
+    main(
+        args.code_file,
+        args.input_files,
+        args.model,
+        args.engine,
+        stop_conditions_from_args(args),
+        args.workers,
+        not args.unordered,
+        args.chunksize,
+    )
@@ -0,0 +1,77 @@
+"""Сравнение реализаций памяти данных: обращения к памяти и моделирование программы.
+
+Запуск: `python -m benchmarks.memory_backends [--accesses 1000000] [--program algorithms/prob1.fth]`
+
+Для каждой реализации измеряются последовательная запись и чтение, случайные обращения внутри
+области размером `--span` слов и полное моделирование программы (hardwired модель, движок jit).
+"""
+
+from __future__ import annotations
+
+import argparse
+import pathlib
+import random
+import time
+
+import machine_hw
+import translator
+from data_path import DataPath
+from memory import BACKENDS, make_memory
+from stop_conditions import StopConditions
+
+DEFAULT_ACCESSES = 1_000_000
+DEFAULT_SPAN = 1 << 16
+DEFAULT_PROGRAM = pathlib.Path(__file__).parent.parent / "algorithms" / "prob1.fth"
+
+
+def sequential(memory, accesses: int):
+    for address in range(accesses):
+        memory[address] = address
+    total = 0
+    for address in range(accesses):
+        total += memory[address]
+    return total
+
+
+def scattered(memory, addresses: list[int]):
+    total = 0
+    for address in addresses:
+        memory[address] = total
+        total += memory[address ^ 1]
+    return total
+
+
+def simulate(backend: str, data, code):
+    data_path = DataPath(make_memory(backend, data), "")
+    machine_hw.ControlUnit(code, data_path, "jit").run(stop=StopConditions(max_instructions=None))
+    data_path.data_memory.close()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main(accesses: int, span: int, program: str):
+    data, code = translator.translate(pathlib.Path(program).read_text(encoding="utf-8"))
+    addresses = [random.Random(0).randrange(span) for _ in range(accesses)]
+    print(f"{'backend':>8} {'sequential':>12} {'scattered':>12} {'program':>12}   (seconds)")
+    for backend in BACKENDS:
+        memory = make_memory(backend)
+        seconds = (
+            timed(sequential, memory, min(accesses, memory.size)),
+            timed(scattered, memory, addresses),
+            timed(simulate, backend, data, code),
+        )
+        memory.close()
+        print(f"{backend:>8} " + " ".join(f"{value:>12.3f}" for value in seconds))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение реализаций памяти данных")
+    parser.add_argument("--accesses", type=int, default=DEFAULT_ACCESSES)
+    parser.add_argument("--span", type=int, default=DEFAULT_SPAN, help="address range of scattered accesses")
+    parser.add_argument("--program", default=str(DEFAULT_PROGRAM))
+    args = parser.parse_args()
+    main(args.accesses, args.span, args.program)
@@ -0,0 +1,154 @@
+"""Набор бенчмарков транслятора и моделей с проверкой на замедление.
+
+Запуск: `python -m benchmarks.suite [--output results.json] [--baseline baseline.json] [--threshold 0.2]`
+
+Измеряется:
+ - `translate/<tokens>` -- скорость трансляции сгенерированных программ (токенов в секунду);
+ - `<model>-<engine>/<program>/x<scale>` -- скорость моделирования (инструкций и тактов в секунду)
+   программ prob1, cat и hello_username на входе, повторенном scale раз.
+
+Каждое измерение повторяется `--repeat` раз (короткие -- чаще), берется лучшее время. Результаты записываются в JSON.
+Если задан `--baseline`, результаты сравниваются с ним по основной метрике (`throughput`), и процесс завершается
+с кодом 1, если хотя бы одно измерение медленнее базового больше чем на threshold. Измерения короче
+`--min-seconds` не сравниваются: их время -- в основном шум.
+Базовые результаты зависят от машины, поэтому в репозитории их нет: их сохраняют (`--save-baseline`)
+и сравнивают на одной и той же машине.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import platform
+import sys
+import time
+
+import translator
+from data_path import DataPath
+from models import make_control_unit
+from stop_conditions import StopConditions
+
+from benchmarks.translator_scaling import generate_source
+
+ALGORITHMS = pathlib.Path(__file__).parent.parent / "algorithms"
+DEFAULT_THRESHOLD = 0.2
+# Измерения короче (в базовых или текущих результатах) не сравниваются
+DEFAULT_MIN_SECONDS = 0.01
+DEFAULT_REPEAT = 3
+MIN_TOTAL_TIME = 0.2
+DEFAULT_TRANSLATOR_SIZES = (10_000, 100_000)
+DEFAULT_SCALES = (1, 10, 100, 1000, 10000)
+DEFAULT_ENGINES = ("hw-dispatch", "hw-jit", "mc-compiled")
+
+# Вход программы, который повторяется scale раз. У prob1 входа нет, она измеряется только при scale = 1
+PROGRAM_INPUTS = {
+    "prob1": None,
+    "cat": "Hello, world!\n",
+    "hello_username": "Alice",
+}
+
+
+def best_time(function, repeat: int):
+    """Лучшее время из repeat запусков. Короткие измерения повторяются, пока не наберется MIN_TOTAL_TIME секунд."""
+    best = float("inf")
+    total = 0.0
+    runs = 0
+    result = None
+    while runs < repeat or total < MIN_TOTAL_TIME:
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best, total, runs = min(best, elapsed), total + elapsed, runs + 1
+    return best, result
+
+
+def bench_translator(tokens: int, repeat: int):
+    source = generate_source(tokens)
+    seconds, _ = best_time(lambda: translator.translate(source), repeat)
+    return {"seconds": seconds, "tokens": tokens, "throughput": tokens / seconds}
+
+
+def simulate(model: str, engine: str, data, code, input_text: str):
+    control_unit = make_control_unit(model, code, DataPath(list(data), input_text), engine)
+    _, instr_counter, ticks = control_unit.run(stop=StopConditions(max_instructions=None))
+    return instr_counter, ticks
+
+
+def bench_simulation(model: str, engine: str, program: str, input_text: str, repeat: int):
+    data, code = translator.translate((ALGORITHMS / f"{program}.fth").read_text(encoding="utf-8"))
+    seconds, (instructions, ticks) = best_time(lambda: simulate(model, engine, data, code, input_text), repeat)
+    return {
+        "seconds": seconds,
+        "instructions": instructions,
+        "ticks": ticks,
+        "throughput": instructions / seconds,
+        "ticks_per_second": ticks / seconds,
+    }
+
+
+def run_suite(translator_sizes, scales, engines, repeat: int):
+    """Выполняет все измерения, выдает пары (имя, результат)."""
+    for tokens in translator_sizes:
+        yield f"translate/{tokens}", bench_translator(tokens, repeat)
+    for name in engines:
+        model, engine = name.split("-", 1)
+        for program, unit in PROGRAM_INPUTS.items():
+            for scale in scales if unit is not None else (1,):
+                input_text = unit * scale if unit is not None else ""
+                if program == "hello_username":
+                    input_text += "\n"
+                yield f"{name}/{program}/x{scale}", bench_simulation(model, engine, program, input_text, repeat)
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float = DEFAULT_MIN_SECONDS):
+    """
+    Измерения, которые медленнее базовых больше чем на threshold: (имя, отношение скоростей).
+     Измерения, которых нет в базовых результатах или которые короче min_seconds, пропускаются.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and min(result["seconds"], baseline[name]["seconds"]) >= min_seconds:
+            ratio = result["throughput"] / baseline[name]["throughput"]
+            if ratio < 1 - threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def main(args):
+    results = {}
+    for name, result in run_suite(args.translator_sizes, args.scales, args.engines, args.repeat):
+        results[name] = result
+        print(f"{name:<40} {result['seconds']:>9.4f} s {result['throughput']:>14,.0f} /s", flush=True)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.baseline is None:
+        return 0
+    baseline_path = pathlib.Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))["results"]
+    regressions = compare(results, baseline, args.threshold, args.min_seconds)
+    for name, ratio in regressions:
+        print(f"REGRESSION {name}: {ratio:.2f}x of baseline throughput")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки транслятора и моделей процессора")
+    parser.add_argument("--output", default=None, help="write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare with results saved on this machine")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the new --baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.2 - 20%%")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS, help="do not gate shorter cases")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--translator-sizes", type=int, nargs="*", default=DEFAULT_TRANSLATOR_SIZES)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--engines", nargs="+", default=DEFAULT_ENGINES, help="model-engine pairs, e.g. hw-jit")
+    args = parser.parse_args()
+    assert args.baseline is not None or not args.save_baseline, "--save-baseline needs --baseline"
+    sys.exit(main(args))
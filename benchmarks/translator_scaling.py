@@ -0,0 +1,55 @@
+"""Масштабируемость транслятора: время трансляции сгенерированных программ разного размера.
+
+Запуск: `python -m benchmarks.translator_scaling [--sizes 10000 100000 1000000]`
+
+Для линейного транслятора время на один токен не должно расти с размером программы.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+import translator
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# Шаблон процедуры и ее вызова: переменная, цикл, условие, арифметика и "+!".
+BLOCK = """
+variable counter{i}
+: word{i} (n -- n)
+    begin
+        dup counter{i} +!
+        1 -
+        dup 0 < if 0 counter{i} ! then
+    dup 0 = until
+;
+10 word{i}
+"""
+BLOCK_TOKENS = len(translator.text2terms(BLOCK.format(i=0)))
+
+
+def generate_source(tokens: int):
+    """Программа из повторяющихся блоков, содержащая не меньше `tokens` токенов."""
+    return "".join(BLOCK.format(i=i) for i in range(-(-tokens // BLOCK_TOKENS)))
+
+
+def measure(tokens: int):
+    source = generate_source(tokens)
+    start = time.perf_counter()
+    translator.translate(source)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    print(f"{'tokens':>10} {'seconds':>10} {'us/token':>10}")
+    for tokens in sizes:
+        seconds = measure(tokens)
+        print(f"{tokens:>10} {seconds:>10.3f} {seconds / tokens * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Масштабируемость транслятора")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    args = parser.parse_args()
+    main(args.sizes)
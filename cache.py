@@ -0,0 +1,172 @@
+"""Модель кэша: кэш данных между DataPath и памятью данных, кэш команд перед памятью команд.
+
+Кэш состоит из `lines // ways` множеств по `ways` строк, в строке `line_size` ячеек памяти:
+`ways=1` -- кэш прямого отображения, `ways=lines` (или 0) -- полностью ассоциативный.
+Кэш моделирует только задержки: значения по-прежнему хранятся в `DataPath.data_memory` и образе программы.
+При `prefetch` промах дополнительно загружает следующую строку (без задержки, она перекрывается промахом).
+
+Политики записи:
+ - `back` -- запись с размещением строки в кэше, строка помечается измененной и записывается в память при вытеснении;
+ - `through` -- запись сразу в память (`miss_ticks`), без размещения строки при промахе.
+
+Каждое обращение добавляет `hit_ticks` или `miss_ticks` тактов (запись измененной строки при вытеснении --
+еще `miss_ticks`). Эти такты накапливаются в `stall_ticks` и прибавляются моделью к числу тактов.
+Ячейки ввода-вывода не кэшируются (см. `DataPath.IO_ADDRESSES`). Кэш команд получает адрес каждой
+выбираемой инструкции (суперинструкция выбирается как одна инструкция).
+"""
+
+from __future__ import annotations
+
+import random
+from collections import Counter, OrderedDict
+
+REPLACEMENT_POLICIES = ("lru", "fifo", "random")
+WRITE_POLICIES = ("back", "through")
+
+
+class Cache:
+    lines = None
+    line_size = None
+    ways = None
+    replacement = None
+    write_policy = None
+    hit_ticks = None
+    miss_ticks = None
+    prefetch = None
+
+    sets = None
+    stall_ticks = None
+    hits = None
+    misses = None
+    writebacks = None
+    prefetches = None
+
+    def __init__(
+        self,
+        lines: int = 16,
+        line_size: int = 4,
+        ways: int = 1,
+        replacement: str = "lru",
+        write_policy: str = "back",
+        hit_ticks: int = 0,
+        miss_ticks: int = 10,
+        prefetch: bool = False,
+        seed: int = 0,
+    ):
+        """ways=0 -- полностью ассоциативный кэш. seed -- зерно для случайного вытеснения."""
+        ways = ways or lines
+        assert lines > 0, "Number of cache lines must be positive"
+        assert line_size > 0, "Cache line size must be positive"
+        assert lines % ways == 0, "Number of lines must be a multiple of associativity"
+        assert replacement in REPLACEMENT_POLICIES, f"Unknown replacement policy: {replacement}"
+        assert write_policy in WRITE_POLICIES, f"Unknown write policy: {write_policy}"
+        self.lines: int = lines
+        self.line_size: int = line_size
+        self.ways: int = ways
+        self.replacement: str = replacement
+        self.write_policy: str = write_policy
+        self.hit_ticks: int = hit_ticks
+        self.miss_ticks: int = miss_ticks
+        self.prefetch: bool = prefetch
+        self._random = random.Random(seed)
+
+        # множество: тег -> строка изменена (порядок -- порядок вытеснения для LRU и FIFO)
+        self.sets: list[OrderedDict[int, bool]] = [OrderedDict() for _ in range(lines // ways)]
+        self.stall_ticks: int = 0
+        # статистика по адресам ячеек
+        self.hits: Counter[int] = Counter()
+        self.misses: Counter[int] = Counter()
+        self.writebacks: int = 0
+        self.prefetches: int = 0
+
+    def access(self, address: int, write: bool = False):
+        """Обращение к ячейке памяти. Возвращает задержку в тактах."""
+        line = address // self.line_size
+        cache_set, tag = self.locate(line)
+        if tag in cache_set:
+            self.hits[address] += 1
+            if self.replacement == "lru":
+                cache_set.move_to_end(tag)
+            ticks = self.hit_ticks
+            if write and self.write_policy == "back":
+                cache_set[tag] = True
+            elif write:
+                ticks += self.miss_ticks
+        else:
+            self.misses[address] += 1
+            ticks = self.miss_ticks
+            if not write or self.write_policy == "back":
+                ticks += self.allocate(cache_set, tag, dirty=write)
+            if self.prefetch:
+                ticks += self.prefetch_line(line + 1)
+        self.stall_ticks += ticks
+        return ticks
+
+    def locate(self, line: int):
+        """Множество и тег строки памяти с номером line."""
+        return self.sets[line % len(self.sets)], line // len(self.sets)
+
+    def prefetch_line(self, line: int):
+        """Загружает строку, если ее нет в кэше. Возвращает задержку вытеснения."""
+        cache_set, tag = self.locate(line)
+        if tag in cache_set:
+            return 0
+        self.prefetches += 1
+        return self.allocate(cache_set, tag, dirty=False)
+
+    def allocate(self, cache_set: OrderedDict[int, bool], tag: int, dirty: bool):
+        """Размещает строку в множестве, при необходимости вытесняя другую. Возвращает задержку вытеснения."""
+        ticks = 0
+        if len(cache_set) == self.ways:
+            victim = self._random.choice(list(cache_set)) if self.replacement == "random" else next(iter(cache_set))
+            if cache_set.pop(victim):
+                self.writebacks += 1
+                ticks = self.miss_ticks
+        cache_set[tag] = dirty
+        return ticks
+
+    def address_stats(self):
+        """{адрес: (попадания, промахи)} в порядке адресов."""
+        return {address: (self.hits[address], self.misses[address]) for address in sorted(self.hits | self.misses)}
+
+    def report(self, name: str = "cache"):
+        hits, misses = self.hits.total(), self.misses.total()
+        accesses = hits + misses
+        lines = [
+            f"{name}: hits: {hits} misses: {misses} "
+            f"hit rate: {hits / accesses if accesses else 0:.3f} "
+            f"writebacks: {self.writebacks} prefetches: {self.prefetches} stall ticks: {self.stall_ticks}",
+        ]
+        lines.extend(
+            f"  address {address:5}: hits: {hits:6} misses: {misses:6}"
+            for address, (hits, misses) in self.address_stats().items()
+        )
+        return "\n".join(lines)
+
+
+def add_cache_arguments(parser, name: str = "cache", title: str = "data"):
+    """Добавляет в argparse-парсер параметры кэша (--<name>-lines и т.д.)."""
+    parser.add_argument(f"--{name}-lines", type=int, default=0, help=f"{title} cache lines, 0 - no cache")
+    parser.add_argument(f"--{name}-line-size", type=int, default=4, help="memory cells per cache line")
+    parser.add_argument(f"--{name}-ways", type=int, default=1, help="associativity, 0 - fully associative")
+    parser.add_argument(f"--{name}-replacement", choices=REPLACEMENT_POLICIES, default="lru")
+    parser.add_argument(f"--{name}-write", choices=WRITE_POLICIES, default="back")
+    parser.add_argument(f"--{name}-hit-ticks", type=int, default=0)
+    parser.add_argument(f"--{name}-miss-ticks", type=int, default=10)
+    parser.add_argument(f"--{name}-prefetch", action="store_true", help="prefetch the next line on a miss")
+
+
+def cache_from_args(args, name: str = "cache"):
+    options = {key[len(name) + 1 :]: value for key, value in vars(args).items() if key.startswith(f"{name}_")}
+    if not options["lines"]:
+        return None
+    return Cache(
+        lines=options["lines"],
+        line_size=options["line_size"],
+        ways=options["ways"],
+        replacement=options["replacement"],
+        write_policy=options["write"],
+        hit_ticks=options["hit_ticks"],
+        miss_ticks=options["miss_ticks"],
+        prefetch=options["prefetch"],
+    )
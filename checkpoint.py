@@ -0,0 +1,332 @@
+"""Контрольные точки: снимок полного состояния модели процессора и восстановление из него.
+
+Снимок содержит PC, MPC (для microcoded модели), TOS, TOS1, SP, стек данных, стек возвратов, память данных,
+такты, число выполненных инструкций и положение устройств ввода-вывода: число прочитанных символов ввода
+и вывод (без приемника -- весь вывод, с приемником -- только число символов, сам вывод уже передан приемнику).
+
+Снимок на границе инструкции (MPC = 0) восстанавливается в любой модели и любом движке: можно дойти
+быстрым движком до интересного места и продолжить в microcoded модели с точностью до такта. Такты до
+переключения при этом посчитаны быстрой моделью. Содержимое кэшей не сохраняется: после восстановления кэши холодные.
+
+Восстановление изменяет существующие объекты модели (скомпилированный микрокод и блоки jit ссылаются на них),
+поэтому модель должна быть создана для той же программы (проверяется контрольной суммой) со свежим вводом.
+
+Память данных сохраняется участками, в которые была запись (`Memory.ranges`): для SparseMemory это только
+выделенные страницы, поэтому запись по далекому адресу не раздувает снимок.
+
+Двоичный формат: заголовок `SNAPSHOT_HEADER` (сигнатура, версия, модель), затем сжатые zlib данные:
+целые числа в формате zigzag LEB128, вывод в UTF-8 и участки памяти данных (начальный адрес, длина
+и массив 64-битных слов).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import pathlib
+import struct
+import sys
+import zlib
+from array import array
+from typing import NamedTuple
+
+import machine_hw
+import machine_mc
+from data_path import DataPath
+from isa import read_data_and_code
+from models import MODELS, make_control_unit
+from stop_conditions import StopConditions, StopReason
+
+SNAPSHOT_MAGIC = b"FTHS"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHB")
+
+DEFAULT_CHECKPOINT_INTERVAL = 1_000_000
+
+
+class Snapshot(NamedTuple):
+    model: str
+    program_checksum: int
+    instructions: int
+    ticks: int
+    program_counter: int
+    microprogram_counter: int
+    tos: int
+    tos1: int
+    stack_pointer: int
+    stack_high_water: int
+    stack: list[int]
+    return_stack_pointer: int
+    return_stack_high_water: int
+    return_stack: list[int]
+    word_bits: int
+    # участки памяти данных: (начальный адрес, значения)
+    memory: list[tuple[int, list[int]]]
+    input_consumed: int
+    output_written: int
+    output: str
+
+
+def program_checksum(program):
+    return zlib.crc32(" ".join(f"{opcode}:{arg}" for opcode, arg in zip(program.opcodes, program.args)).encode())
+
+
+def model_name(control_unit):
+    return "mc" if isinstance(control_unit, machine_mc.ControlUnit) else "hw"
+
+
+def take_snapshot(control_unit, instructions: int = 0):
+    """Снимок состояния модели. instructions -- сколько инструкций уже выполнено (счетчик ведет вызывающий)."""
+    data_path = control_unit.data_path
+    output_buffer = data_path.output_buffer
+    output_buffer.flush()
+    return Snapshot(
+        model=model_name(control_unit),
+        program_checksum=program_checksum(control_unit.program),
+        instructions=instructions,
+        ticks=control_unit.current_tick(),
+        program_counter=control_unit.program_counter,
+        microprogram_counter=getattr(control_unit, "microprogram_counter", 0),
+        tos=data_path.tos,
+        tos1=data_path.tos1,
+        stack_pointer=data_path.stack_pointer,
+        stack_high_water=data_path.stack_high_water,
+        # ячейки выше наибольшего SP не записывались
+        stack=data_path.stack[: data_path.stack_high_water + 1],
+        return_stack_pointer=control_unit.return_stack_pointer,
+        return_stack_high_water=control_unit.return_stack_high_water,
+        return_stack=control_unit.return_stack[: control_unit.return_stack_high_water + 1],
+        word_bits=data_path.data_memory.word_bits,
+        memory=data_path.data_memory.ranges(),
+        input_consumed=data_path.input_buffer.consumed,
+        output_written=output_buffer.written,
+        output=output_buffer.getvalue(),
+    )
+
+
+def restore_snapshot(control_unit, snapshot: Snapshot):
+    """Переводит модель в состояние снимка. Возвращает число инструкций, выполненных до снимка."""
+    data_path = control_unit.data_path
+    memory = data_path.data_memory
+    assert snapshot.program_checksum == program_checksum(control_unit.program), "Snapshot of another program"
+    assert snapshot.word_bits == memory.word_bits, "Snapshot of memory with another word size"
+    assert len(snapshot.stack) <= data_path.stack_depth, "Snapshot does not fit into the data stack"
+    assert len(snapshot.return_stack) <= control_unit.return_stack_depth, "Snapshot does not fit into the return stack"
+    assert snapshot.input_consumed >= data_path.input_buffer.consumed, "Input was read past the snapshot"
+    if isinstance(control_unit, machine_mc.ControlUnit):
+        control_unit.microprogram_counter = control_unit.prev_mpc = snapshot.microprogram_counter
+    else:
+        assert snapshot.microprogram_counter == 0, "Hardwired model resumes only at an instruction boundary"
+
+    control_unit.program_counter = snapshot.program_counter
+    control_unit.return_stack[:] = snapshot.return_stack + [0] * (
+        control_unit.return_stack_depth - len(snapshot.return_stack)
+    )
+    control_unit.return_stack_pointer = snapshot.return_stack_pointer
+    control_unit.return_stack_high_water = snapshot.return_stack_high_water
+
+    data_path.tos, data_path.tos1, data_path.stack_pointer = snapshot.tos, snapshot.tos1, snapshot.stack_pointer
+    data_path.stack[:] = snapshot.stack + [0] * (data_path.stack_depth - len(snapshot.stack))
+    data_path.stack_high_water = snapshot.stack_high_water
+    memory.clear()
+    for start, values in snapshot.memory:
+        for address, value in enumerate(values, start):
+            memory[address] = value
+
+    data_path.input_buffer.skip(snapshot.input_consumed - data_path.input_buffer.consumed)
+    data_path.output_buffer.reset(snapshot.output, snapshot.output_written)
+
+    # такты ожидания кэшей (холодных после восстановления) прибавляются к снимку заново
+    control_unit.set_current_tick(snapshot.ticks)
+    return snapshot.instructions
+
+
+def put_varint(buffer: bytearray, value: int):
+    """Знаковое целое в формате zigzag LEB128."""
+    value = value << 1 if value >= 0 else ((-value) << 1) - 1
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def get_varint(buffer: bytes, offset: int):
+    """Читает число, записанное put_varint. Возвращает значение и смещение за ним."""
+    value = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+SCALAR_FIELDS = (
+    "program_checksum",
+    "instructions",
+    "ticks",
+    "program_counter",
+    "microprogram_counter",
+    "tos",
+    "tos1",
+    "stack_pointer",
+    "stack_high_water",
+    "return_stack_pointer",
+    "return_stack_high_water",
+    "word_bits",
+    "input_consumed",
+    "output_written",
+)
+
+
+def encode_snapshot(snapshot: Snapshot):
+    payload = bytearray()
+    for name in SCALAR_FIELDS:
+        put_varint(payload, getattr(snapshot, name))
+    for values in (snapshot.stack, snapshot.return_stack):
+        put_varint(payload, len(values))
+        for value in values:
+            put_varint(payload, value)
+    output = snapshot.output.encode("utf-8")
+    put_varint(payload, len(output))
+    payload += output
+    put_varint(payload, len(snapshot.memory))
+    for start, values in snapshot.memory:
+        words = array("q", values)
+        if sys.byteorder == "big":
+            words.byteswap()
+        put_varint(payload, start)
+        put_varint(payload, len(words))
+        payload += words.tobytes()
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, MODELS.index(snapshot.model))
+    return header + zlib.compress(bytes(payload))
+
+
+def decode_snapshot(buffer: bytes):
+    magic, version, model = SNAPSHOT_HEADER.unpack_from(buffer)
+    assert magic == SNAPSHOT_MAGIC, "Not a snapshot"
+    assert version == SNAPSHOT_VERSION, f"Unsupported snapshot version: {version}"
+    payload = zlib.decompress(buffer[SNAPSHOT_HEADER.size :])
+    fields = {"model": MODELS[model]}
+    offset = 0
+    for name in SCALAR_FIELDS:
+        fields[name], offset = get_varint(payload, offset)
+    for name in ("stack", "return_stack"):
+        length, offset = get_varint(payload, offset)
+        values = []
+        for _ in range(length):
+            value, offset = get_varint(payload, offset)
+            values.append(value)
+        fields[name] = values
+    length, offset = get_varint(payload, offset)
+    fields["output"] = payload[offset : offset + length].decode("utf-8")
+    count, offset = get_varint(payload, offset + length)
+    fields["memory"] = []
+    for _ in range(count):
+        start, offset = get_varint(payload, offset)
+        length, offset = get_varint(payload, offset)
+        words = array("q", payload[offset : offset + 8 * length])
+        if sys.byteorder == "big":
+            words.byteswap()
+        fields["memory"].append((start, words.tolist()))
+        offset += 8 * length
+    return Snapshot(**fields)
+
+
+def write_snapshot(path: str, snapshot: Snapshot):
+    """Записывает снимок атомарно: прерванная запись не портит предыдущую контрольную точку."""
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(encode_snapshot(snapshot))
+        file.flush()
+        os.fsync(file.fileno())
+    pathlib.Path(temporary).replace(path)
+
+
+def read_snapshot(path: str):
+    with open(path, "rb") as file:
+        return decode_snapshot(file.read())
+
+
+def run_with_checkpoints(
+    control_unit, path: str, interval: int = DEFAULT_CHECKPOINT_INTERVAL, limit=None, instructions=0
+):
+    """
+    Моделирование с контрольной точкой в файле path каждые interval инструкций и при остановке по лимиту.
+     instructions -- число инструкций, выполненных до начала (при продолжении из контрольной точки).
+     Возвращает вывод, общее число инструкций и тактов, как ControlUnit.run.
+    """
+    assert interval > 0, "Checkpoint interval must be positive"
+    while limit is None or instructions < limit:
+        batch = interval if limit is None else min(interval, limit - instructions)
+        # между контрольными точками -- пауза; по лимиту моделирование останавливается, как обычно
+        last = limit is not None and instructions + batch == limit
+        _, executed, _ = control_unit.run(stop=StopConditions(max_instructions=batch, pause=not last))
+        instructions += executed
+        if control_unit.stop_reason in (StopReason.PAUSE, StopReason.INSTRUCTION_LIMIT):
+            write_snapshot(path, take_snapshot(control_unit, instructions))
+        if control_unit.stop_reason is not StopReason.PAUSE:
+            break
+    return control_unit.data_path.output_buffer.getvalue(), instructions, control_unit.current_tick()
+
+
+def main(
+    code_file, input_file, model="hw", engine=None, checkpoint=None, interval=DEFAULT_CHECKPOINT_INTERVAL, **options
+):
+    """
+    checkpoint -- файл контрольной точки; если он существует и задан options["resume"], моделирование
+     продолжается из него. options["switch_at"] -- число инструкций, которое сначала выполняет быстрая модель
+     (hardwired, jit), после чего состояние передается модели model. options["limit"] -- лимит инструкций.
+    """
+    data, code = read_data_and_code(code_file)
+    limit, switch_at = options.get("limit"), options.get("switch_at")
+    with open(input_file, encoding="utf-8") as file:
+        control_unit = make_control_unit(model, code, DataPath(list(data), file), engine)
+        instructions = 0
+        if checkpoint is not None and options.get("resume") and pathlib.Path(checkpoint).exists():
+            instructions = restore_snapshot(control_unit, read_snapshot(checkpoint))
+            logging.info("Resumed from %s at instruction %d", checkpoint, instructions)
+        elif switch_at:
+            with open(input_file, encoding="utf-8") as fast_input:
+                fast = machine_hw.ControlUnit(code, DataPath(list(data), fast_input), "jit")
+                _, instructions, _ = fast.run(stop=StopConditions(max_instructions=switch_at, pause=True))
+                instructions = restore_snapshot(control_unit, take_snapshot(fast, instructions))
+            logging.info("Switched to %s at instruction %d", model, instructions)
+
+        if checkpoint is not None:
+            output, instructions, ticks = run_with_checkpoints(control_unit, checkpoint, interval, limit, instructions)
+        else:
+            remaining = None if limit is None else limit - instructions
+            output, executed, ticks = control_unit.run(stop=StopConditions(max_instructions=remaining))
+            instructions += executed
+
+    print(output)
+    print("instr_counter:", instructions, "ticks:", ticks)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Контрольные точки моделирования и переключение моделей")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--model", choices=MODELS, default="hw")
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file, rewritten every --interval instructions")
+    parser.add_argument("--interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL)
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint if it exists")
+    parser.add_argument("--switch-at", type=int, default=None, help="run hardwired jit for N instructions first")
+    parser.add_argument("--limit", type=int, default=0, help="instruction limit, 0 - unlimited")
+    args = parser.parse_args()
+    main(
+        args.code_file,
+        args.input_file,
+        args.model,
+        args.engine,
+        args.checkpoint,
+        args.interval,
+        resume=args.resume,
+        switch_at=args.switch_at,
+        limit=args.limit or None,
+    )
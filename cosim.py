@@ -0,0 +1,177 @@
+"""Совместное моделирование: hardwired и microcoded модели исполняют одну программу шаг в шаг.
+
+После каждой инструкции (для microcoded модели -- когда MPC возвращается в 0) сравниваются
+архитектурные состояния моделей: PC, TOS, TOS1, SP, содержимое стека, указатель стека возвратов,
+память данных и вывод. Такты не сравниваются: модели различаются именно ими.
+Память данных моделей -- `WriteTrackingMemory`: на каждом шаге сравниваются только ячейки, записанные
+на нем хотя бы одной из моделей, поэтому шаг не зависит от размера памяти.
+
+При первом расхождении сообщается номер инструкции, различающиеся поля и последние состояния обеих моделей.
+Исключение (например, StackError) считается частью поведения: модели должны завершиться одинаково.
+Если у машинного кода есть карта исходного кода (`<code_file>.map`), в отчете о расхождении указывается
+позиция инструкции в исходном коде.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import NamedTuple
+
+import machine_hw
+import machine_mc
+from data_path import DataPath
+from isa import read_data_and_code
+from memory import WriteTrackingMemory
+from source_map import LazySourceMap, SourceMap, find_source_map
+from stop_conditions import DEFAULT_INSTRUCTION_LIMIT
+from tracing import DEFAULT_TRACE_DEPTH, TraceLevel, Tracer
+
+STATE_FIELDS = ("pc", "tos", "tos1", "sp", "stack", "return_sp", "data_memory", "output", "outcome")
+
+
+def architectural_state(control_unit, outcome: str | None, written: list[int]):
+    """
+    Состояние, которое должно совпадать у обеих моделей. outcome -- исключение, которым закончился шаг,
+     written -- адреса ячеек памяти, записанных на шаге.
+    """
+    data_path = control_unit.data_path
+    memory = data_path.data_memory
+    output = data_path.output_buffer
+    return (
+        control_unit.program_counter,
+        data_path.tos,
+        data_path.tos1,
+        data_path.stack_pointer,
+        data_path.stack[: data_path.stack_pointer + 1],
+        control_unit.return_stack_pointer,
+        {address: memory[address] for address in written},
+        # число выведенных символов и последняя запись: расхождение видно на том шаге, где оно возникло
+        (output.written, output.chunks[-1] if output.chunks else ""),
+        outcome,
+    )
+
+
+def step(control_unit):
+    """Шаг модели. Возвращает None или описание исключения, которым закончился шаг."""
+    try:
+        control_unit.step()
+    except StopIteration:
+        return "halt"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+class Divergence(NamedTuple):
+    instruction: int
+    fields: tuple[str, ...]
+    hw_state: tuple
+    mc_state: tuple
+    hw_trace: str
+    mc_trace: str
+    # позиция расходящейся инструкции в исходном коде (если есть карта исходного кода)
+    source: str | None = None
+
+    def report(self):
+        lines = [f"Models diverged at instruction #{self.instruction}:"]
+        if self.source is not None:
+            lines.append(f"  source: {self.source}")
+        lines.extend(
+            f"  {name}: hw={hw!r} mc={mc!r}"
+            for name, hw, mc in zip(STATE_FIELDS, self.hw_state, self.mc_state)
+            if name in self.fields
+        )
+        lines.extend(["machine_hw trace:", self.hw_trace, "machine_mc trace:", self.mc_trace])
+        return "\n".join(lines)
+
+
+class CosimResult(NamedTuple):
+    instructions: int
+    outcome: str | None
+    divergence: Divergence | None
+
+
+def lockstep(
+    hw,
+    mc,
+    max_instructions: int | None = DEFAULT_INSTRUCTION_LIMIT,
+    trace_depth=DEFAULT_TRACE_DEPTH,
+    source_map: SourceMap | LazySourceMap | None = None,
+):
+    """
+    Исполняет модели шаг в шаг до расхождения, завершения или лимита инструкций.
+     Память данных обеих моделей -- WriteTrackingMemory с одинаковым начальным содержимым.
+    """
+    hw_memory, mc_memory = hw.data_path.data_memory, mc.data_path.data_memory
+    assert isinstance(hw_memory, WriteTrackingMemory), "Lockstep compares memory by tracked writes"
+    assert isinstance(mc_memory, WriteTrackingMemory), "Lockstep compares memory by tracked writes"
+    hw_tracer = Tracer(hw.format_state, TraceLevel.INSTRUCTION, trace_depth)
+    mc_tracer = Tracer(mc.format_state, TraceLevel.INSTRUCTION, trace_depth)
+    hw_tracer.record(hw.trace_state())
+    mc_tracer.record(mc.trace_state())
+    instructions = 0
+    outcome = None
+    while outcome is None and (max_instructions is None or instructions < max_instructions):
+        instructions += 1
+        pc = hw.program_counter
+        hw_outcome, mc_outcome = step(hw), step(mc)
+        written = sorted(hw_memory.written | mc_memory.written)
+        hw_memory.written.clear()
+        mc_memory.written.clear()
+        hw_state = architectural_state(hw, hw_outcome, written)
+        mc_state = architectural_state(mc, mc_outcome, written)
+        hw_tracer.record(hw.trace_state())
+        mc_tracer.record(mc.trace_state())
+        if hw_state != mc_state:
+            fields = tuple(name for name, a, b in zip(STATE_FIELDS, hw_state, mc_state) if a != b)
+            source = None if source_map is None else source_map.describe(pc)
+            divergence = Divergence(
+                instructions, fields, hw_state, mc_state, hw_tracer.dump(), mc_tracer.dump(), source
+            )
+            return CosimResult(instructions, None, divergence)
+        outcome = hw_state[-1]
+    return CosimResult(instructions, outcome, None)
+
+
+def cosimulate(
+    data: list[int],
+    code,
+    input_text="",
+    max_instructions: int | None = DEFAULT_INSTRUCTION_LIMIT,
+    hw_engine: str = "dispatch",
+    mc_engine: str = "compiled",
+    trace_depth=DEFAULT_TRACE_DEPTH,
+    source_map: SourceMap | LazySourceMap | None = None,
+):
+    hw = machine_hw.ControlUnit(code, DataPath(WriteTrackingMemory(data), input_text), hw_engine)
+    mc = machine_mc.ControlUnit(code, DataPath(WriteTrackingMemory(data), input_text), engine=mc_engine)
+    return lockstep(hw, mc, max_instructions, trace_depth, source_map)
+
+
+def main(
+    code_file, input_file, limit=DEFAULT_INSTRUCTION_LIMIT, hw_engine="dispatch", mc_engine="compiled", source_map=None
+):
+    data, code = read_data_and_code(code_file)
+    with open(input_file, encoding="utf-8") as file:
+        input_text = file.read()
+    # карта исходного кода читается только при расхождении
+    source_map = find_source_map(code_file, source_map)
+    result = cosimulate(data, code, input_text, limit, hw_engine, mc_engine, source_map=source_map)
+    if result.divergence is not None:
+        print(result.divergence.report())
+        return 1
+    print(f"Models agree on {result.instructions} instructions, outcome: {result.outcome or 'instruction limit'}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Совместное моделирование hardwired и microcoded моделей")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--limit", type=int, default=DEFAULT_INSTRUCTION_LIMIT, help="instruction limit, 0 - unlimited")
+    parser.add_argument("--hw-engine", choices=machine_hw.ENGINES, default="dispatch")
+    parser.add_argument("--mc-engine", choices=machine_mc.ENGINES, default="compiled")
+    parser.add_argument("--source-map", default=None, help="source map file (default: <code_file>.map if present)")
+    args = parser.parse_args()
+    sys.exit(main(args.code_file, args.input_file, args.limit or None, args.hw_engine, args.mc_engine, args.source_map))
@@ -2,16 +2,36 @@ from __future__ import annotations
 
 from typing import ClassVar
 
+from cache import Cache
+from devices import InputDevice, OutputDevice
+from memory import WORD_BITS, DenseMemory, Memory
 from signals import Signal
 
+DEFAULT_STACK_DEPTH = 1024
+DEFAULT_RETURN_STACK_DEPTH = 256
+
+# Машинное слово: АЛУ, как и память данных, работает со знаковыми словами разрядности WORD_BITS,
+# переполнение циклическое (см. memory.wrap_word)
+_WORD_HALF = 1 << (WORD_BITS - 1)
+_WORD_MASK = (1 << WORD_BITS) - 1
+
+
+class StackError(Exception):
+    """Переполнение или исчерпание аппаратного стека."""
+
+    def __init__(self, name: str, pointer: int, depth: int):
+        kind = "overflow" if pointer >= depth else "underflow"
+        super().__init__(f"{name.capitalize()} stack {kind}: pointer {pointer}, depth {depth}")
+        self.pointer = pointer
+
 
 class ALU:
     SIGNAL_TO_OPERATION: ClassVar[dict] = {
-        Signal.SumALU: lambda a, b: a + b,
-        Signal.SubALU: lambda a, b: a - b,
+        Signal.SumALU: lambda a, b: ((a + b + _WORD_HALF) & _WORD_MASK) - _WORD_HALF,
+        Signal.SubALU: lambda a, b: ((a - b + _WORD_HALF) & _WORD_MASK) - _WORD_HALF,
         Signal.AndALU: lambda a, b: -int(bool(a) and bool(b)),
         Signal.OrALU: lambda a, b: -int(bool(a) or bool(b)),
-        Signal.NegALU: lambda _, b: -b,
+        Signal.NegALU: lambda _, b: ((_WORD_HALF - b) & _WORD_MASK) - _WORD_HALF,
         Signal.ISNEG: lambda _, b: -1 if b < 0 else 0,
         Signal.InvertRightALU: lambda _, b: -1 if b == 0 else 0,
     }
@@ -27,42 +47,75 @@ class DataPath:
     tos1 = None
     stack_pointer = None
     stack = None
+    stack_depth = None
+    stack_high_water = None
 
     input_buffer = None
     output_buffer = None
+    cache = None
     alu = ALU()
 
     WRITE_MEM_IO_MAPPING_INT = 0  # Устройство, выводящее значение ячеек
     WRITE_MEM_IO_MAPPING_CHAR = 1  # Устройство, выводящее символы
     READ_MEM_IO_MAPPING = 2
-
-    def __init__(self, data_memory, input_buffer: list[str]):
-        self.data_memory = data_memory
+    # Ячейки устройств ввода-вывода не кэшируются
+    IO_ADDRESSES: ClassVar[frozenset[int]] = frozenset(
+        (WRITE_MEM_IO_MAPPING_INT, WRITE_MEM_IO_MAPPING_CHAR, READ_MEM_IO_MAPPING)
+    )
+
+    def __init__(
+        self,
+        data_memory,
+        input_buffer="",
+        output_buffer=None,
+        cache: Cache | None = None,
+        stack_depth: int = DEFAULT_STACK_DEPTH,
+    ):
+        """
+        data_memory -- Memory (см. memory.py) или начальное содержимое памяти (список слов, помещается в DenseMemory);
+        input_buffer -- источник ввода (см. devices.iter_chunks) или готовое InputDevice;
+        output_buffer -- OutputDevice, по умолчанию вывод накапливается в памяти;
+        cache -- модель кэша данных, None -- память без задержек;
+        stack_depth -- число ячеек стека данных. Стек выделяется заранее, SP вне [0, stack_depth) -- StackError.
+        """
+        self.data_memory: Memory = data_memory if isinstance(data_memory, Memory) else DenseMemory(data_memory)
 
         self.tos = 0
         self.tos1 = 0
         self.stack_pointer = 1
-        self.stack = [0, 0]
-
-        self.input_buffer: list[str] = input_buffer
-        self.output_buffer: list[str] = []
+        assert stack_depth >= 2, "Stack depth must be at least 2"
+        # список быстрее array('q'): чтение из array создает новый объект int при каждом обращении
+        self.stack: list[int] = [0] * stack_depth
+        self.stack_depth: int = stack_depth
+        # наибольшее значение SP за время работы
+        self.stack_high_water: int = self.stack_pointer
+
+        self.input_buffer: InputDevice = (
+            input_buffer if isinstance(input_buffer, InputDevice) else InputDevice(input_buffer)
+        )
+        self.output_buffer: OutputDevice = output_buffer if output_buffer is not None else OutputDevice()
+        self.cache: Cache | None = cache
+
+    def stall_ticks(self):
+        """Такты ожидания памяти данных."""
+        return self.cache.stall_ticks if self.cache is not None else 0
 
     def write_memory(self, data_address: int, value: int):
+        if self.cache is not None and data_address not in self.IO_ADDRESSES:
+            self.cache.access(data_address, write=True)
         self.data_memory[data_address] = value
         if data_address == self.WRITE_MEM_IO_MAPPING_CHAR:
             if value != 0:
-                self.output_buffer.append(chr(value))
+                self.output_buffer.write(chr(value))
         if data_address == self.WRITE_MEM_IO_MAPPING_INT:
-            self.output_buffer.append(str(value))
+            self.output_buffer.write(str(value))
 
     def read_memory(self, data_address: int):
         if data_address == self.READ_MEM_IO_MAPPING:
-            if len(self.input_buffer) <= 0:
-                res = 0  # EOF
-            else:
-                res = ord(self.input_buffer[0])
-                self.input_buffer = self.input_buffer[1::]
+            res = self.input_buffer.read()  # 0 -- EOF
         else:
+            if self.cache is not None and data_address not in self.IO_ADDRESSES:
+                self.cache.access(data_address)
             res = self.data_memory[data_address]
         assert isinstance(res, int), "Memory can contain only integers"
         return res
@@ -74,11 +127,13 @@ class DataPath:
         self.tos1 = value
 
     def latch_sp(self, value: int):
+        if not 0 <= value < self.stack_depth:
+            raise StackError("data", value, self.stack_depth)
+        if value > self.stack_high_water:
+            self.stack_high_water = value
         self.stack_pointer = value
 
     def write_from_tos(self):
-        while len(self.stack) <= self.stack_pointer:
-            self.stack.append(0)
         self.stack[self.stack_pointer] = self.tos
 
     def is_not_zero(self):
@@ -0,0 +1,161 @@
+"""Устройства ввода-вывода, отображенные в память (см. `DataPath.read_memory` и `DataPath.write_memory`).
+
+Устройство ввода читает поток символов порциями и выдает их по одному через курсор,
+поэтому ввод длины N читается за O(N), а в памяти одновременно находится не больше одной порции.
+
+Устройство вывода накапливает записанный текст в ограниченном буфере и сбрасывает его в приемник
+(stdout, файл, функцию обратного вызова, `asyncio.StreamWriter`). Без приемника весь вывод хранится в памяти --
+этот режим используется по умолчанию (и в golden-тестах).
+"""
+
+from __future__ import annotations
+
+import codecs
+import io
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BUFFER_SIZE = 4 * 1024
+
+
+def iter_chunks(source, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Порции текста из источника ввода.
+
+    Источник -- строка, `bytes` (UTF-8), список символов, файловый объект (текстовый или двоичный, в том числе pipe)
+    или итератор строк (например, генератор).
+    """
+    if isinstance(source, str):
+        yield source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source).decode("utf-8")
+    elif isinstance(source, list):
+        yield "".join(source)
+    elif hasattr(source, "read"):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while chunk := source.read(chunk_size):
+            yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        yield decoder.decode(b"", final=True)
+    else:
+        yield from source
+
+
+class InputDevice:
+    """Потоковое устройство ввода. Чтение после конца ввода возвращает 0 (EOF)."""
+
+    chunks = None
+    buffer = None
+    position = None
+    consumed = None
+
+    def __init__(self, source="", chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunks = iter_chunks(source, chunk_size)
+        self.buffer: str = ""
+        self.position: int = 0
+        # количество прочитанных символов (без учета EOF)
+        self.consumed: int = 0
+
+    def read(self):
+        """Код следующего символа или 0, если ввод закончился."""
+        if self.position >= len(self.buffer) and not self.fill():
+            return 0
+        char = self.buffer[self.position]
+        self.position += 1
+        self.consumed += 1
+        return ord(char)
+
+    def skip(self, count: int):
+        """Пропускает count символов (например, уже прочитанных до контрольной точки)."""
+        for _ in range(count):
+            if self.position >= len(self.buffer) and not self.fill():
+                return
+            self.position += 1
+            self.consumed += 1
+
+    def fill(self):
+        """Читает следующую непустую порцию. Возвращает False, если источник исчерпан."""
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer, self.position = chunk, 0
+                return True
+        self.buffer, self.position = "", 0
+        return False
+
+
+def sink_writer(sink):
+    """Функция записи строки в приемник вывода.
+
+    Приемник -- текстовый файловый объект (в том числе `sys.stdout`), двоичный файловый объект
+    или `asyncio.StreamWriter` (текст кодируется в UTF-8), либо функция от строки.
+    `StreamWriter.write` не блокирует, ожидать `drain()` должен владелец потока.
+    """
+    if hasattr(sink, "drain") or isinstance(sink, (io.RawIOBase, io.BufferedIOBase)):
+        return lambda text: sink.write(text.encode("utf-8"))
+    if hasattr(sink, "write"):
+        return sink.write
+    assert callable(sink), f"Unsupported output sink: {sink!r}"
+    return sink
+
+
+class OutputDevice:
+    """Устройство вывода с буфером на buffer_size символов.
+
+    Буфер сбрасывается в приемник при заполнении, при записи перевода строки (line_buffering) и в `flush`.
+    Без приемника (sink=None) вывод не сбрасывается и доступен целиком через `getvalue`.
+    """
+
+    sink = None
+    buffer_size = None
+    line_buffering = None
+    chunks = None
+    pending = None
+    written = None
+    capture = None
+
+    def __init__(self, sink=None, buffer_size: int = DEFAULT_BUFFER_SIZE, line_buffering: bool = False):
+        assert buffer_size > 0, "Buffer size must be positive"
+        self.sink = sink
+        self.buffer_size: int = buffer_size
+        self.line_buffering: bool = line_buffering
+        self._write = sink_writer(sink) if sink is not None else None
+        # несброшенный вывод (без приемника -- весь вывод)
+        self.chunks: list[str] = []
+        self.pending: int = 0
+        # количество записанных символов
+        self.written: int = 0
+        # копия вывода для условий остановки (см. StopConditions.start), None -- не нужна
+        self.capture: list[str] | None = None
+
+    def write(self, text: str):
+        self.chunks.append(text)
+        self.written += len(text)
+        if self.capture is not None:
+            self.capture.append(text)
+        if self._write is not None:
+            self.pending += len(text)
+            if self.pending >= self.buffer_size or (self.line_buffering and "\n" in text):
+                self.flush()
+
+    def flush(self):
+        """Сбрасывает буфер в приемник. Без приемника ничего не делает."""
+        if self._write is None:
+            return
+        if self.chunks:
+            self._write("".join(self.chunks))
+            self.chunks.clear()
+            self.pending = 0
+        if hasattr(self.sink, "flush"):
+            self.sink.flush()
+
+    def reset(self, text: str, written: int):
+        """
+        Заменяет содержимое устройства (восстановление из контрольной точки): text -- несброшенный вывод,
+         written -- число уже записанных символов. В приемник ничего не передается.
+        """
+        self.chunks[:] = [text] if text else []
+        self.pending = len(text) if self._write is not None else 0
+        self.written = written
+
+    def getvalue(self):
+        """Несброшенный вывод: без приемника -- весь вывод, после `flush` с приемником -- пустая строка."""
+        if len(self.chunks) > 1:
+            self.chunks[:] = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
@@ -20,12 +20,30 @@
 
 - `opcode` -- строка с кодом операции (тип: `Opcode`);
 - `arg` -- аргумент инструкции (если требуется);
+
+JSON остается отладочным форматом. Для больших программ есть компактный бинарный формат
+(`write_binary_data_and_code`), все числа в little-endian:
+
+- заголовок (`BINARY_HEADER`): сигнатура `BINARY_MAGIC`, версия формата, резерв,
+  размер памяти данных, количество инструкций, CRC32 всего, что идет после заголовка;
+- память данных -- массив int32;
+- коды операций -- по байту на инструкцию: номер `Opcode` в `BINARY_OPCODES`,
+  старший бит (`BINARY_HAS_ARG`) установлен, если у инструкции есть аргумент;
+- аргументы -- массив int32 (для инструкций без аргумента -- 0).
+
+`read_data_and_code` определяет формат по сигнатуре. Бинарный файл отображается в память (`mmap`),
+а инструкции декодируются лениво, при первом обращении (см. `BinaryCode`).
 """
 
 from __future__ import annotations
 
 import json
+import mmap
+import struct
+import zlib
+from collections.abc import Sequence
 from enum import Enum
+from typing import NamedTuple
 
 
 class Opcode(str, Enum):
@@ -55,14 +73,36 @@ class Opcode(str, Enum):
 
     HALT = "halt"
 
+    # Суперинструкции. Создаются транслятором при слиянии типовых последовательностей (см. FUSED_OPCODES)
+    LT = "lt"
+    GT = "gt"
+    EQ = "eq"
+    ADD_STORE = "add_store"
+    JZ = "jz"
+
     def __str__(self):
         return str(self.value)
 
 
-class Instruction:
-    def __init__(self, opcode: Opcode, arg: int | None = None):
-        self.opcode: Opcode = opcode
-        self.arg: int = arg
+# Инструкции, аргумент которых -- адрес в памяти команд
+BRANCH_OPCODES = (Opcode.JMP, Opcode.JNZ, Opcode.JZ, Opcode.CALL)
+
+# Суперинструкция -> последовательность инструкций, которую она заменяет.
+# Аргумент суперинструкции -- аргумент единственной инструкции последовательности, которой он нужен (LIT или JNZ).
+FUSED_OPCODES: dict[Opcode, tuple[Opcode, ...]] = {
+    Opcode.LT: (Opcode.SUB, Opcode.ISNEG),
+    Opcode.GT: (Opcode.SUB, Opcode.NEG, Opcode.ISNEG),
+    Opcode.EQ: (Opcode.SUB, Opcode.INV),
+    Opcode.ADD_STORE: (Opcode.LOAD, Opcode.ADD, Opcode.LIT, Opcode.STORE),
+    Opcode.JZ: (Opcode.INV, Opcode.JNZ),
+}
+
+
+class Instruction(NamedTuple):
+    """Инструкция машинного кода. Неизменяемая: для изменения аргумента создается новая (`_replace`)."""
+
+    opcode: Opcode
+    arg: int | None = None
 
     def __str__(self):
         return f"({self.opcode} {self.arg})"
@@ -71,6 +111,43 @@ class Instruction:
         return self.__str__()
 
 
+class ProgramImage(Sequence):
+    """Образ программы в виде структуры массивов: коды операций и аргументы по адресам.
+
+    Модели обращаются к массивам `opcodes` и `args` напрямую, без создания объектов инструкций.
+    Коды операций -- ссылки на члены `Opcode` (каждый существует в единственном экземпляре),
+    поэтому их можно сравнивать через `is`.
+    Индексация образа возвращает `Instruction` и нужна для совместимости (трассировка, сериализация).
+    """
+
+    __slots__ = ("args", "opcodes")
+
+    def __init__(self, opcodes: list[Opcode], args: list[int | None]):
+        assert len(opcodes) == len(args), "Opcodes and args must have the same length"
+        self.opcodes: list[Opcode] = opcodes
+        self.args: list[int | None] = args
+
+    @classmethod
+    def from_code(cls, code):
+        """Образ из списка инструкций, `BinaryCode` или другого образа (возвращается как есть)."""
+        if isinstance(code, cls):
+            return code
+        if isinstance(code, BinaryCode):
+            return code.image()
+        return cls([instr.opcode for instr in code], [instr.arg for instr in code])
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, address):
+        if isinstance(address, slice):
+            return [Instruction(opcode, arg) for opcode, arg in zip(self.opcodes[address], self.args[address])]
+        return Instruction(self.opcodes[address], self.args[address])
+
+    def __iter__(self):
+        return map(Instruction, self.opcodes, self.args)
+
+
 def write_data_and_code(filename, data: list[int | str], code: list[Instruction]):
     with open(filename, "w", encoding="utf-8") as file:
         file.write('{\n        "data":')
@@ -88,7 +165,105 @@ def write_data_and_code(filename, data: list[int | str], code: list[Instruction]
         file.write("\n}")
 
 
+BINARY_MAGIC = b"FTHB"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHIII")
+BINARY_HAS_ARG = 0x80
+BINARY_WORD = struct.Struct("<i")
+
+# Номер кода операции в бинарном формате. Новые коды операций добавляются только в конец Opcode,
+# иначе нужно повышать BINARY_VERSION.
+BINARY_OPCODES: tuple[Opcode, ...] = tuple(Opcode)
+BINARY_OPCODE_NUMBERS: dict[Opcode, int] = {opcode: number for number, opcode in enumerate(BINARY_OPCODES)}
+
+
+def write_binary_data_and_code(filename, data: list[int], code: list[Instruction]):
+    opcodes = bytearray()
+    args = []
+    for instr in code:
+        has_arg = isinstance(instr.arg, int)
+        opcodes.append(BINARY_OPCODE_NUMBERS[instr.opcode] | (BINARY_HAS_ARG if has_arg else 0))
+        args.append(instr.arg if has_arg else 0)
+    for word in (*data, *args):
+        assert -(2**31) <= word < 2**31, f"Value {word} does not fit into int32"
+
+    payload = struct.pack(f"<{len(data)}i", *data) + bytes(opcodes) + struct.pack(f"<{len(args)}i", *args)
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(data), len(code), zlib.crc32(payload))
+    with open(filename, "wb") as file:
+        file.write(header + payload)
+
+
+class BinaryCode(Sequence):
+    """Машинный код в отображенном в память бинарном файле.
+
+    Инструкция декодируется при первом обращении по адресу и кэшируется.
+    """
+
+    buffer = None
+    opcodes_offset = None
+    args_offset = None
+    length = None
+    decoded = None
+
+    def __init__(self, buffer, opcodes_offset: int, length: int):
+        self.buffer = buffer
+        self.opcodes_offset: int = opcodes_offset
+        self.args_offset: int = opcodes_offset + length
+        self.length: int = length
+        self.decoded: list[Instruction | None] = [None] * length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, address):
+        if isinstance(address, slice):
+            return [self[i] for i in range(*address.indices(self.length))]
+        instr = self.decoded[address]
+        if instr is None:
+            address %= self.length
+            byte = self.buffer[self.opcodes_offset + address]
+            arg = None
+            if byte & BINARY_HAS_ARG:
+                (arg,) = BINARY_WORD.unpack_from(self.buffer, self.args_offset + address * BINARY_WORD.size)
+            instr = Instruction(BINARY_OPCODES[byte & ~BINARY_HAS_ARG], arg)
+            self.decoded[address] = instr
+        return instr
+
+    def image(self):
+        """Декодирует весь код сразу в `ProgramImage` (без создания объектов инструкций)."""
+        opcode_bytes = self.buffer[self.opcodes_offset : self.args_offset]
+        words = struct.unpack_from(f"<{self.length}i", self.buffer, self.args_offset)
+        opcodes = [BINARY_OPCODES[byte & ~BINARY_HAS_ARG] for byte in opcode_bytes]
+        args = [word if byte & BINARY_HAS_ARG else None for byte, word in zip(opcode_bytes, words)]
+        return ProgramImage(opcodes, args)
+
+
+def is_binary_file(filename):
+    with open(filename, "rb") as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def read_binary_data_and_code(filename):
+    with open(filename, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    assert len(buffer) >= BINARY_HEADER.size, "Binary file is too short"
+    magic, version, _, data_size, code_size, checksum = BINARY_HEADER.unpack_from(buffer)
+    assert magic == BINARY_MAGIC, "Not a binary machine code file"
+    assert version == BINARY_VERSION, f"Unsupported binary format version {version}"
+    opcodes_offset = BINARY_HEADER.size + data_size * BINARY_WORD.size
+    assert len(buffer) == opcodes_offset + code_size * (1 + BINARY_WORD.size), "Binary file size mismatch"
+    assert zlib.crc32(memoryview(buffer)[BINARY_HEADER.size :]) == checksum, "Binary file checksum mismatch"
+
+    # память данных изменяется моделью, поэтому копируется в список
+    data = list(struct.unpack_from(f"<{data_size}i", buffer, BINARY_HEADER.size))
+    return data, BinaryCode(buffer, opcodes_offset, code_size)
+
+
 def read_data_and_code(filename):
+    if is_binary_file(filename):
+        return read_binary_data_and_code(filename)
+
     with open(filename, encoding="utf-8") as file:
         file = json.loads(file.read())
 
@@ -96,8 +271,10 @@ def read_data_and_code(filename):
     for d in file["data"]:
         data.append(d)
 
-    program_code = []
+    opcodes = []
+    args = []
     for instr in file["code"]:
-        program_code.append(Instruction(Opcode(instr["opcode"]), instr["arg"] if "arg" in instr else None))
+        opcodes.append(Opcode(instr["opcode"]))
+        args.append(instr["arg"] if "arg" in instr else None)
 
-    return data, program_code
+    return data, ProgramImage(opcodes, args)
@@ -0,0 +1,241 @@
+"""Basic-block JIT для hardwired модели (движок `jit` в `machine_hw`).
+
+Программа разбивается на базовые блоки -- линейные участки, которые заканчиваются инструкцией перехода
+(`JMP`, `JNZ`, `JZ`, `CALL`, `RET`) или перед `HALT` и перед началом другого блока (адресом перехода).
+Для каждого блока генерируется исходный код отдельной функции, которая компилируется `compile`/`exec`:
+
+- TOS, TOS1 и SP хранятся в локальных переменных и записываются в `DataPath` один раз, при выходе из блока.
+  Если обращение к памяти завершилось исключением, записываются также PC и такты предыдущих инструкций блока --
+  состояние совпадает с движком dispatch;
+- изменения SP и указателя стека возвратов внутри блока известны при компиляции, поэтому границы стеков
+  проверяются перед входом в блок (`Block.fits`). Блок, который вышел бы за них, исполняется по одной инструкции,
+  и StackError возникает на той же инструкции и в том же состоянии, что и в движке dispatch;
+- операции АЛУ берутся из `ALU.SIGNAL_TO_OPERATION`, обращения к памяти идут через `DataPath`;
+- функция возвращает адрес следующей инструкции, такты всего блока начисляются моделью одной константой.
+
+Блок компилируется при первом входе в него и кэшируется для программы (`block_cache`).
+Если исполнение оказалось в середине блока (после пошагового исполнения), модель исполняет инструкции
+по одной до начала следующего блока.
+Кэш привязан к содержимому программы и стоимостям инструкций, поэтому при изменении кода он не используется повторно.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import NamedTuple
+
+from data_path import ALU
+from isa import BRANCH_OPCODES, FUSED_OPCODES, Opcode, ProgramImage
+from signals import Signal
+
+# Сколько программ хранится в кэше блоков одновременно
+CACHE_SIZE = 16
+
+# Запись TOS в стек (DataPath.write_from_tos). Границы стека проверяются до входа в блок
+WRITE_FROM_TOS = ("stack[sp] = tos",)
+
+ALU_OPERATIONS = {
+    Opcode.ADD: Signal.SumALU,
+    Opcode.SUB: Signal.SubALU,
+    Opcode.AND: Signal.AndALU,
+    Opcode.OR: Signal.OrALU,
+    Opcode.INV: Signal.InvertRightALU,
+    Opcode.NEG: Signal.NegALU,
+    Opcode.ISNEG: Signal.ISNEG,
+}
+
+# Исходный код инструкций, не изменяющих PC. Повторяет обработчики execute_* движка dispatch
+DATA_SOURCE: dict[Opcode, tuple[str, ...]] = {
+    Opcode.NOP: (),
+    Opcode.LIT: ("tos = {arg}", "tos1 = stack[sp]", "sp += 1", *WRITE_FROM_TOS),
+    Opcode.LOAD: ("tos = dp.read_memory(tos)", *WRITE_FROM_TOS),
+    Opcode.STORE: (
+        "dp.write_memory(tos, tos1)",
+        "sp -= 2",
+        "tos = stack[sp]",
+        "sp -= 1",
+        "tos1 = stack[sp]",
+        "sp += 1",
+    ),
+    Opcode.DUP: ("sp += 1", *WRITE_FROM_TOS, "tos1 = stack[sp]"),
+    Opcode.OVER: ("tos = tos1", "tos1 = stack[sp]", "sp += 1", *WRITE_FROM_TOS),
+    **{
+        opcode: ("tos = alu_{signal}(tos1, tos)", "sp -= 1", *WRITE_FROM_TOS, "sp -= 1", "tos1 = stack[sp]", "sp += 1")
+        for opcode in (Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR)
+    },
+    **{opcode: ("tos = alu_{signal}(0, tos)", *WRITE_FROM_TOS) for opcode in (Opcode.INV, Opcode.NEG, Opcode.ISNEG)},
+}
+
+# Исходный код переходов. Адрес следующей инструкции записывается в target
+BRANCH_SOURCE: dict[Opcode, tuple[str, ...]] = {
+    Opcode.JMP: ("target = {arg}",),
+    Opcode.JNZ: (
+        "target = {arg} if tos != 0 else {next}",
+        "sp -= 1",
+        "tos = stack[sp]",
+        "sp -= 1",
+        "tos1 = stack[sp]",
+        "sp += 1",
+    ),
+    Opcode.CALL: ("cu.push_return_stack({next})", "target = {arg}"),
+    Opcode.RET: ("target = cu.return_stack[cu.return_stack_pointer]", "cu.pop_return_stack()"),
+}
+
+NAMESPACE = {f"alu_{signal.name}": operation for signal, operation in ALU.SIGNAL_TO_OPERATION.items()}
+
+
+class Block(NamedTuple):
+    """Скомпилированный базовый блок: функция f(cu, dp) -> адрес следующей инструкции."""
+
+    function: object
+    start: int
+    # количество инструкций и тактов блока
+    length: int
+    cost: int
+    # насколько SP и указатель стека возвратов опускаются ниже и поднимаются выше своих значений при входе в блок
+    stack_low: int = 0
+    stack_high: int = 0
+    return_low: int = 0
+    return_high: int = 0
+
+    def fits(self, cu):
+        """Остаются ли указатели стеков внутри стеков на всем протяжении блока."""
+        dp = cu.data_path
+        return (
+            self.stack_low <= dp.stack_pointer < dp.stack_depth - self.stack_high
+            and self.return_low <= cu.return_stack_pointer < cu.return_stack_depth - self.return_high
+        )
+
+    def crosses(self, breakpoints: frozenset[int]):
+        """Есть ли точка останова на одной из инструкций блока (блок HALT занимает свой адрес)."""
+        return not breakpoints.isdisjoint(range(self.start, self.start + max(self.length, 1)))
+
+
+def is_control_flow(opcode: Opcode):
+    return opcode in BRANCH_SOURCE or FUSED_OPCODES.get(opcode, ())[-1:] == (Opcode.JNZ,)
+
+
+def find_leaders(program: ProgramImage):
+    """Адреса начала базовых блоков: адреса переходов и инструкции, следующие за переходами."""
+    leaders = {0}
+    for address, opcode in enumerate(program.opcodes):
+        if opcode is Opcode.HALT or is_control_flow(opcode):
+            leaders.add(address + 1)
+        if opcode in BRANCH_OPCODES:
+            leaders.add(program.args[address])
+    return leaders
+
+
+def stack_offsets(lines: list[str]):
+    """Наименьшее и наибольшее смещение SP в исходном коде блока (строки вида `sp += n` / `sp -= n`)."""
+    offset = low = high = 0
+    for line in lines:
+        if line.startswith(("sp += ", "sp -= ")):
+            offset += int(line[6:]) if line[3] == "+" else -int(line[6:])
+            low, high = min(low, offset), max(high, offset)
+    return -low, high
+
+
+def instruction_source(opcode: Opcode, arg, next_address: int):
+    """Исходный код инструкции (суперинструкция разворачивается в составляющие)."""
+    lines = []
+    for component in FUSED_OPCODES.get(opcode, (opcode,)):
+        signal = ALU_OPERATIONS[component].name if component in ALU_OPERATIONS else None
+        template = DATA_SOURCE[component] if component in DATA_SOURCE else BRANCH_SOURCE[component]
+        lines.extend(line.format(arg=repr(arg), next=next_address, signal=signal) for line in template)
+    return lines
+
+
+class BlockCache:
+    program = None
+    tick_costs = None
+    leaders = None
+    blocks = None
+
+    def __init__(self, program: ProgramImage, tick_costs: dict[Opcode, int]):
+        self.program: ProgramImage = program
+        self.tick_costs: dict[Opcode, int] = tick_costs
+        self.leaders: set[int] = find_leaders(program)
+        self.blocks: dict[int, Block] = {}
+
+    def block(self, start: int):
+        """Блок, начинающийся с адреса start. None, если start -- не начало базового блока."""
+        block = self.blocks.get(start)
+        if block is None and start in self.leaders:
+            block = self.blocks[start] = self.compile(start)
+        return block
+
+    def compile(self, start: int):
+        opcodes, args = self.program.opcodes, self.program.args
+        if opcodes[start] is Opcode.HALT:
+            return Block(self.define(start, ["raise StopIteration"]), start, 0, 0)
+
+        lines = []
+        address = start
+        cost = 0
+        target = None
+        # такты инструкций блока до каждой инструкции, обращающейся к памяти (она может завершиться исключением)
+        costs_before = {}
+        while True:
+            opcode = opcodes[address]
+            source = instruction_source(opcode, args[address], address + 1)
+            if any("dp." in line for line in source):
+                costs_before[address] = cost
+                lines.append(f"at = {address}")
+            lines.extend(source)
+            cost += self.tick_costs[opcode]
+            address += 1
+            if is_control_flow(opcode):
+                target = "target"
+                break
+            if address == len(opcodes) or address in self.leaders or opcodes[address] is Opcode.HALT:
+                break
+        stack_low, stack_high = stack_offsets(lines)
+        # переход -- последняя инструкция блока, поэтому стек возвратов меняется не больше чем на 1
+        last = FUSED_OPCODES.get(opcode, (opcode,))[-1]
+        return_low, return_high = int(last is Opcode.RET), int(last is Opcode.CALL)
+        prologue = ["tos, tos1, sp, stack = dp.tos, dp.tos1, dp.stack_pointer, dp.stack"]
+        if stack_high:
+            # DataPath.latch_sp учитывает наибольшее значение SP
+            prologue += [
+                f"if sp + {stack_high} > dp.stack_high_water:",
+                f"    dp.stack_high_water = sp + {stack_high}",
+            ]
+        # при исключении состояние -- как у движка dispatch: PC и такты до инструкции, вызвавшей его
+        fault = ["cu.program_counter = at", f"cu.set_current_tick(cu.current_tick() + {costs_before}[at])"]
+        lines = [
+            *prologue,
+            "try:",
+            *(f"    {line}" for line in lines or ["pass"]),
+            "except BaseException:",
+            *(f"    {line}" for line in fault if costs_before),
+            "    raise",
+            "finally:",
+            "    dp.tos, dp.tos1, dp.stack_pointer = tos, tos1, sp",
+            f"return {target or address}",
+        ]
+        return Block(
+            self.define(start, lines), start, address - start, cost, stack_low, stack_high, return_low, return_high
+        )
+
+    @staticmethod
+    def define(start: int, lines: list[str]):
+        source = "\n".join([f"def block_{start}(cu, dp):", *(f"    {line}" for line in lines)])
+        namespace = dict(NAMESPACE)
+        exec(compile(source, f"<jit block {start}>", "exec"), namespace)
+        return namespace[f"block_{start}"]
+
+
+_caches: OrderedDict[tuple, BlockCache] = OrderedDict()
+
+
+def block_cache(program: ProgramImage, tick_costs: dict[Opcode, int]):
+    """Кэш блоков для программы. Ключ -- содержимое программы и стоимости инструкций."""
+    key = (tuple(program.opcodes), tuple(program.args), tuple(tick_costs.items()))
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = BlockCache(program, tick_costs)
+        if len(_caches) > CACHE_SIZE:
+            _caches.popitem(last=False)
+    _caches.move_to_end(key)
+    return cache
@@ -1,13 +1,33 @@
 from __future__ import annotations
 
+import argparse
 import logging
 import sys
-
-from data_path import DataPath
-from isa import Instruction, Opcode, read_data_and_code
+from functools import partial
+from typing import ClassVar
+
+from cache import Cache, add_cache_arguments, cache_from_args
+from data_path import ALU, DEFAULT_RETURN_STACK_DEPTH, DEFAULT_STACK_DEPTH, DataPath, StackError
+from devices import OutputDevice
+from isa import FUSED_OPCODES, Instruction, Opcode, ProgramImage, read_data_and_code
+from jit import block_cache
+from memory import add_memory_arguments, make_memory
 from signals import Signal
-
-logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.DEBUG)
+from source_map import LazySourceMap, SourceMap, find_source_map
+from stop_conditions import (
+    DEFAULT_INSTRUCTION_LIMIT,
+    STOP_MESSAGES,
+    BreakpointReachedError,
+    StopConditions,
+    StopReason,
+    add_stop_arguments,
+    stop_conditions_from_args,
+)
+from tracing import DEFAULT_TRACE_DEPTH, TraceLevel, Tracer
+
+ENGINES = ("interpret", "dispatch", "jit")
+# Таблицы тактов: hw -- такты Hardwired модели, mc -- такты Microcoded модели (по длине микрокода)
+TICK_MODELS = ("hw", "mc")
 
 
 class ControlUnit:
@@ -16,29 +36,146 @@ class ControlUnit:
     data_path = None
     return_stack = None
     return_stack_pointer = None
+    return_stack_depth = None
+    return_stack_high_water = None
     _tick = None
-
-    def __init__(self, program: list[Instruction], data_path: DataPath):
-        self.program: list[Instruction] = program
+    engine = None
+    handlers = None
+    costs = None
+    blocks = None
+    tick_costs = None
+    tick_model = None
+    tracer = None
+    stop_reason = None
+    source_map = None
+    instruction_cache = None
+
+    # Количество тактов каждой инструкции. Совпадает с числом вызовов tick() в decode_and_execute_instruction.
+    TICK_COSTS: ClassVar[dict[Opcode, int]] = {
+        Opcode.NOP: 0,
+        Opcode.LIT: 4,
+        Opcode.LOAD: 2,
+        Opcode.STORE: 7,
+        Opcode.DUP: 3,
+        Opcode.OVER: 4,
+        Opcode.ADD: 6,
+        Opcode.SUB: 6,
+        Opcode.AND: 6,
+        Opcode.OR: 6,
+        Opcode.INV: 2,
+        Opcode.NEG: 2,
+        Opcode.ISNEG: 2,
+        Opcode.JMP: 1,
+        Opcode.JNZ: 6,
+        Opcode.CALL: 2,
+        Opcode.RET: 2,
+        Opcode.HALT: 0,
+    }
+
+    ALU_TWO_ARG_SIGNALS: ClassVar[dict[Opcode, Signal]] = {
+        Opcode.ADD: Signal.SumALU,
+        Opcode.SUB: Signal.SubALU,
+        Opcode.AND: Signal.AndALU,
+        Opcode.OR: Signal.OrALU,
+    }
+
+    ALU_ONE_ARG_SIGNALS: ClassVar[dict[Opcode, Signal]] = {
+        Opcode.INV: Signal.InvertRightALU,
+        Opcode.NEG: Signal.NegALU,
+        Opcode.ISNEG: Signal.ISNEG,
+    }
+
+    def __init__(
+        self,
+        program: ProgramImage | list[Instruction],
+        data_path: DataPath,
+        engine: str = "interpret",
+        trace_level: TraceLevel = TraceLevel.OFF,
+        trace_depth: int = DEFAULT_TRACE_DEPTH,
+        fused_tick_costs: dict[Opcode, int] | None = None,
+        instruction_cache: Cache | None = None,
+        return_stack_depth: int = DEFAULT_RETURN_STACK_DEPTH,
+        source_map: SourceMap | LazySourceMap | None = None,
+        tick_model: str = "hw",
+    ):
+        """
+        fused_tick_costs -- стоимость суперинструкций в тактах.
+         По умолчанию равна сумме стоимостей составляющих инструкций, то есть слияние не меняет число тактов.
+        instruction_cache -- модель кэша команд, получает адрес каждой выбираемой инструкции.
+        return_stack_depth -- число ячеек стека возвратов (выделяется заранее).
+        source_map -- карта исходного кода: позиция в исходном коде для сообщений об остановке и ошибках.
+        tick_model -- таблица тактов движков dispatch и jit: `hw` (TICK_COSTS) или `mc` -- такты Microcoded модели
+         (MicrocodedControlUnit.TICK_COSTS), тогда результат совпадает с machine_mc по тактам при скорости jit.
+         Движок interpret считает такты вызовами tick() и поддерживает только `hw`.
+        """
+        assert engine in ENGINES, f"Unknown engine: {engine}"
+        assert tick_model in TICK_MODELS, f"Unknown tick model: {tick_model}"
+        assert tick_model == "hw" or engine != "interpret", "Interpret engine counts hardwired ticks only"
+        self.program: ProgramImage = ProgramImage.from_code(program)
         self.program_counter: int = 0
         self.data_path: DataPath = data_path
-        self.return_stack: list[int] = [0]
+        self.return_stack: list[int] = [0] * return_stack_depth
         self.return_stack_pointer: int = 0
+        self.return_stack_depth: int = return_stack_depth
+        self.return_stack_high_water: int = 0
         self._tick: int = 0
+        self.engine: str = engine
+        self.tick_model: str = tick_model
+        if tick_model == "mc":
+            # микрокод строится при импорте machine_mc -- только когда нужна его таблица тактов
+            from machine_mc import ControlUnit as MicrocodedControlUnit
+
+            base_costs = MicrocodedControlUnit.TICK_COSTS
+        else:
+            base_costs = {
+                **self.TICK_COSTS,
+                **{fused: sum(self.TICK_COSTS[op] for op in ops) for fused, ops in FUSED_OPCODES.items()},
+            }
+        self.tick_costs: dict[Opcode, int] = {**base_costs, **(fused_tick_costs or {})}
+        self.tracer: Tracer = Tracer(self.format_state, trace_level, trace_depth)
+        self.instruction_cache: Cache | None = instruction_cache
+        self.source_map: SourceMap | LazySourceMap | None = source_map
+        if engine in ("dispatch", "jit"):
+            self.handlers, self.costs = self.decode_program()
+            if instruction_cache is not None:
+                self.handlers = [partial(self.execute_fetched, pc, handler) for pc, handler in enumerate(self.handlers)]
+        if engine == "jit":
+            self.blocks = block_cache(self.program, self.tick_costs)
 
     def tick(self):
         self._tick += 1
 
     def current_tick(self):
-        return self._tick
-
-    def decode_and_execute_control_flow_instruction(self, instruction: Instruction):
-        if instruction.opcode is Opcode.HALT:
+        """Такты модели с учетом ожидания памяти данных и памяти команд."""
+        fetch_ticks = self.instruction_cache.stall_ticks if self.instruction_cache is not None else 0
+        return self._tick + self.data_path.stall_ticks() + fetch_ticks
+
+    def set_current_tick(self, ticks: int):
+        """Устанавливает счетчик тактов так, чтобы current_tick() вернул ticks (при текущем ожидании памяти)."""
+        self._tick = 0
+        self._tick = ticks - self.current_tick()
+
+    def push_return_stack(self, address: int):
+        if self.return_stack_pointer + 1 >= self.return_stack_depth:
+            raise StackError("return", self.return_stack_pointer + 1, self.return_stack_depth)
+        self.return_stack_pointer += 1
+        if self.return_stack_pointer > self.return_stack_high_water:
+            self.return_stack_high_water = self.return_stack_pointer
+        self.return_stack[self.return_stack_pointer] = address
+
+    def pop_return_stack(self):
+        """Снимает адрес возврата. Ячейка 0 -- дно стека, возврат без вызова -- StackError."""
+        if self.return_stack_pointer == 0:
+            raise StackError("return", -1, self.return_stack_depth)
+        self.return_stack_pointer -= 1
+
+    def decode_and_execute_control_flow_instruction(self, opcode: Opcode):
+        if opcode is Opcode.HALT:
             raise StopIteration()
 
-        if instruction.opcode is Opcode.JNZ:
+        if opcode is Opcode.JNZ:
             self.program_counter = (
-                self.program[self.program_counter].arg if self.data_path.is_not_zero() else self.program_counter + 1
+                self.program.args[self.program_counter] if self.data_path.is_not_zero() else self.program_counter + 1
             )
             self.tick()
 
@@ -67,35 +204,30 @@ class ControlUnit:
             self.tick()
             return True
 
-        if instruction.opcode is Opcode.JMP:
-            self.program_counter = self.program[self.program_counter].arg
+        if opcode is Opcode.JMP:
+            self.program_counter = self.program.args[self.program_counter]
             self.tick()
             return True
 
-        if instruction.opcode is Opcode.CALL:
-            self.return_stack_pointer += 1
-            # наличие ветвления - особенность модели
-            if len(self.return_stack) > self.return_stack_pointer:  # если элемент уже был
-                self.return_stack[self.return_stack_pointer] = self.program_counter + 1
-            else:  # если надо увеличить размер стека
-                self.return_stack.append(self.program_counter + 1)
+        if opcode is Opcode.CALL:
+            self.push_return_stack(self.program_counter + 1)
             self.tick()
 
-            self.program_counter = self.program[self.program_counter].arg
+            self.program_counter = self.program.args[self.program_counter]
             self.tick()
             return True
 
-        if instruction.opcode is Opcode.RET:
+        if opcode is Opcode.RET:
             self.program_counter = self.return_stack[self.return_stack_pointer]
             self.tick()
 
-            self.return_stack_pointer -= 1
+            self.pop_return_stack()
             self.tick()
             return True
 
         return False
 
-    def alu_two_arg_instruction(self, instruction: Instruction):
+    def alu_two_arg_instruction(self, opcode: Opcode):
         """
         Объединяет alu-specific инструкции с двумя аргументами.
          Не соответствует варианту с микрокодом, ведь в нем нет поддержки прыжков по микро-инструкциям.
@@ -103,13 +235,7 @@ class ControlUnit:
         alu_left = self.data_path.tos1
         alu_right = self.data_path.tos
 
-        signal = {
-            Opcode.ADD: Signal.SumALU,
-            Opcode.SUB: Signal.SubALU,
-            Opcode.AND: Signal.AndALU,
-            Opcode.OR: Signal.OrALU,
-        }
-        alu_res = self.data_path.alu.run(signal[instruction.opcode], alu_left, alu_right)
+        alu_res = self.data_path.alu.run(self.ALU_TWO_ARG_SIGNALS[opcode], alu_left, alu_right)
 
         self.data_path.latch_tos(alu_res)
         self.tick()
@@ -138,7 +264,7 @@ class ControlUnit:
         self.data_path.latch_sp(alu_res)
         self.tick()
 
-    def alu_one_arg_instruction(self, instruction: Instruction):
+    def alu_one_arg_instruction(self, opcode: Opcode):
         """
         Объединяет alu-specific инструкции с одним аргументом.
          Не соответствует варианту с микрокодом, ведь в нем нет поддержки прыжков по микро-инструкциям.
@@ -146,12 +272,7 @@ class ControlUnit:
         alu_left = 0
         alu_right = self.data_path.tos
 
-        signal = {
-            Opcode.INV: Signal.InvertRightALU,
-            Opcode.NEG: Signal.NegALU,
-            Opcode.ISNEG: Signal.ISNEG,
-        }
-        alu_res = self.data_path.alu.run(signal[instruction.opcode], alu_left, alu_right)
+        alu_res = self.data_path.alu.run(self.ALU_ONE_ARG_SIGNALS[opcode], alu_left, alu_right)
 
         self.data_path.latch_tos(alu_res)
         self.tick()
@@ -159,13 +280,13 @@ class ControlUnit:
         self.data_path.write_from_tos()
         self.tick()
 
-    def memory_instruction(self, instruction: Instruction):
-        if instruction.opcode == Opcode.LOAD:
+    def memory_instruction(self, opcode: Opcode):
+        if opcode is Opcode.LOAD:
             self.data_path.latch_tos(self.data_path.read_memory(self.data_path.tos))
             self.tick()
             self.data_path.write_from_tos()
             self.tick()
-        if instruction.opcode == Opcode.STORE:
+        if opcode is Opcode.STORE:
             self.data_path.write_memory(self.data_path.tos, self.data_path.tos1)
             self.tick()
 
@@ -199,8 +320,8 @@ class ControlUnit:
             self.data_path.latch_sp(alu_res)
             self.tick()
 
-    def stack_instruction(self, instruction: Instruction):
-        if instruction.opcode == Opcode.DUP:
+    def stack_instruction(self, opcode: Opcode):
+        if opcode is Opcode.DUP:
             alu_left = +1
             alu_right = self.data_path.stack_pointer
             alu_res = self.data_path.alu.run(Signal.SumALU, alu_left, alu_right)
@@ -212,7 +333,7 @@ class ControlUnit:
 
             self.data_path.latch_tos1(self.data_path.stack[self.data_path.stack_pointer])
             self.tick()
-        if instruction.opcode == Opcode.OVER:
+        if opcode is Opcode.OVER:
             alu_left = self.data_path.tos1
             alu_right = 0
             alu_res = self.data_path.alu.run(Signal.SumALU, alu_left, alu_right)
@@ -231,12 +352,36 @@ class ControlUnit:
             self.data_path.write_from_tos()
             self.tick()
 
-    def decode_and_execute_instruction(self, instruction: Instruction):  # noqa: C901
-        if self.decode_and_execute_control_flow_instruction(instruction):
+    def decode_and_execute_instruction(self, opcode: Opcode):
+        if opcode in FUSED_OPCODES:
+            self.fused_instruction(opcode)
             return
 
-        if instruction.opcode == Opcode.LIT:
-            self.data_path.latch_tos(self.program[self.program_counter].arg)
+        if self.decode_and_execute_control_flow_instruction(opcode):
+            return
+
+        self.data_instruction(opcode)
+        self.program_counter += 1
+
+    def fused_instruction(self, opcode: Opcode):
+        """
+        Суперинструкция исполняется как последовательность составляющих ее инструкций без их выборки.
+         Аргумент составляющие инструкции берут из самой суперинструкции (program.args[program_counter]).
+         Итоговая стоимость в тактах берется из tick_costs.
+        """
+        start_tick = self._tick
+        jumped = False
+        for component in FUSED_OPCODES[opcode]:
+            jumped = self.decode_and_execute_control_flow_instruction(component)
+            if not jumped:
+                self.data_instruction(component)
+        self._tick = start_tick + self.tick_costs[opcode]
+        if not jumped:
+            self.program_counter += 1
+
+    def data_instruction(self, opcode: Opcode):
+        if opcode is Opcode.LIT:
+            self.data_path.latch_tos(self.program.args[self.program_counter])
             self.tick()
 
             self.data_path.latch_tos1(self.data_path.stack[self.data_path.stack_pointer])
@@ -251,53 +396,271 @@ class ControlUnit:
             self.data_path.write_from_tos()
             self.tick()
 
-        elif instruction.opcode in (Opcode.LOAD, Opcode.STORE):
-            self.memory_instruction(instruction)
+        elif opcode in (Opcode.LOAD, Opcode.STORE):
+            self.memory_instruction(opcode)
 
-        elif instruction.opcode in (Opcode.DUP, Opcode.OVER):
-            self.stack_instruction(instruction)
+        elif opcode in (Opcode.DUP, Opcode.OVER):
+            self.stack_instruction(opcode)
 
-        elif instruction.opcode in (Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR):
-            self.alu_two_arg_instruction(instruction)
+        elif opcode in (Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR):
+            self.alu_two_arg_instruction(opcode)
 
-        elif instruction.opcode in (Opcode.INV, Opcode.NEG, Opcode.ISNEG):
-            self.alu_one_arg_instruction(instruction)
+        elif opcode in (Opcode.INV, Opcode.NEG, Opcode.ISNEG):
+            self.alu_one_arg_instruction(opcode)
 
-        elif instruction.opcode == Opcode.HALT:
+        elif opcode is Opcode.HALT:
             raise StopIteration()
 
-        self.program_counter += 1
-
-    def run(self, limit):
+    def decode_program(self):
+        """
+        Однократно декодирует программу в таблицу обработчиков (движок dispatch).
+         Аргумент инструкции привязывается к обработчику заранее, стоимость в тактах берется из tick_costs.
+         Обработчик возвращает True, если сам изменил PC.
+        """
+        handlers = []
+        costs = []
+        for instruction in self.program:
+            handlers.append(self.decode_instruction(instruction))
+            costs.append(self.tick_costs[instruction.opcode])
+        return handlers, costs
+
+    def decode_instruction(self, instruction: Instruction):
+        opcode = instruction.opcode
+        if opcode in FUSED_OPCODES:
+            components = (self.decode_instruction(Instruction(op, instruction.arg)) for op in FUSED_OPCODES[opcode])
+            return partial(self.execute_fused, tuple(components))
+        if opcode in self.ALU_TWO_ARG_SIGNALS:
+            return partial(self.execute_alu_two_arg, ALU.SIGNAL_TO_OPERATION[self.ALU_TWO_ARG_SIGNALS[opcode]])
+        if opcode in self.ALU_ONE_ARG_SIGNALS:
+            return partial(self.execute_alu_one_arg, ALU.SIGNAL_TO_OPERATION[self.ALU_ONE_ARG_SIGNALS[opcode]])
+        handler = getattr(self, f"execute_{opcode.name.lower()}")
+        if opcode in (Opcode.LIT, Opcode.JMP, Opcode.JNZ, Opcode.CALL):
+            return partial(handler, instruction.arg)
+        return handler
+
+    def execute_fused(self, handlers):
+        jumped = None
+        for handler in handlers:
+            jumped = handler()
+        return jumped
+
+    def execute_nop(self):
+        pass
+
+    def execute_halt(self):
+        raise StopIteration()
+
+    def execute_lit(self, arg):
+        dp = self.data_path
+        dp.latch_tos(arg)
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer + 1)
+        dp.write_from_tos()
+
+    def execute_load(self):
+        dp = self.data_path
+        dp.latch_tos(dp.read_memory(dp.tos))
+        dp.write_from_tos()
+
+    def execute_store(self):
+        dp = self.data_path
+        dp.write_memory(dp.tos, dp.tos1)
+        dp.latch_sp(dp.stack_pointer - 2)
+        dp.latch_tos(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer - 1)
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer + 1)
+
+    def execute_dup(self):
+        dp = self.data_path
+        dp.latch_sp(dp.stack_pointer + 1)
+        dp.write_from_tos()
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+
+    def execute_over(self):
+        dp = self.data_path
+        dp.latch_tos(dp.tos1)
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer + 1)
+        dp.write_from_tos()
+
+    def execute_alu_two_arg(self, operation):
+        dp = self.data_path
+        dp.latch_tos(operation(dp.tos1, dp.tos))
+        dp.latch_sp(dp.stack_pointer - 1)
+        dp.write_from_tos()
+        dp.latch_sp(dp.stack_pointer - 1)
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer + 1)
+
+    def execute_alu_one_arg(self, operation):
+        dp = self.data_path
+        dp.latch_tos(operation(0, dp.tos))
+        dp.write_from_tos()
+
+    def execute_jmp(self, arg):
+        self.program_counter = arg
+        return True
+
+    def execute_jnz(self, arg):
+        dp = self.data_path
+        self.program_counter = arg if dp.is_not_zero() else self.program_counter + 1
+        dp.latch_sp(dp.stack_pointer - 1)
+        dp.latch_tos(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer - 1)
+        dp.latch_tos1(dp.stack[dp.stack_pointer])
+        dp.latch_sp(dp.stack_pointer + 1)
+        return True
+
+    def execute_call(self, arg):
+        self.push_return_stack(self.program_counter + 1)
+        self.program_counter = arg
+        return True
+
+    def execute_ret(self):
+        self.program_counter = self.return_stack[self.return_stack_pointer]
+        self.pop_return_stack()
+        return True
+
+    def execute_fetched(self, program_counter, handler):
+        self.instruction_cache.access(program_counter)
+        return handler()
+
+    def execute_breakpoint(self, program_counter):
+        raise BreakpointReachedError(program_counter)
+
+    def install_breakpoints(self, breakpoints):
+        """Копия таблицы обработчиков, где по адресам точек останова стоит обработчик, прерывающий моделирование."""
+        handlers = list(self.handlers)
+        for program_counter in breakpoints:
+            if 0 <= program_counter < len(handlers):
+                handlers[program_counter] = partial(self.execute_breakpoint, program_counter)
+        return handlers
+
+    def step(self):
+        """Исполняет одну инструкцию, без условий остановки и трассировки. HALT -- StopIteration."""
+        if self.handlers is None:
+            if self.instruction_cache is not None:
+                self.instruction_cache.access(self.program_counter)
+            self.decode_and_execute_instruction(self.program.opcodes[self.program_counter])
+            return
+        pc = self.program_counter
+        if not self.handlers[pc]():
+            self.program_counter = pc + 1
+        self._tick += self.costs[pc]
+
+    def run(self, limit: int | None = DEFAULT_INSTRUCTION_LIMIT, stop: StopConditions | None = None):  # noqa: C901
+        if stop is None:
+            stop = StopConditions(max_instructions=limit)
         instr_counter = 0
-
-        logging.debug("%s", self)
+        self.stop_reason = None
+
+        tracer = self.tracer
+        tracer.start()
+        tracing = tracer.level > TraceLevel.OFF
+        if tracing:
+            tracer.record(self.trace_state())
+        stop.start(self.data_path.output_buffer)
+        breakpoints = stop.breakpoints
         try:
-            while True:
-                self.decode_and_execute_instruction(self.program[self.program_counter])
-                logging.debug("%s", self.__repr__())
-                instr_counter += 1
-                if instr_counter >= limit:
-                    logging.warning("Limit exceeded!")
-                    break
+            if self.engine == "jit" and not tracing:
+                # Блок, который не помещается в оставшийся лимит инструкций или содержит точку останова,
+                # исполняется по одной инструкции обработчиками dispatch, поэтому лимит и точки останова точные.
+                handlers, costs, blocks = self.install_breakpoints(breakpoints), self.costs, self.blocks
+                fetch = self.instruction_cache.access if self.instruction_cache is not None else None
+                while self.stop_reason is None:
+                    end = instr_counter + stop.batch_size(instr_counter)
+                    while instr_counter < end:
+                        pc = self.program_counter
+                        block = blocks.block(pc)
+                        if (
+                            block is not None
+                            and block.length <= end - instr_counter
+                            and block.fits(self)
+                            and not (breakpoints and block.crosses(breakpoints))
+                        ):
+                            if fetch is not None:
+                                for address in range(pc, pc + max(block.length, 1)):
+                                    fetch(address)
+                            self.program_counter = block.function(self, self.data_path)
+                            self._tick += block.cost
+                            instr_counter += block.length
+                        else:
+                            if not handlers[pc]():
+                                self.program_counter = pc + 1
+                            self._tick += costs[pc]
+                            instr_counter += 1
+                    self.stop_reason = stop.check(instr_counter, self.current_tick(), self.data_path.output_buffer)
+            elif self.engine in ("dispatch", "jit"):
+                handlers, costs = self.install_breakpoints(breakpoints), self.costs
+                while self.stop_reason is None:
+                    for _ in range(stop.batch_size(instr_counter)):
+                        pc = self.program_counter
+                        if not handlers[pc]():
+                            self.program_counter = pc + 1
+                        self._tick += costs[pc]
+                        if tracing:
+                            tracer.record(self.trace_state())
+                        instr_counter += 1
+                    self.stop_reason = stop.check(instr_counter, self.current_tick(), self.data_path.output_buffer)
+            else:
+                opcodes, fetch = self.program.opcodes, self.instruction_cache
+                while self.stop_reason is None:
+                    for _ in range(stop.batch_size(instr_counter)):
+                        if breakpoints and self.program_counter in breakpoints:
+                            raise BreakpointReachedError(self.program_counter)  # noqa: TRY301
+                        if fetch is not None:
+                            fetch.access(self.program_counter)
+                        self.decode_and_execute_instruction(opcodes[self.program_counter])
+                        if tracing:
+                            tracer.record(self.trace_state())
+                        instr_counter += 1
+                    self.stop_reason = stop.check(instr_counter, self.current_tick(), self.data_path.output_buffer)
+            if self.stop_reason in STOP_MESSAGES:
+                logging.warning(STOP_MESSAGES[self.stop_reason])
         except EOFError:
+            self.stop_reason = StopReason.INPUT_EMPTY
             logging.warning("Input buffer is empty!")
         except StopIteration:
+            self.stop_reason = StopReason.HALT
             logging.info("Program has ended with halt")
+        except BreakpointReachedError as e:
+            self.stop_reason = StopReason.BREAKPOINT
+            logging.info("%s", e)
+            if self.source_map is not None:
+                logging.info("Source: %s", self.source_map.describe(e.program_counter))
+        except Exception:
+            if tracer.states:
+                logging.error("Last machine states:\n%s", tracer.dump())  # noqa: TRY400
+            if self.source_map is not None:
+                logging.error("Source: %s", self.source_map.describe(self.program_counter))  # noqa: TRY400
+            raise
+
+        self.data_path.output_buffer.flush()
+        output = self.data_path.output_buffer.getvalue()
+        logging.info("output_buffer: %s", repr(output))
+        return output, instr_counter, self.current_tick()
+
+    def trace_state(self):
+        return (
+            self.current_tick(),
+            self.program_counter,
+            self.data_path.tos,
+            self.data_path.tos1,
+            self.data_path.stack_pointer,
+        )
 
-        logging.info("output_buffer: %s", repr("".join(self.data_path.output_buffer)))
-        return "".join(self.data_path.output_buffer), instr_counter, self.current_tick()
-
-    def __repr__(self):
+    def format_state(self, state: tuple):
+        tick, program_counter, tos, tos1, stack_pointer = state
         state_repr = (
-            f"TICK: {self._tick:3}\t"
-            f"PC: {self.program_counter:3}\t"
-            f"TOS: {self.data_path.tos:3}\t"
-            f"TOS1: {self.data_path.tos1:3}\t"
-            f"SP: {self.data_path.stack_pointer:3}\t"
+            f"TICK: {tick:3}\t"
+            f"PC: {program_counter:3}\t"
+            f"TOS: {tos:3}\t"
+            f"TOS1: {tos1:3}\t"
+            f"SP: {stack_pointer:3}\t"
         )
 
-        instr = self.program[self.program_counter]
+        instr = self.program[program_counter]
         opcode = instr.opcode
         instr_repr = str(opcode)
 
@@ -306,25 +669,96 @@ class ControlUnit:
 
         return f"\t{state_repr}\t{instr_repr}"
 
-
-def main(code_file, input_file):
+    def __repr__(self):
+        return self.format_state(self.trace_state())
+
+
+def main(
+    code_file,
+    input_file,
+    engine="interpret",
+    stop=None,
+    trace_level=TraceLevel.OFF,
+    trace_depth=DEFAULT_TRACE_DEPTH,
+    stream=False,
+    cache=None,
+    instruction_cache=None,
+    memory="dense",
+    memory_file=None,
+    stack_depth=DEFAULT_STACK_DEPTH,
+    return_stack_depth=DEFAULT_RETURN_STACK_DEPTH,
+    stack_stats=False,
+    source_map_file=None,
+    tick_model="hw",
+):
     data, code = read_data_and_code(code_file)
+    # карта исходного кода (явная или `<code_file>.map`) читается, только если понадобится
+    # ввод читается из файла потоком, по мере обращения программы к устройству ввода
+    # при stream вывод сразу передается в stdout, а run возвращает пустую строку
+    output_buffer = OutputDevice(sys.stdout, line_buffering=True) if stream else None
     with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        input_token = []
-        for char in input_text:
-            input_token.append(char)
-
-    data_path = DataPath(data, input_token)
-    control_unit = ControlUnit(code, data_path)
-    output, instr_counter, ticks = control_unit.run(1000)
+        data_path = DataPath(make_memory(memory, data, memory_file), file, output_buffer, cache, stack_depth)
+        control_unit = ControlUnit(
+            code,
+            data_path,
+            engine,
+            trace_level,
+            trace_depth,
+            instruction_cache=instruction_cache,
+            return_stack_depth=return_stack_depth,
+            source_map=find_source_map(code_file, source_map_file),
+            tick_model=tick_model,
+        )
+        output, instr_counter, ticks = control_unit.run(stop=stop)
+        data_path.data_memory.close()
 
     print("".join(output))
     print("instr_counter:", instr_counter, "ticks:", ticks)
+    if cache is not None:
+        print(cache.report())
+    if instruction_cache is not None:
+        print(instruction_cache.report("icache"))
+    if stack_stats:
+        print(
+            f"stack high-water: {data_path.stack_high_water}/{data_path.stack_depth}",
+            f"return stack high-water: {control_unit.return_stack_high_water}/{control_unit.return_stack_depth}",
+        )
 
 
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 3, "Wrong arguments: machine_hw.py <code_file> <input_file>"
-    _, code_file, input_file = sys.argv
-    main(code_file, input_file)
+    logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description="Hardwired модель стекового процессора")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--engine", choices=ENGINES, default="interpret")
+    parser.add_argument("--trace", type=TraceLevel.parse, choices=list(TraceLevel), default=TraceLevel.OFF)
+    parser.add_argument("--trace-depth", type=int, default=DEFAULT_TRACE_DEPTH)
+    parser.add_argument("--stream", action="store_true", help="write output to stdout while the model runs")
+    add_stop_arguments(parser)
+    add_cache_arguments(parser)
+    add_cache_arguments(parser, "icache", "instruction")
+    add_memory_arguments(parser)
+    parser.add_argument("--stack-depth", type=int, default=DEFAULT_STACK_DEPTH)
+    parser.add_argument("--return-stack-depth", type=int, default=DEFAULT_RETURN_STACK_DEPTH)
+    parser.add_argument("--stack-stats", action="store_true", help="print stack high-water marks")
+    parser.add_argument("--source-map", default=None, help="source map file (default: <code_file>.map if present)")
+    parser.add_argument("--tick-model", choices=TICK_MODELS, default="hw", help="tick costs (mc: dispatch/jit only)")
+    args = parser.parse_args()
+    main(
+        args.code_file,
+        args.input_file,
+        args.engine,
+        stop_conditions_from_args(args),
+        args.trace,
+        args.trace_depth,
+        args.stream,
+        cache_from_args(args),
+        cache_from_args(args, "icache"),
+        args.memory,
+        args.memory_file,
+        args.stack_depth,
+        args.return_stack_depth,
+        args.stack_stats,
+        args.source_map,
+        args.tick_model,
+    )
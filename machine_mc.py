@@ -1,11 +1,30 @@
 from __future__ import annotations
 
+import argparse
 import logging
 import sys
-
-from data_path import DataPath
-from isa import Instruction, Opcode, read_data_and_code
+from functools import partial
+from typing import ClassVar
+
+from cache import Cache, add_cache_arguments, cache_from_args
+from data_path import ALU, DEFAULT_RETURN_STACK_DEPTH, DEFAULT_STACK_DEPTH, DataPath, StackError
+from devices import OutputDevice
+from isa import FUSED_OPCODES, Instruction, Opcode, ProgramImage, read_data_and_code
+from memory import add_memory_arguments, make_memory
 from signals import Signal
+from source_map import LazySourceMap, SourceMap, find_source_map
+from stop_conditions import (
+    DEFAULT_INSTRUCTION_LIMIT,
+    STOP_MESSAGES,
+    BreakpointReachedError,
+    StopConditions,
+    StopReason,
+    add_stop_arguments,
+    stop_conditions_from_args,
+)
+from tracing import DEFAULT_TRACE_DEPTH, TraceLevel, Tracer
+
+ENGINES = ("compiled", "interpret")
 
 
 class EmptyLeftAluInputError(ValueError):
@@ -18,13 +37,57 @@ class EmptyRightAluInputError(ValueError):
         super().__init__("Nothing chosen on right alu input")
 
 
+def append_fused_microcode(microprogram: tuple, opcode_to_mc: dict[Opcode, int]):
+    """
+    Дописывает в конец памяти микрокоманд микрокод суперинструкций.
+     Микрокод составляющих инструкций копируется подряд. У всех составляющих, кроме последней,
+     завершающая микроинструкция вместо перехода к выборке (MicroProgramCounterZero, PCJumpTypeNext)
+     переходит к следующей микроинструкции, поэтому PC изменяется один раз -- в конце суперинструкции.
+    """
+    finishing = (Signal.MicroProgramCounterZero, Signal.PCJumpTypeNext, Signal.LatchPC)
+    microprogram = list(microprogram)
+    opcode_to_mc = dict(opcode_to_mc)
+    for fused, opcodes in FUSED_OPCODES.items():
+        opcode_to_mc[fused] = len(microprogram)
+        for num, opcode in enumerate(opcodes):
+            mpc = opcode_to_mc[opcode]
+            while Signal.MicroProgramCounterZero not in microprogram[mpc]:
+                microprogram.append(microprogram[mpc])
+                mpc += 1
+            if num == len(opcodes) - 1:
+                microprogram.append(microprogram[mpc])
+            else:
+                last = tuple(signal for signal in microprogram[mpc] if signal not in finishing)
+                microprogram.append((*last, Signal.MicroProgramCounterNext))
+    return tuple(microprogram), opcode_to_mc
+
+
+def microcode_tick_costs(microprogram: tuple, opcode_to_mc: dict[Opcode, int]):
+    """
+    Количество тактов каждой инструкции: микроинструкция выборки и микрокод инструкции от точки входа
+     до микроинструкции, возвращающей MPC в 0. Микрокод инструкций линейный (без переходов MPC внутри),
+     поэтому стоимость не зависит от данных. HALT -- 0 тактов: модель останавливается на выборке.
+    """
+    costs = {Opcode.HALT: 0}
+    for opcode, entry in opcode_to_mc.items():
+        mpc = entry
+        while Signal.MicroProgramCounterZero not in microprogram[mpc]:
+            assert Signal.MicroProgramCounterNext in microprogram[mpc], f"Microcode of {opcode} is not linear"
+            mpc += 1
+        costs[opcode] = 1 + mpc - entry + 1
+    return costs
+
+
 class ControlUnit:
     program = None
     program_counter = None
     data_path = None
     return_stack = None
     return_stack_pointer = None
+    return_stack_depth = None
+    return_stack_high_water = None
     _tick = None
+    instruction_cache = None
     microprogram = (
         (Signal.MicroProgramCounterOpcode, Signal.LatchMPCounter),  # 0 - Instruction fetch
         # NOP
@@ -370,57 +433,231 @@ class ControlUnit:
         (Signal.PopRetStack, Signal.MicroProgramCounterZero, Signal.LatchMPCounter),  # 62
     )
     microprogram_counter = None
-
-    @staticmethod
-    def opcode_to_mc(opcode: Opcode):
+    engine = None
+    microcode = None
+    entry_points = None
+    _microprogram_code = None
+    tracer = None
+    stop_reason = None
+    source_map = None
+
+    OPCODE_TO_MC: ClassVar[dict[Opcode, int]] = {
+        Opcode.NOP: 1,
+        Opcode.LIT: 2,
+        Opcode.LOAD: 6,
+        Opcode.STORE: 8,
+        Opcode.DUP: 15,
+        Opcode.OVER: 18,
+        Opcode.ADD: 22,
+        Opcode.SUB: 28,
+        Opcode.AND: 34,
+        Opcode.OR: 40,
+        Opcode.INV: 46,
+        Opcode.NEG: 48,
+        Opcode.ISNEG: 50,
+        Opcode.JMP: 52,
+        Opcode.JNZ: 53,
+        Opcode.CALL: 59,
+        Opcode.RET: 61,
+    }
+    # Микрокод суперинструкций (63 и далее) собирается из микрокода составляющих их инструкций
+    microprogram, OPCODE_TO_MC = append_fused_microcode(microprogram, OPCODE_TO_MC)
+    # Количество тактов каждой инструкции (включая суперинструкции), выводится из длины микрокода
+    TICK_COSTS: ClassVar[dict[Opcode, int]] = microcode_tick_costs(microprogram, OPCODE_TO_MC)
+
+    # Фрагменты кода, в которые компилируются сигналы (см. compile_microprogram).
+    # cu -- устройство управления, dp -- тракт данных, args -- аргументы инструкций программы
+    MICRO_OPERATIONS: ClassVar[dict[Signal, tuple[str, ...]]] = {
+        Signal.WriteMem: ("dp.write_memory(dp.tos, dp.tos1)",),
+        Signal.ReadMem: ("dp.latch_tos(dp.read_memory(dp.tos))",),
+        Signal.SaveLIT: ("dp.latch_tos(args[cu.program_counter])",),
+        Signal.LatchSP: ("dp.latch_sp(alu_res)",),
+        Signal.WriteFromTOS: ("dp.write_from_tos()",),
+        Signal.ReadToTOS: ("dp.latch_tos(dp.stack[dp.stack_pointer])",),
+        Signal.LatchTOS1: ("dp.latch_tos1(dp.stack[dp.stack_pointer])",),
+        Signal.PushRetStack: ("cu.push_return_stack(cu.program_counter + 1)",),
+        Signal.PopRetStack: ("cu.pop_return_stack()",),
+    }
+    # Входы АЛУ в порядке приоритета
+    ALU_LEFT: ClassVar[dict[Signal, str]] = {
+        Signal.TOSLeft: "dp.tos1",
+        Signal.IncLeft: "1",
+        Signal.DecLeft: "-1",
+        Signal.ZeroLeft: "0",
+    }
+    ALU_RIGHT: ClassVar[dict[Signal, str]] = {
+        Signal.TOSRight: "dp.tos",
+        Signal.SPRight: "dp.stack_pointer",
+        Signal.ZeroRight: "0",
+    }
+    PC_JUMPS: ClassVar[dict[Signal, str]] = {
+        Signal.PCJumpTypeNext: "cu.program_counter += 1",
+        Signal.PCJumpTypeJNZ: "cu.program_counter = args[cu.program_counter] if dp.is_not_zero() else cu.program_counter + 1",
+        Signal.PCJumpTypeJump: "cu.program_counter = args[cu.program_counter]",
+        Signal.PCJumpTypeRET: "cu.program_counter = cu.return_stack[cu.return_stack_pointer]",
+    }
+
+    @classmethod
+    def opcode_to_mc(cls, opcode: Opcode):
         try:
-            return {
-                Opcode.NOP: 1,
-                Opcode.LIT: 2,
-                Opcode.LOAD: 6,
-                Opcode.STORE: 8,
-                Opcode.DUP: 15,
-                Opcode.OVER: 18,
-                Opcode.ADD: 22,
-                Opcode.SUB: 28,
-                Opcode.AND: 34,
-                Opcode.OR: 40,
-                Opcode.INV: 46,
-                Opcode.NEG: 48,
-                Opcode.ISNEG: 50,
-                Opcode.JMP: 52,
-                Opcode.JNZ: 53,
-                Opcode.CALL: 59,
-                Opcode.RET: 61,
-            }[opcode]
+            return cls.OPCODE_TO_MC[opcode]
         except KeyError:
             raise StopIteration() from None
 
-    def __init__(self, program: list[Instruction], data_path: DataPath):
-        self.program: list[Instruction] = program
+    def __init__(
+        self,
+        program: ProgramImage | list[Instruction],
+        data_path: DataPath,
+        trace_level: TraceLevel = TraceLevel.OFF,
+        trace_depth: int = DEFAULT_TRACE_DEPTH,
+        engine: str = "compiled",
+        instruction_cache: Cache | None = None,
+        return_stack_depth: int = DEFAULT_RETURN_STACK_DEPTH,
+        source_map: SourceMap | LazySourceMap | None = None,
+    ):
+        """
+        instruction_cache -- модель кэша команд, получает адрес каждой выбираемой инструкции.
+        return_stack_depth -- число ячеек стека возвратов (выделяется заранее).
+        source_map -- карта исходного кода: позиция в исходном коде для сообщений об остановке и ошибках.
+        engine -- способ исполнения микрокода:
+         `compiled` -- каждая микроинструкция заранее компилируется в функцию (см. compile_microprogram);
+         `interpret` -- сигналы микроинструкции разбираются на каждом такте (эталон для проверки компилятора).
+        """
+        assert engine in ENGINES, f"Unknown engine: {engine}"
+        self.program: ProgramImage = ProgramImage.from_code(program)
         self.program_counter: int = 0
         self.data_path: DataPath = data_path
-        self.return_stack: list[int] = [0]
+        self.return_stack: list[int] = [0] * return_stack_depth
         self.return_stack_pointer: int = 0
+        self.return_stack_depth: int = return_stack_depth
+        self.return_stack_high_water: int = 0
         self._tick: int = 0
         self.microprogram_counter: int = 0
         self.prev_mpc: int = 0
+        self.tracer: Tracer = Tracer(self.format_state, trace_level, trace_depth)
+        self.engine: str = engine
+        self.instruction_cache: Cache | None = instruction_cache
+        self.source_map: SourceMap | LazySourceMap | None = source_map
+        # адрес микрокода для инструкции по каждому адресу программы (None -- HALT)
+        self.entry_points: list[int | None] = [self.OPCODE_TO_MC.get(opcode) for opcode in self.program.opcodes]
+        if engine == "compiled":
+            self.microcode = self.compile_microprogram()
+        else:
+            self.microcode = [partial(self.decode_and_execute_signals, microcode) for microcode in self.microprogram]
 
     def tick(self):
         self._tick += 1
 
     def current_tick(self):
-        return self._tick
+        """Такты модели с учетом ожидания памяти данных и памяти команд."""
+        fetch_ticks = self.instruction_cache.stall_ticks if self.instruction_cache is not None else 0
+        return self._tick + self.data_path.stall_ticks() + fetch_ticks
+
+    def set_current_tick(self, ticks: int):
+        """Устанавливает счетчик тактов так, чтобы current_tick() вернул ticks (при текущем ожидании памяти)."""
+        self._tick = 0
+        self._tick = ticks - self.current_tick()
+
+    def push_return_stack(self, address: int):
+        if self.return_stack_pointer + 1 >= self.return_stack_depth:
+            raise StackError("return", self.return_stack_pointer + 1, self.return_stack_depth)
+        self.return_stack_pointer += 1
+        if self.return_stack_pointer > self.return_stack_high_water:
+            self.return_stack_high_water = self.return_stack_pointer
+        self.return_stack[self.return_stack_pointer] = address
+
+    def pop_return_stack(self):
+        """Снимает адрес возврата. Ячейка 0 -- дно стека, возврат без вызова -- StackError."""
+        if self.return_stack_pointer == 0:
+            raise StackError("return", -1, self.return_stack_depth)
+        self.return_stack_pointer -= 1
+
+    def compile_microprogram(self):
+        """
+        Компилирует каждую микроинструкцию в функцию без аргументов.
+         Входы АЛУ, тип перехода PC и следующее значение MPC выбираются один раз, при компиляции.
+         Порядок действий совпадает с порядком сигналов в микроинструкции.
+         Исходный код компилируется один раз на класс, для модели функции только связываются с ее состоянием.
+        """
+        namespace = {
+            "cu": self,
+            "dp": self.data_path,
+            "args": self.program.args,
+            "entry_points": self.entry_points,
+            **{f"alu_{signal.name}": operation for signal, operation in ALU.SIGNAL_TO_OPERATION.items()},
+        }
+        exec(self.microprogram_code(), namespace)
+        return [namespace[f"microinstruction_{address}"] for address in range(len(self.microprogram))]
+
+    @classmethod
+    def microprogram_code(cls):
+        if cls._microprogram_code is None:
+            source = "\n".join(
+                line
+                for address in range(len(cls.microprogram))
+                for line in (
+                    f"def microinstruction_{address}():",
+                    *(f"    {line}" for line in cls.microinstruction_source(address)),
+                )
+            )
+            cls._microprogram_code = compile(source, "<microcode>", "exec")
+        return cls._microprogram_code
+
+    @classmethod
+    def microinstruction_source(cls, address: int):  # noqa: C901
+        microcode = cls.microprogram[address]
+        lines = []
+        alu_computed = False
+        for signal in microcode:
+            if signal in ALU.SIGNAL_TO_OPERATION:
+                left = next((src for sel, src in cls.ALU_LEFT.items() if sel in microcode), None)
+                right = next((src for sel, src in cls.ALU_RIGHT.items() if sel in microcode), None)
+                if left is None:
+                    raise EmptyLeftAluInputError()
+                if right is None:
+                    raise EmptyRightAluInputError()
+                lines.append(f"alu_res = alu_{signal.name}({left}, {right})")
+                if Signal.SaveALU in microcode:
+                    lines.append("dp.latch_tos(alu_res)")
+                alu_computed = True
+            elif signal is Signal.LatchSP and not alu_computed:
+                lines.append("dp.latch_sp(0)")
+            elif signal in cls.MICRO_OPERATIONS:
+                lines.extend(cls.MICRO_OPERATIONS[signal])
+            elif signal is Signal.LatchPC:
+                lines.extend(cls.next_pc_source(microcode))
+            elif signal is Signal.LatchMPCounter:
+                lines.extend(cls.next_mpc_source(address, microcode))
+        return lines or ["pass"]
+
+    @classmethod
+    def next_pc_source(cls, microcode: tuple):
+        return next(((src,) for sel, src in cls.PC_JUMPS.items() if sel in microcode), ())
+
+    @staticmethod
+    def next_mpc_source(address: int, microcode: tuple):
+        if Signal.MicroProgramCounterNext in microcode:
+            return (f"cu.microprogram_counter = {address + 1}",)
+        if Signal.MicroProgramCounterOpcode in microcode:
+            return (
+                "mpc = entry_points[cu.program_counter]",
+                "if mpc is None:",
+                "    raise StopIteration",
+                "cu.microprogram_counter = mpc",
+            )
+        if Signal.MicroProgramCounterZero in microcode:
+            return ("cu.microprogram_counter = 0",)
+        return ()
 
     def on_signal_latch_program_counter(self, microcode: tuple):
         if Signal.PCJumpTypeNext in microcode:
             self.program_counter += 1
         elif Signal.PCJumpTypeJNZ in microcode:
             self.program_counter = (
-                self.program[self.program_counter].arg if self.data_path.is_not_zero() else self.program_counter + 1
+                self.program.args[self.program_counter] if self.data_path.is_not_zero() else self.program_counter + 1
             )
         elif Signal.PCJumpTypeJump in microcode:
-            self.program_counter = self.program[self.program_counter].arg
+            self.program_counter = self.program.args[self.program_counter]
         elif Signal.PCJumpTypeRET in microcode:
             self.program_counter = self.return_stack[self.return_stack_pointer]
 
@@ -428,7 +665,7 @@ class ControlUnit:
         if Signal.MicroProgramCounterNext in microcode:
             self.microprogram_counter += 1
         elif Signal.MicroProgramCounterOpcode in microcode:
-            self.microprogram_counter = self.opcode_to_mc(self.program[self.program_counter].opcode)
+            self.microprogram_counter = self.opcode_to_mc(self.program.opcodes[self.program_counter])
         elif Signal.MicroProgramCounterZero in microcode:
             self.microprogram_counter = 0
 
@@ -474,7 +711,7 @@ class ControlUnit:
                         self.data_path.latch_tos(alu_res)
 
                 case Signal.SaveLIT:
-                    self.data_path.latch_tos(self.program[self.program_counter].arg)
+                    self.data_path.latch_tos(self.program.args[self.program_counter])
                 case Signal.LatchSP:
                     self.data_path.latch_sp(alu_res)
                 case Signal.WriteFromTOS:
@@ -485,13 +722,9 @@ class ControlUnit:
                     self.data_path.latch_tos1(self.data_path.stack[self.data_path.stack_pointer])
 
                 case Signal.PushRetStack:
-                    self.return_stack_pointer += 1
-                    if len(self.return_stack) > self.return_stack_pointer:
-                        self.return_stack[self.return_stack_pointer] = self.program_counter + 1
-                    else:
-                        self.return_stack.append(self.program_counter + 1)
+                    self.push_return_stack(self.program_counter + 1)
                 case Signal.PopRetStack:
-                    self.return_stack_pointer -= 1
+                    self.pop_return_stack()
 
                 case Signal.LatchPC:
                     self.on_signal_latch_program_counter(microcode)
@@ -500,44 +733,116 @@ class ControlUnit:
                 case _:
                     pass
 
-    def run(self, limit):
+    def step(self, microprogram_counts: list[int] | None = None):
+        """
+        Исполняет микрокод одной инструкции: от выборки (MPC = 0) до возврата MPC в 0.
+         Без условий остановки и трассировки. HALT -- StopIteration.
+         microprogram_counts -- счетчики исполнений по адресам микропрограммы (для профилировщика).
+        """
+        assert self.microprogram_counter == 0, "Step must start at an instruction boundary"
+        if self.instruction_cache is not None:
+            self.instruction_cache.access(self.program_counter)
+        microcode = self.microcode
+        while True:
+            self.prev_mpc = self.microprogram_counter
+            microcode[self.microprogram_counter]()
+            self._tick += 1
+            if microprogram_counts is not None:
+                microprogram_counts[self.prev_mpc] += 1
+            if self.microprogram_counter == 0:
+                return
+
+    def run(self, limit: int | None = DEFAULT_INSTRUCTION_LIMIT, stop: StopConditions | None = None):  # noqa: C901
+        """
+        Моделирование по тактам. Условия остановки проверяются пакетно, раз в stop.check_interval тактов.
+         Лимит инструкций и точки останова проверяются точно, перед выборкой очередной инструкции.
+        """
+        if stop is None:
+            stop = StopConditions(max_instructions=limit)
+        max_instructions = stop.max_instructions
         instr_counter = 0
-
-        logging.debug("%s", self)
+        self.stop_reason = None
+
+        tracer = self.tracer
+        tracer.start()
+        trace_instructions = tracer.level == TraceLevel.INSTRUCTION
+        trace_microinstructions = tracer.level >= TraceLevel.MICROINSTRUCTION
+        if tracer.level > TraceLevel.OFF:
+            tracer.record(self.trace_state())
+        stop.start(self.data_path.output_buffer)
+        breakpoints = stop.breakpoints
+        microcode = self.microcode
         try:
-            while True:
-                if self.microprogram_counter == 0:
-                    instr_counter += 1
-                    logging.debug(f"Instruction #{instr_counter}")
-
-                self.prev_mpc = self.microprogram_counter
-                self.decode_and_execute_signals(self.microprogram[self.microprogram_counter])
-                self.tick()
-                logging.debug("%s", self.__repr__())
-
-                if instr_counter >= limit:
-                    logging.warning("Limit exceeded!")
-                    break
+            while self.stop_reason is None:
+                for _ in range(stop.check_interval):
+                    if self.microprogram_counter == 0:
+                        if max_instructions is not None and instr_counter >= max_instructions:
+                            break
+                        if breakpoints and self.program_counter in breakpoints:
+                            raise BreakpointReachedError(self.program_counter)  # noqa: TRY301
+                        if self.instruction_cache is not None:
+                            self.instruction_cache.access(self.program_counter)
+                        instr_counter += 1
+                        if tracer.log:
+                            logging.debug("Instruction #%d", instr_counter)
+                        elif trace_instructions and instr_counter > 1:
+                            tracer.record(self.trace_state())
+
+                    self.prev_mpc = self.microprogram_counter
+                    microcode[self.microprogram_counter]()
+                    self._tick += 1
+                    if trace_microinstructions:
+                        tracer.record(self.trace_state())
+                self.stop_reason = stop.check(instr_counter, self.current_tick(), self.data_path.output_buffer)
+            if self.stop_reason in STOP_MESSAGES:
+                logging.warning(STOP_MESSAGES[self.stop_reason])
         except EOFError:
+            self.stop_reason = StopReason.INPUT_EMPTY
             logging.warning("Input buffer is empty!")
         except StopIteration:
+            self.stop_reason = StopReason.HALT
             logging.info("Program has ended with halt")
+        except BreakpointReachedError as e:
+            self.stop_reason = StopReason.BREAKPOINT
+            logging.info("%s", e)
+            if self.source_map is not None:
+                logging.info("Source: %s", self.source_map.describe(e.program_counter))
+        except Exception:
+            if tracer.states:
+                logging.error("Last machine states:\n%s", tracer.dump())  # noqa: TRY400
+            if self.source_map is not None:
+                logging.error("Source: %s", self.source_map.describe(self.program_counter))  # noqa: TRY400
+            raise
+
+        self.data_path.output_buffer.flush()
+        output = self.data_path.output_buffer.getvalue()
+        logging.info("output_buffer: %s", repr(output))
+        return output, instr_counter, self.current_tick()
+
+    def trace_state(self):
+        return (
+            self.current_tick(),
+            self.program_counter,
+            self.prev_mpc,
+            self.microprogram_counter,
+            self.data_path.tos,
+            self.data_path.tos1,
+            self.data_path.stack_pointer,
+        )
 
-        logging.info("output_buffer: %s", repr("".join(self.data_path.output_buffer)))
-        return "".join(self.data_path.output_buffer), instr_counter, self.current_tick()
-
-    def __repr__(self):
+    def format_state(self, state: tuple):
+        tick, program_counter, prev_mpc, microprogram_counter, tos, tos1, stack_pointer = state
         state_repr = (
-            f"TICK: {self._tick:3}\t"
-            f"PC: {self.program_counter:3}\t"
-            f"PREV_MPC: {self.prev_mpc}\t"
-            f"CUR_MPC: {self.microprogram_counter}\t"
-            f"TOS: {self.data_path.tos}\t"
-            f"TOS1: {self.data_path.tos1}\t"
-            f"SP: {self.data_path.stack_pointer}\t"
+            f"TICK: {tick:3}\t"
+            f"PC: {program_counter:3}\t"
+            f"PREV_MPC: {prev_mpc}\t"
+            f"CUR_MPC: {microprogram_counter}\t"
+            f"TOS: {tos}\t"
+            f"TOS1: {tos1}\t"
+            f"SP: {stack_pointer}\t"
         )
 
-        instr = self.program[self.program_counter]
+        instr = self.program[program_counter]
         opcode = instr.opcode
         instr_repr = str(opcode)
 
@@ -546,25 +851,92 @@ class ControlUnit:
 
         return f"{state_repr}\n{instr_repr}"
 
-
-def main(code_file, input_file):
+    def __repr__(self):
+        return self.format_state(self.trace_state())
+
+
+def main(
+    code_file,
+    input_file,
+    stop=None,
+    trace_level=TraceLevel.OFF,
+    trace_depth=DEFAULT_TRACE_DEPTH,
+    engine="compiled",
+    stream=False,
+    cache=None,
+    instruction_cache=None,
+    memory="dense",
+    memory_file=None,
+    stack_depth=DEFAULT_STACK_DEPTH,
+    return_stack_depth=DEFAULT_RETURN_STACK_DEPTH,
+    stack_stats=False,
+    source_map_file=None,
+):
     data, code = read_data_and_code(code_file)
+    # карта исходного кода (явная или `<code_file>.map`) читается, только если понадобится
+    # ввод читается из файла потоком, по мере обращения программы к устройству ввода
+    # при stream вывод сразу передается в stdout, а run возвращает пустую строку
+    output_buffer = OutputDevice(sys.stdout, line_buffering=True) if stream else None
     with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        input_token = []
-        for char in input_text:
-            input_token.append(char)
-
-    data_path = DataPath(data, input_token)
-    control_unit = ControlUnit(code, data_path)
-    output, instr_counter, ticks = control_unit.run(1000)
+        data_path = DataPath(make_memory(memory, data, memory_file), file, output_buffer, cache, stack_depth)
+        control_unit = ControlUnit(
+            code,
+            data_path,
+            trace_level,
+            trace_depth,
+            engine,
+            instruction_cache,
+            return_stack_depth,
+            find_source_map(code_file, source_map_file),
+        )
+        output, instr_counter, ticks = control_unit.run(stop=stop)
+        data_path.data_memory.close()
 
     print("".join(output))
     print("instr_counter: ", instr_counter, "ticks:", ticks)
+    if cache is not None:
+        print(cache.report())
+    if instruction_cache is not None:
+        print(instruction_cache.report("icache"))
+    if stack_stats:
+        print(
+            f"stack high-water: {data_path.stack_high_water}/{data_path.stack_depth}",
+            f"return stack high-water: {control_unit.return_stack_high_water}/{control_unit.return_stack_depth}",
+        )
 
 
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 3, "Wrong arguments: machine_mc.py <code_file> <input_file>"
-    _, code_file, input_file = sys.argv
-    main(code_file, input_file)
+    logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description="Microcoded модель стекового процессора")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--engine", choices=ENGINES, default="compiled")
+    parser.add_argument("--trace", type=TraceLevel.parse, choices=list(TraceLevel), default=TraceLevel.OFF)
+    parser.add_argument("--trace-depth", type=int, default=DEFAULT_TRACE_DEPTH)
+    parser.add_argument("--stream", action="store_true", help="write output to stdout while the model runs")
+    add_stop_arguments(parser)
+    add_cache_arguments(parser)
+    add_cache_arguments(parser, "icache", "instruction")
+    add_memory_arguments(parser)
+    parser.add_argument("--stack-depth", type=int, default=DEFAULT_STACK_DEPTH)
+    parser.add_argument("--return-stack-depth", type=int, default=DEFAULT_RETURN_STACK_DEPTH)
+    parser.add_argument("--stack-stats", action="store_true", help="print stack high-water marks")
+    parser.add_argument("--source-map", default=None, help="source map file (default: <code_file>.map if present)")
+    args = parser.parse_args()
+    main(
+        args.code_file,
+        args.input_file,
+        stop_conditions_from_args(args),
+        args.trace,
+        args.trace_depth,
+        args.engine,
+        args.stream,
+        cache_from_args(args),
+        cache_from_args(args, "icache"),
+        args.memory,
+        args.memory_file,
+        args.stack_depth,
+        args.return_stack_depth,
+        args.stack_stats,
+        args.source_map,
+    )
@@ -0,0 +1,261 @@
+"""Память данных: адресное пространство из машинных слов с проверкой границ.
+
+Реализации:
+ - `DenseMemory` -- непрерывный `array('q')`, растет по мере записи до размера адресного пространства;
+ - `WriteTrackingMemory` -- `DenseMemory`, которая запоминает адреса записей;
+ - `SparseMemory` -- таблица страниц (словарь), память выделяется только под записанные страницы;
+ - `MmapMemory` -- слова в отображенном в память файле: содержимое сохраняется между запусками,
+   снимок записывается в отдельный файл (`snapshot`).
+
+Слово памяти -- машинное слово разрядности `WORD_BITS`, его же обрабатывают АЛУ и стек (см. data_path.py).
+Запись приводит значение к знаковому слову (переполнение -- циклическое, как в АЛУ).
+Чтение еще не записанной ячейки возвращает 0.
+Обращение вне адресного пространства `[0, size)` вызывает `MemoryAccessError`.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from array import array
+
+WORD_BITS = 32
+DEFAULT_SIZE = 1 << 20
+# Размер страницы SparseMemory: 1 << PAGE_BITS слов
+PAGE_BITS = 10
+
+BACKENDS = ("dense", "sparse", "mmap")
+
+
+class MemoryAccessError(Exception):
+    def __init__(self, address: int, size: int):
+        super().__init__(f"Memory access out of bounds: address {address}, memory size {size}")
+        self.address = address
+
+
+def wrap_word(value: int):
+    """Значение как знаковое машинное слово."""
+    half = 1 << (WORD_BITS - 1)
+    return ((value + half) & ((1 << WORD_BITS) - 1)) - half
+
+
+class Memory:
+    """Общая часть реализаций памяти данных."""
+
+    size = None
+    word_bits = None
+    extent = None
+
+    def __init__(self, size: int):
+        assert size > 0, "Memory size must be positive"
+        self.size: int = size
+        self.word_bits: int = WORD_BITS
+        # 1 + наибольший адрес, по которому была запись (или длина начальных данных)
+        self.extent: int = 0
+        self._half = 1 << (WORD_BITS - 1)
+        self._mask = (1 << WORD_BITS) - 1
+
+    def fault(self, address: int):
+        raise MemoryAccessError(address, self.size)
+
+    def close(self):
+        """Освобождает ресурсы реализации (файл MmapMemory)."""
+
+    def tolist(self):
+        """Содержимое ячеек [0, extent)."""
+        return [self[address] for address in range(self.extent)]
+
+    def ranges(self):
+        """Участки памяти, в которые была запись: список (начальный адрес, значения). Не записанные ячейки -- 0."""
+        return [(0, self.tolist())] if self.extent else []
+
+    def clear(self):
+        """Обнуляет ячейки [0, extent), extent становится 0. Реализации переопределяют более быстрым способом."""
+        for address in range(self.extent):
+            self[address] = 0
+        self.extent = 0
+
+    def __len__(self):
+        return self.extent
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __repr__(self):
+        return f"{type(self).__name__}(size={self.size}, word_bits={self.word_bits}, extent={self.extent})"
+
+
+class DenseMemory(Memory):
+    words = None
+
+    def __init__(self, data=(), size: int = DEFAULT_SIZE):
+        super().__init__(size)
+        assert len(data) <= size, "Initial data does not fit into memory"
+        self.words: array = array("q", (wrap_word(value) for value in data))
+        self.extent = len(self.words)
+
+    def __getitem__(self, address: int):
+        if 0 <= address < len(self.words):
+            return self.words[address]
+        if not 0 <= address < self.size:
+            self.fault(address)
+        return 0
+
+    def __setitem__(self, address: int, value: int):
+        words = self.words
+        if not 0 <= address < len(words):
+            if not 0 <= address < self.size:
+                self.fault(address)
+            # рост с удвоением, чтобы последовательная запись за концом стоила O(1) в среднем
+            words.extend(array("q", bytes(8 * (min(self.size, max(address + 1, 2 * len(words))) - len(words)))))
+        words[address] = ((value + self._half) & self._mask) - self._half
+        if address >= self.extent:
+            self.extent = address + 1
+
+    def tolist(self):
+        return self.words[: self.extent].tolist()
+
+    def clear(self):
+        self.words = array("q")
+        self.extent = 0
+
+
+class WriteTrackingMemory(DenseMemory):
+    """DenseMemory, запоминающая адреса записей в `written` (для передачи и сравнения состояния по изменениям).
+
+    Множество очищает использующий его код.
+    """
+
+    written = None
+
+    def __init__(self, data=(), size: int = DEFAULT_SIZE):
+        super().__init__(data, size)
+        self.written: set[int] = set()
+
+    def __setitem__(self, address: int, value: int):
+        super().__setitem__(address, value)
+        self.written.add(address)
+
+
+class SparseMemory(Memory):
+    pages = None
+
+    def __init__(self, data=(), size: int = 1 << WORD_BITS):
+        super().__init__(size)
+        self.pages: dict[int, array] = {}
+        for address, value in enumerate(data):
+            self[address] = value
+
+    def __getitem__(self, address: int):
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is not None:
+            return page[address & ((1 << PAGE_BITS) - 1)]
+        if not 0 <= address < self.size:
+            self.fault(address)
+        return 0
+
+    def __setitem__(self, address: int, value: int):
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is None:
+            if not 0 <= address < self.size:
+                self.fault(address)
+            page = self.pages[address >> PAGE_BITS] = array("q", bytes(8 << PAGE_BITS))
+        page[address & ((1 << PAGE_BITS) - 1)] = ((value + self._half) & self._mask) - self._half
+        if address >= self.extent:
+            self.extent = address + 1
+
+    def ranges(self):
+        """Выделенные страницы по порядку адресов, соседние страницы объединяются."""
+        ranges = []
+        for number in sorted(self.pages):
+            start = number << PAGE_BITS
+            values = self.pages[number][: self.extent - start].tolist()
+            if ranges and ranges[-1][0] + len(ranges[-1][1]) == start:
+                ranges[-1][1].extend(values)
+            else:
+                ranges.append((start, values))
+        return ranges
+
+    def clear(self):
+        self.pages.clear()
+        self.extent = 0
+
+
+class MmapMemory(Memory):
+    """Память в файле path (None -- анонимное отображение без сохранения).
+
+    Если файл уже существует и data пуст, используется его содержимое. Файл не короче size слов
+    (на большинстве файловых систем он разреженный и не занимает места под нулевые страницы).
+    """
+
+    path = None
+    words = None
+
+    def __init__(self, data=(), size: int = DEFAULT_SIZE, path: str | None = None):
+        super().__init__(size)
+        assert len(data) <= size, "Initial data does not fit into memory"
+        self.path: str | None = path
+        self._file = None
+        if path is None:
+            self._mmap = mmap.mmap(-1, 8 * size)
+        else:
+            self._file = open(path, "a+b")
+            if os.fstat(self._file.fileno()).st_size < 8 * size:
+                self._file.truncate(8 * size)
+            self._mmap = mmap.mmap(self._file.fileno(), 8 * size)
+            if not data:
+                self.extent = -(-len(self._mmap[:].rstrip(b"\0")) // 8)
+        self.words: memoryview = memoryview(self._mmap).cast("q")
+        for address, value in enumerate(data):
+            self[address] = value
+
+    def __getitem__(self, address: int):
+        if not 0 <= address < self.size:
+            self.fault(address)
+        return self.words[address]
+
+    def __setitem__(self, address: int, value: int):
+        if not 0 <= address < self.size:
+            self.fault(address)
+        self.words[address] = ((value + self._half) & self._mask) - self._half
+        if address >= self.extent:
+            self.extent = address + 1
+
+    def tolist(self):
+        return self.words[: self.extent].tolist()
+
+    def clear(self):
+        self._mmap[: 8 * self.extent] = bytes(8 * self.extent)
+        self.extent = 0
+
+    def flush(self):
+        self._mmap.flush()
+
+    def snapshot(self, path: str):
+        """Записывает копию памяти в файл path (его можно открыть как MmapMemory(path=path))."""
+        with open(path, "wb") as file:
+            file.write(self._mmap[:])
+
+    def close(self):
+        self._mmap.flush()
+        self.words.release()
+        self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def make_memory(backend: str, data=(), path: str | None = None):
+    """Память данных по имени реализации, заполненная data."""
+    assert backend in BACKENDS, f"Unknown memory backend: {backend}"
+    assert path is None or backend == "mmap", "Memory file is supported by the mmap backend only"
+    if backend == "dense":
+        return DenseMemory(data)
+    if backend == "sparse":
+        return SparseMemory(data)
+    return MmapMemory(data, path=path)
+
+
+def add_memory_arguments(parser):
+    """Добавляет в argparse-парсер параметры памяти данных."""
+    parser.add_argument("--memory", choices=BACKENDS, default="dense", help="data memory backend")
+    parser.add_argument("--memory-file", default=None, help="file of the mmap backend (kept after the run)")
@@ -0,0 +1,21 @@
+"""Выбор модели процессора по имени: `hw` -- Hardwired (machine_hw), `mc` -- Microcoded (machine_mc)."""
+
+from __future__ import annotations
+
+import machine_hw
+import machine_mc
+from data_path import DataPath
+
+MODELS = ("hw", "mc")
+# Движок по умолчанию для инструментов (пакетное моделирование, профилировщик, контрольные точки)
+DEFAULT_ENGINES = {"hw": "dispatch", "mc": "compiled"}
+
+
+def make_control_unit(model: str, code, data_path: DataPath, engine: str | None = None, **options):
+    """
+    ControlUnit модели model с движком engine (None -- DEFAULT_ENGINES[model]).
+     options -- остальные параметры конструктора модели (instruction_cache, source_map, ...).
+    """
+    assert model in MODELS, f"Unknown model: {model}"
+    control_unit_class = machine_hw.ControlUnit if model == "hw" else machine_mc.ControlUnit
+    return control_unit_class(code, data_path, engine=engine or DEFAULT_ENGINES[model], **options)
@@ -0,0 +1,244 @@
+"""Профилировщик моделей процессора.
+
+Модель исполняется по одной инструкции (`ControlUnit.step`), после каждой инструкции ее такты
+(вместе с ожиданием кэшей) записываются на адрес инструкции. Для microcoded модели дополнительно
+считается число исполнений каждой микроинструкции.
+
+Счетчики по адресам сворачиваются:
+ - по кодам операций;
+ - по словам Forth (процедурам `:`) и строкам исходного кода -- по карте исходного кода (`source_map.SourceMap`);
+ - в стеки вызовов в формате collapsed stacks (`main;prob1 12345`), который принимают flamegraph.pl,
+   speedscope и inferno. Стек строится по стеку возвратов: каждый адрес возврата указывает за CALL,
+   аргумент которого -- вход вызванной процедуры.
+
+Для машинного кода карта исходного кода читается из файла `<machine_code_file>.map`, если транслятор его записал.
+Пошаговое исполнение медленнее движков `run`, поэтому профилирование включается отдельно.
+"""
+
+from __future__ import annotations
+
+import argparse
+from collections import Counter
+
+import translator
+from data_path import DataPath
+from isa import read_data_and_code
+from models import MODELS, make_control_unit
+from source_map import MAIN_WORD, LazySourceMap, SourceMap, find_source_map
+from stop_conditions import DEFAULT_INSTRUCTION_LIMIT, StopReason
+
+DEFAULT_TOP = 10
+
+
+class Profile:
+    program = None
+    source_map = None
+    instructions = None
+    ticks = None
+    microinstructions = None
+    stack_ticks = None
+    stack_instructions = None
+    outcome = None
+
+    def __init__(
+        self, program, source_map: SourceMap | LazySourceMap | None = None, microprogram_size: int | None = None
+    ):
+        """microprogram_size -- размер микропрограммы (для microcoded модели), None -- без счетчиков MPC."""
+        self.program = program
+        self.source_map: SourceMap | LazySourceMap | None = source_map
+        self.instructions: list[int] = [0] * len(program)
+        self.ticks: list[int] = [0] * len(program)
+        self.microinstructions: list[int] | None = None if microprogram_size is None else [0] * microprogram_size
+        # (адреса возврата, PC) -> такты и инструкции
+        self.stack_ticks: Counter[tuple[tuple[int, ...], int]] = Counter()
+        self.stack_instructions: Counter[tuple[tuple[int, ...], int]] = Counter()
+        # чем закончилось моделирование: HALT, INPUT_EMPTY или INSTRUCTION_LIMIT
+        self.outcome: StopReason | None = None
+
+    @classmethod
+    def for_control_unit(cls, control_unit, source_map: SourceMap | LazySourceMap | None = None):
+        microprogram = getattr(control_unit, "microprogram", None)
+        return cls(control_unit.program, source_map, None if microprogram is None else len(microprogram))
+
+    def record(self, program_counter: int, ticks: int, return_addresses: tuple[int, ...]):
+        self.instructions[program_counter] += 1
+        self.ticks[program_counter] += ticks
+        key = (return_addresses, program_counter)
+        self.stack_ticks[key] += ticks
+        self.stack_instructions[key] += 1
+
+    def total(self):
+        return sum(self.instructions), sum(self.ticks)
+
+    def fold(self, key):
+        """Сворачивает счетчики адресов по key(адрес): {ключ: (инструкции, такты)}."""
+        folded: dict = {}
+        for address, (count, ticks) in enumerate(zip(self.instructions, self.ticks)):
+            if count:
+                total_count, total_ticks = folded.get(key(address), (0, 0))
+                folded[key(address)] = (total_count + count, total_ticks + ticks)
+        return folded
+
+    def by_opcode(self):
+        return self.fold(lambda address: self.program.opcodes[address])
+
+    def by_word(self):
+        assert self.source_map is not None, "Folding by word needs a source map"
+        return self.fold(self.source_map.word)
+
+    def by_line(self):
+        assert self.source_map is not None, "Folding by line needs a source map"
+        return self.fold(self.source_map.line)
+
+    def collapsed_stacks(self, weight: str = "ticks"):
+        """Строки `кадр;кадр;... вес`, weight -- ticks или instructions."""
+        assert weight in ("ticks", "instructions"), f"Unknown weight: {weight}"
+        counter = self.stack_ticks if weight == "ticks" else self.stack_instructions
+        args = self.program.args
+        # имя процедуры по адресу входа; без карты исходного кода кадр называется адресом входа
+        names = {} if self.source_map is None else {entry: name for name, entry in self.source_map.functions.items()}
+        stacks: Counter[str] = Counter()
+        for (return_addresses, _), value in counter.items():
+            entries = [args[address - 1] for address in return_addresses]
+            frames = [MAIN_WORD, *(names.get(entry, f"@{entry}") for entry in entries)]
+            stacks[";".join(frames)] += value
+        return [f"{stack} {value}" for stack, value in sorted(stacks.items()) if value]
+
+    def report(self, top: int = DEFAULT_TOP):
+        instructions, ticks = self.total()
+        lines = [f"profile: instructions: {instructions} ticks: {ticks} outcome: {self.outcome}"]
+
+        def section(title, folded, name):
+            lines.append(title)
+            ordered = sorted(folded.items(), key=lambda item: -item[1][1])
+            lines.extend(
+                f"  {name(key):<24} instr: {count:8} ticks: {value:8} {value / ticks if ticks else 0:6.1%}"
+                for key, (count, value) in ordered[:top]
+            )
+
+        section("by opcode:", self.by_opcode(), str)
+        if self.source_map is not None:
+            section("by word:", self.by_word(), str)
+            section("by line:", self.by_line(), lambda line: "-" if line is None else f"line {line}")
+
+        def address_name(address):
+            instruction = f"{address:5} {self.program[address]}"
+            source_range = None if self.source_map is None else self.source_map.lookup(address)
+            return instruction if source_range is None else f"{instruction} {source_range.term!r}"
+
+        section("by address:", self.fold(lambda address: address), address_name)
+        if self.microinstructions is not None:
+            lines.append("by microprogram address:")
+            ordered = sorted(enumerate(self.microinstructions), key=lambda item: -item[1])
+            lines.extend(f"  mpc {mpc:5} ticks: {count:8}" for mpc, count in ordered[:top] if count)
+        return "\n".join(lines)
+
+
+def profile_run(control_unit, profile: Profile, limit: int | None = DEFAULT_INSTRUCTION_LIMIT):
+    """Исполняет модель по одной инструкции до HALT, конца ввода или лимита, собирая профиль."""
+    microprogram_counts = profile.microinstructions
+    step = control_unit.step
+    instructions = 0
+    try:
+        while limit is None or instructions < limit:
+            pc = control_unit.program_counter
+            rsp = control_unit.return_stack_pointer
+            return_addresses = tuple(control_unit.return_stack[1 : rsp + 1]) if rsp else ()
+            start = control_unit.current_tick()
+            if microprogram_counts is None:
+                step()
+            else:
+                step(microprogram_counts)
+            profile.record(pc, control_unit.current_tick() - start, return_addresses)
+            instructions += 1
+        profile.outcome = StopReason.INSTRUCTION_LIMIT
+    except StopIteration:
+        profile.outcome = StopReason.HALT
+    except EOFError:
+        profile.outcome = StopReason.INPUT_EMPTY
+    control_unit.data_path.output_buffer.flush()
+    return profile
+
+
+def profile_program(
+    data,
+    code,
+    source_map: SourceMap | LazySourceMap | None = None,
+    input_text: str = "",
+    model: str = "hw",
+    engine: str | None = None,
+    limit: int | None = DEFAULT_INSTRUCTION_LIMIT,
+):
+    """Профилирует исполнение машинного кода. Возвращает профиль и вывод программы."""
+    data_path = DataPath(list(data), input_text)
+    control_unit = make_control_unit(model, code, data_path, engine)
+    profile = profile_run(control_unit, Profile.for_control_unit(control_unit, source_map), limit)
+    return profile, data_path.output_buffer.getvalue()
+
+
+def profile_source(
+    source: str,
+    input_text: str = "",
+    model: str = "hw",
+    engine: str | None = None,
+    limit: int | None = DEFAULT_INSTRUCTION_LIMIT,
+    fuse: bool = False,
+    optimize: bool = False,
+):
+    """Транслирует программу на Forth с картой исходного кода и профилирует ее исполнение."""
+    data, code, source_map = translator.translate(source, fuse, optimize, source_map=True)
+    return profile_program(data, code, source_map, input_text, model, engine, limit)
+
+
+def main(program_file, input_file, model="hw", engine=None, limit=DEFAULT_INSTRUCTION_LIMIT, **options):
+    """
+    program_file -- исходный код на Forth (`.fth`) или машинный код; карта машинного кода берется
+     из options["source_map"] или `<program_file>.map`, без нее отчет только по адресам и кодам операций.
+    options: fuse, optimize (для исходного кода), source_map, top, collapsed (файл для collapsed stacks),
+     weight (ticks или instructions).
+    """
+    with open(input_file, encoding="utf-8") as file:
+        input_text = file.read()
+    if program_file.endswith(".fth"):
+        with open(program_file, encoding="utf-8") as file:
+            source = file.read()
+        fuse, optimize = options.get("fuse", False), options.get("optimize", False)
+        profile, output = profile_source(source, input_text, model, engine, limit, fuse, optimize)
+    else:
+        data, code = read_data_and_code(program_file)
+        source_map = find_source_map(program_file, options.get("source_map"))
+        profile, output = profile_program(data, code, source_map, input_text, model, engine, limit)
+    print(output)
+    print(profile.report(options.get("top", DEFAULT_TOP)))
+    if options.get("collapsed"):
+        with open(options["collapsed"], "w", encoding="utf-8") as file:
+            file.writelines(line + "\n" for line in profile.collapsed_stacks(options.get("weight", "ticks")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Профилирование программы на Forth")
+    parser.add_argument("program_file", help="Forth source (.fth) or machine code")
+    parser.add_argument("input_file")
+    parser.add_argument("--model", choices=MODELS, default="hw")
+    parser.add_argument("--engine", default=None, help="engine of the model (step-compatible)")
+    parser.add_argument("--limit", type=int, default=DEFAULT_INSTRUCTION_LIMIT, help="instruction limit, 0 - unlimited")
+    parser.add_argument("--fuse", action="store_true")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--source-map", default=None, help="source map of machine code (default: <program_file>.map)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="rows per report section")
+    parser.add_argument("--collapsed", default=None, help="write flamegraph collapsed stacks to this file")
+    parser.add_argument("--weight", choices=("ticks", "instructions"), default="ticks")
+    args = parser.parse_args()
+    main(
+        args.program_file,
+        args.input_file,
+        args.model,
+        args.engine,
+        args.limit or None,
+        fuse=args.fuse,
+        optimize=args.optimize,
+        source_map=args.source_map,
+        top=args.top,
+        collapsed=args.collapsed,
+        weight=args.weight,
+    )
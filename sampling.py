@@ -0,0 +1,167 @@
+"""Выборочное моделирование: быстрая функциональная модель и периодические точные окна.
+
+Программа целиком исполняется hardwired моделью (движок jit) -- она быстро ведет архитектурное состояние
+и счетчик инструкций. В начале каждого периода из `period` инструкций состояние передается в одну и ту же
+microcoded модель, которая исполняет окно из `window` инструкций с точностью до такта. Передается только
+архитектурное состояние: PC, стеки, ячейки памяти, записанные быстрой моделью с прошлого окна
+(`memory.WriteTrackingMemory`), и позиция ввода (она только растет, так как окно повторяет начало периода).
+Вывод окон отбрасывается.
+Окна не меняют состояние быстрой модели.
+
+Число тактов всей программы оценивается отношением: такты окон / инструкции окон * все инструкции.
+Доверительный интервал строится по стандартной ошибке оценки отношения (нормальное приближение),
+поэтому при одном окне интервал вырождается в точку. Если окна покрывают всю программу (`window == period`),
+оценка совпадает с точным числом тактов microcoded модели.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+from statistics import NormalDist
+from typing import NamedTuple
+
+import machine_hw
+import machine_mc
+from data_path import DataPath
+from isa import read_data_and_code
+from memory import WriteTrackingMemory
+from stop_conditions import StopConditions, StopReason
+
+DEFAULT_PERIOD = 100_000
+DEFAULT_WINDOW = 1_000
+DEFAULT_CONFIDENCE = 0.95
+
+
+class Sample(NamedTuple):
+    """Точное окно: номер первой инструкции, число инструкций и тактов microcoded модели."""
+
+    start: int
+    instructions: int
+    ticks: int
+
+
+class SamplingResult(NamedTuple):
+    instructions: int
+    outcome: StopReason
+    output: str
+    samples: list[Sample]
+    ticks: int
+    ticks_low: int
+    ticks_high: int
+    confidence: float
+
+    def report(self):
+        sampled = sum(sample.instructions for sample in self.samples)
+        return (
+            f"instr_counter: {self.instructions} outcome: {self.outcome}\n"
+            f"samples: {len(self.samples)} sampled instructions: {sampled} "
+            f"({sampled / self.instructions if self.instructions else 0:.1%})\n"
+            f"ticks: ~{self.ticks} [{self.ticks_low}, {self.ticks_high}] at {self.confidence:.0%} confidence"
+        )
+
+
+def estimate_ticks(samples: list[Sample], instructions: int, confidence: float = DEFAULT_CONFIDENCE):
+    """Оценка тактов программы из instructions инструкций по окнам: (оценка, нижняя граница, верхняя граница)."""
+    sampled_instructions = sum(sample.instructions for sample in samples)
+    if not sampled_instructions:
+        return 0, 0, 0
+    ratio = sum(sample.ticks for sample in samples) / sampled_instructions
+    estimate = instructions * ratio
+    count = len(samples)
+    if count < 2:
+        return round(estimate), round(estimate), round(estimate)
+    # стандартная ошибка оценки отношения по отклонениям окон от общего CPI
+    deviation = sum((sample.ticks - ratio * sample.instructions) ** 2 for sample in samples) / (count - 1)
+    error = math.sqrt(deviation / count) / (sampled_instructions / count)
+    margin = instructions * NormalDist().inv_cdf((1 + confidence) / 2) * error
+    return round(estimate), math.floor(estimate - margin), math.ceil(estimate + margin)
+
+
+def hand_off(fast, detailed):
+    """Переводит microcoded модель в архитектурное состояние быстрой модели (на границе инструкций)."""
+    source, target = fast.data_path, detailed.data_path
+    detailed.program_counter = fast.program_counter
+    detailed.microprogram_counter = detailed.prev_mpc = 0
+    # ячейки выше указателей стеков читаются только после записи
+    detailed.return_stack_pointer = fast.return_stack_pointer
+    detailed.return_stack[: fast.return_stack_pointer + 1] = fast.return_stack[: fast.return_stack_pointer + 1]
+    target.tos, target.tos1, target.stack_pointer = source.tos, source.tos1, source.stack_pointer
+    target.stack[: source.stack_pointer + 1] = source.stack[: source.stack_pointer + 1]
+
+    memory = source.data_memory
+    for address in memory.written:
+        target.data_memory[address] = memory[address]
+    memory.written.clear()
+    target.input_buffer.skip(source.input_buffer.consumed - target.input_buffer.consumed)
+    target.output_buffer.reset("", 0)
+
+
+def detailed_window(detailed, start: int, window: int):
+    """Исполняет окно microcoded моделью. start -- номер первой инструкции окна."""
+    ticks = detailed.current_tick()
+    instructions = 0
+    try:
+        for _ in range(window):
+            detailed.step()
+            instructions += 1
+    except (StopIteration, EOFError):
+        pass
+    return Sample(start, instructions, detailed.current_tick() - ticks)
+
+
+def simulate_sampled(
+    data,
+    code,
+    input_text: str = "",
+    period: int = DEFAULT_PERIOD,
+    window: int = DEFAULT_WINDOW,
+    confidence: float = DEFAULT_CONFIDENCE,
+    limit: int | None = None,
+):
+    assert 0 < window <= period, "Window must be positive and not longer than the period"
+    fast = machine_hw.ControlUnit(code, DataPath(WriteTrackingMemory(data), input_text), "jit")
+    detailed = machine_mc.ControlUnit(code, DataPath(list(data), input_text))
+    samples = []
+    instructions = 0
+    while True:
+        hand_off(fast, detailed)
+        sample = detailed_window(detailed, instructions, window)
+        if sample.instructions:
+            samples.append(sample)
+        batch = period if limit is None else min(period, limit - instructions)
+        # конец периода -- пауза; остановка по лимиту инструкций журналируется, как обычно
+        last = limit is not None and instructions + batch == limit
+        _, executed, _ = fast.run(stop=StopConditions(max_instructions=batch, pause=not last))
+        instructions += executed
+        if fast.stop_reason is not StopReason.PAUSE:
+            break
+
+    ticks, low, high = estimate_ticks(samples, instructions, confidence)
+    output = fast.data_path.output_buffer.getvalue()
+    return SamplingResult(instructions, fast.stop_reason, output, samples, ticks, low, high, confidence)
+
+
+def main(
+    code_file, input_file, period=DEFAULT_PERIOD, window=DEFAULT_WINDOW, confidence=DEFAULT_CONFIDENCE, limit=None
+):
+    data, code = read_data_and_code(code_file)
+    with open(input_file, encoding="utf-8") as file:
+        input_text = file.read()
+    result = simulate_sampled(data, code, input_text, period, window, confidence, limit)
+    print(result.output)
+    print(result.report())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s   %(module)s:%(funcName)s           %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Выборочное моделирование: оценка тактов microcoded модели")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--period", type=int, default=DEFAULT_PERIOD, help="instructions between detailed windows")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="instructions per detailed window")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--limit", type=int, default=0, help="instruction limit, 0 - unlimited")
+    args = parser.parse_args()
+    main(args.code_file, args.input_file, args.period, args.window, args.confidence, args.limit or None)
@@ -0,0 +1,146 @@
+"""Карта исходного кода: связь адресов машинного кода с токенами программы на Forth.
+
+Карту строит транслятор (`translator.translate(..., source_map=True)`). Она содержит:
+ - диапазоны адресов инструкций `[start, end)` с позицией, текстом терма и словом (процедурой `:`),
+   внутри которого терм находится (None -- код вне процедур);
+ - адреса входа процедур;
+ - адреса переменных в памяти данных.
+
+Инструкции без терма (завершающий HALT) в карту не попадают.
+
+Транслятор с флагом `--source-map` записывает карту рядом с машинным кодом, в файл `<target>.map` (JSON).
+Тексты термов и имена слов хранятся в таблицах строк, диапазон -- строка из шести чисел.
+Модели, профилировщик и совместное моделирование находят карту по имени файла машинного кода
+(`find_source_map`) и читают ее только при первом обращении (`LazySourceMap`).
+"""
+
+from __future__ import annotations
+
+import json
+import pathlib
+from bisect import bisect_right
+from typing import NamedTuple
+
+# Имя слова для кода вне процедур (в отчетах профилировщика и стеках вызовов)
+MAIN_WORD = "main"
+SIDECAR_SUFFIX = ".map"
+FORMAT_VERSION = 1
+
+
+class SourceRange(NamedTuple):
+    """Инструкции с адресами [start, end), порожденные одним термом."""
+
+    start: int
+    end: int
+    line: int
+    column: int
+    term: str
+    word: str | None
+
+    def location(self):
+        return f"{self.line}:{self.column}"
+
+
+class SourceMap:
+    ranges = None
+    functions = None
+    variables = None
+
+    def __init__(self, ranges: list[SourceRange], functions: dict[str, int], variables: dict[str, int]):
+        """ranges -- непересекающиеся диапазоны в порядке адресов."""
+        self.ranges: list[SourceRange] = ranges
+        self.functions: dict[str, int] = functions
+        self.variables: dict[str, int] = variables
+        self._starts = [source_range.start for source_range in ranges]
+
+    def lookup(self, address: int):
+        """Диапазон, содержащий address, или None."""
+        index = bisect_right(self._starts, address) - 1
+        if index >= 0 and address < self.ranges[index].end:
+            return self.ranges[index]
+        return None
+
+    def word(self, address: int):
+        """Имя слова, которому принадлежит инструкция (MAIN_WORD для кода вне процедур)."""
+        source_range = self.lookup(address)
+        if source_range is None or source_range.word is None:
+            return MAIN_WORD
+        return source_range.word
+
+    def line(self, address: int):
+        """Номер строки исходного кода (None для инструкций без терма)."""
+        source_range = self.lookup(address)
+        return None if source_range is None else source_range.line
+
+    def describe(self, address: int):
+        """Позиция инструкции в исходном коде для сообщений: `строка:столбец 'терм' in слово`."""
+        source_range = self.lookup(address)
+        if source_range is None:
+            return f"address {address}: no source"
+        return f"{source_range.location()} {source_range.term!r} in {source_range.word or MAIN_WORD}"
+
+    def write(self, path: str):
+        terms = sorted({source_range.term for source_range in self.ranges})
+        words = sorted({source_range.word for source_range in self.ranges if source_range.word is not None})
+        term_index = {term: i for i, term in enumerate(terms)}
+        word_index = {word: i for i, word in enumerate(words)}
+        document = {
+            "version": FORMAT_VERSION,
+            "terms": terms,
+            "words": words,
+            # start, end, line, column, номер терма, номер слова (-1 -- вне процедур)
+            "ranges": [
+                [r.start, r.end, r.line, r.column, term_index[r.term], word_index.get(r.word, -1)] for r in self.ranges
+            ],
+            "functions": self.functions,
+            "variables": self.variables,
+        }
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def read(cls, path: str):
+        with open(path, encoding="utf-8") as file:
+            document = json.load(file)
+        assert document.get("version") == FORMAT_VERSION, f"Unsupported source map version in {path}"
+        terms, words = document["terms"], document["words"]
+        ranges = [
+            SourceRange(start, end, line, column, terms[term], words[word] if word >= 0 else None)
+            for start, end, line, column, term, word in document["ranges"]
+        ]
+        return cls(ranges, document["functions"], document["variables"])
+
+    def __repr__(self):
+        return f"SourceMap(ranges={len(self.ranges)}, functions={len(self.functions)}, variables={len(self.variables)})"
+
+
+class LazySourceMap:
+    """Карта исходного кода из файла, который читается при первом обращении к карте."""
+
+    path = None
+    _source_map = None
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def load(self):
+        if self._source_map is None:
+            self._source_map = SourceMap.read(self.path)
+        return self._source_map
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._source_map is not None else "not loaded"
+        return f"LazySourceMap({self.path!r}, {state})"
+
+
+def sidecar_path(code_file: str):
+    return code_file + SIDECAR_SUFFIX
+
+
+def find_source_map(code_file: str, path: str | None = None):
+    """Карта для файла машинного кода: явно заданный path или `<code_file>.map`, если он есть. Иначе None."""
+    path = path or sidecar_path(code_file)
+    return LazySourceMap(path) if pathlib.Path(path).exists() else None
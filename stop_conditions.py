@@ -0,0 +1,141 @@
+"""Условия остановки моделирования.
+
+Лимит инструкций и точки останова (по адресу инструкции) проверяются точно.
+С `pause=True` достижение лимита инструкций -- пауза (`StopReason.PAUSE`, без сообщения в журнале):
+моделирование будет продолжено следующим вызовом run.
+Остальные условия (лимит тактов, ограничение по времени, шаблон в выводе) проверяются пакетно --
+раз в `check_interval` шагов модели, поэтому модель может выполнить до `check_interval` лишних шагов.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from enum import Enum
+
+DEFAULT_INSTRUCTION_LIMIT = 1000
+DEFAULT_CHECK_INTERVAL = 1024
+
+
+class StopReason(str, Enum):
+    HALT = "halt"
+    INPUT_EMPTY = "input_empty"
+    INSTRUCTION_LIMIT = "instruction_limit"
+    TICK_LIMIT = "tick_limit"
+    TIME_BUDGET = "time_budget"
+    OUTPUT_PATTERN = "output_pattern"
+    BREAKPOINT = "breakpoint"
+    PAUSE = "pause"
+
+    def __str__(self):
+        return str(self.value)
+
+
+# Сообщения журнала для условий, проверяемых в StopConditions.check. PAUSE не журналируется
+STOP_MESSAGES = {
+    StopReason.INSTRUCTION_LIMIT: "Limit exceeded!",
+    StopReason.TICK_LIMIT: "Tick limit exceeded!",
+    StopReason.TIME_BUDGET: "Time budget exceeded!",
+    StopReason.OUTPUT_PATTERN: "Output pattern found!",
+}
+
+
+class BreakpointReachedError(Exception):
+    def __init__(self, program_counter: int):
+        super().__init__(f"Breakpoint reached at PC {program_counter}")
+        self.program_counter = program_counter
+
+
+class StopConditions:
+    max_instructions = None
+    max_ticks = None
+    time_budget = None
+    output_pattern = None
+    breakpoints = None
+    check_interval = None
+    pause = None
+
+    # Сколько последних символов вывода просматривается повторно, чтобы найти совпадение на границе пакетов
+    OUTPUT_OVERLAP = 256
+
+    def __init__(
+        self,
+        max_instructions: int | None = DEFAULT_INSTRUCTION_LIMIT,
+        max_ticks: int | None = None,
+        time_budget: float | None = None,
+        output_pattern: str | None = None,
+        breakpoints=(),
+        check_interval: int = DEFAULT_CHECK_INTERVAL,
+        pause: bool = False,
+    ):
+        assert check_interval > 0, "Check interval must be positive"
+        self.max_instructions: int | None = max_instructions
+        self.max_ticks: int | None = max_ticks
+        self.time_budget: float | None = time_budget
+        self.output_pattern: re.Pattern | None = re.compile(output_pattern) if output_pattern is not None else None
+        self.breakpoints: frozenset[int] = frozenset(breakpoints)
+        self.check_interval: int = check_interval
+        self.pause: bool = pause
+
+        self._deadline = None
+        self._output_tail = ""
+
+    def start(self, output_buffer=None):
+        """Вызывается моделью перед началом моделирования. output_buffer -- устройство вывода модели."""
+        self._deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+        self._output_tail = ""
+        if self.output_pattern is not None and output_buffer is not None:
+            # вывод может уйти в приемник до проверки, поэтому новый текст копируется устройством
+            output_buffer.capture = []
+
+    def batch_size(self, instr_counter: int):
+        """Количество шагов до следующей проверки. Не выходит за лимит инструкций."""
+        if self.max_instructions is None:
+            return self.check_interval
+        return max(0, min(self.check_interval, self.max_instructions - instr_counter))
+
+    def check(self, instr_counter: int, tick: int, output_buffer):
+        """Пакетная проверка условий. Возвращает причину остановки или None."""
+        if self.max_instructions is not None and instr_counter >= self.max_instructions:
+            return StopReason.PAUSE if self.pause else StopReason.INSTRUCTION_LIMIT
+        if self.max_ticks is not None and tick >= self.max_ticks:
+            return StopReason.TICK_LIMIT
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            return StopReason.TIME_BUDGET
+        if self.output_pattern is not None and self._output_matches(output_buffer):
+            return StopReason.OUTPUT_PATTERN
+        return None
+
+    def _output_matches(self, output_buffer):
+        if not output_buffer.capture:
+            return False
+        text = self._output_tail + "".join(output_buffer.capture)
+        output_buffer.capture.clear()
+        self._output_tail = text[-self.OUTPUT_OVERLAP :]
+        return self.output_pattern.search(text) is not None
+
+
+def add_stop_arguments(parser):
+    """Добавляет в argparse-парсер параметры условий остановки."""
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_INSTRUCTION_LIMIT,
+        help="instruction limit, 0 - unlimited",
+    )
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--time-budget", type=float, default=None, help="wall-clock budget in seconds")
+    parser.add_argument("--stop-on-output", default=None, metavar="REGEX")
+    parser.add_argument("--break", dest="breakpoints", type=int, action="append", default=[], metavar="PC")
+    parser.add_argument("--check-interval", type=int, default=DEFAULT_CHECK_INTERVAL)
+
+
+def stop_conditions_from_args(args):
+    return StopConditions(
+        max_instructions=args.limit or None,
+        max_ticks=args.max_ticks,
+        time_budget=args.time_budget,
+        output_pattern=args.stop_on_output,
+        breakpoints=args.breakpoints,
+        check_interval=args.check_interval,
+    )
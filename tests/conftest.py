@@ -0,0 +1,17 @@
+import pathlib
+
+import models
+from data_path import DataPath
+
+ALGORITHMS = pathlib.Path(__file__).parent.parent / "algorithms"
+
+
+def read_algorithm(name, prob1_bound=None):
+    """Исходный код программы из algorithms. prob1_bound -- сократить prob1 (граница вместо 1000)."""
+    source = (ALGORITHMS / f"{name}.fth").read_text(encoding="utf-8")
+    return source if prob1_bound is None else source.replace("1000 prob1", f"{prob1_bound} prob1")
+
+
+def make_control_unit(model, engine, data, code, input_text="", **options):
+    """Модель для программы (data, code) со свежими памятью данных и вводом input_text."""
+    return models.make_control_unit(model, code, DataPath(list(data), input_text), engine, **options)
@@ -0,0 +1,34 @@
+import batch
+import pytest
+import translator
+
+from tests.conftest import read_algorithm
+
+
+@pytest.mark.parametrize(("model", "engine"), [("hw", "dispatch"), ("hw", "jit"), ("mc", "compiled")])
+def test_batch_is_deterministic(model, engine):
+    data, code = translator.translate(read_algorithm("hello_username"))
+    job = batch.BatchJob(data, code, model, engine)
+    inputs = [f"user{i}\n" for i in range(20)]
+
+    sequential = list(batch.run_batch(job, iter(inputs), workers=0))
+    parallel = list(batch.run_batch(job, iter(inputs), workers=3, chunksize=2, window=2))
+    unordered = list(batch.run_batch(job, iter(inputs), workers=2, ordered=False))
+
+    assert [result.index for result in sequential] == list(range(len(inputs)))
+    assert parallel == sequential
+    assert sorted(unordered) == sequential
+    assert sequential[7].output.endswith("Hello, user7\n")
+
+
+def test_interleaved_batches_keep_their_jobs():
+    jobs = [batch.BatchJob(*translator.translate(read_algorithm(name))) for name in ("hello_username", "cat")]
+    inputs = [f"user{i}\n" for i in range(6)]
+    expected = [list(batch.run_batch(job, iter(inputs), workers=0)) for job in jobs]
+
+    # пулы второго генератора создаются, пока первый еще не закончил работу
+    generators = [batch.run_batch(job, iter(inputs), workers=2, window=1) for job in jobs]
+    results = [[next(generator)] for generator in generators]
+    for generator, collected in zip(generators, results):
+        collected.extend(generator)
+    assert results == expected
@@ -0,0 +1,24 @@
+from benchmarks.suite import compare
+
+
+def result(seconds: float, throughput: float):
+    return {"seconds": seconds, "throughput": throughput}
+
+
+def test_compare():
+    baseline = {
+        "slow": result(0.1, 1000),
+        "fast": result(0.1, 1000),
+        "noise": result(0.0001, 1000),
+        "gone": result(0.1, 1000),
+    }
+    results = {
+        "slow": result(0.2, 700),
+        "fast": result(0.08, 1300),
+        "noise": result(0.0003, 300),
+        "new": result(0.1, 1),
+    }
+    # короткие измерения и измерения без базовых результатов не сравниваются
+    assert compare(results, baseline, 0.2) == [("slow", 0.7)]
+    assert compare(results, baseline, 0.4) == []
+    assert compare(results, baseline, 0.2, min_seconds=0) == [("slow", 0.7), ("noise", 0.3)]
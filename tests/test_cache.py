@@ -0,0 +1,87 @@
+import machine_hw
+import models
+import pytest
+import translator
+from cache import Cache
+from data_path import DataPath
+from stop_conditions import StopConditions
+
+from tests.conftest import make_control_unit, read_algorithm
+
+
+def run_accesses(cache, accesses):
+    for address, write in accesses:
+        cache.access(address, write)
+    return cache
+
+
+def test_direct_mapped_conflicts():
+    # адреса 0 и 8 попадают в одно множество кэша из 2 строк по 4 ячейки
+    cache = run_accesses(Cache(lines=2, line_size=4, miss_ticks=10), [(0, False), (8, False), (1, False), (9, False)])
+    assert (cache.hits.total(), cache.misses.total(), cache.stall_ticks) == (0, 4, 40)
+
+    cache = run_accesses(Cache(lines=2, line_size=4, ways=2), [(0, False), (8, False), (1, False), (9, False)])
+    assert cache.address_stats() == {0: (0, 1), 1: (1, 0), 8: (0, 1), 9: (1, 0)}
+
+
+@pytest.mark.parametrize(("replacement", "misses"), [("lru", 3), ("fifo", 4)])
+def test_replacement(replacement, misses):
+    # полностью ассоциативный кэш на 2 строки: после обращения к 0 LRU вытесняет 1, а FIFO -- 0
+    cache = Cache(lines=2, line_size=1, ways=0, replacement=replacement)
+    run_accesses(cache, [(0, False), (1, False), (0, False), (2, False), (0, False)])
+    assert cache.misses.total() == misses
+
+
+def test_write_policies():
+    accesses = [(5, True), (5, True), (5, False), (6, False)]
+    back = run_accesses(Cache(lines=1, line_size=1, hit_ticks=1, miss_ticks=10), accesses)
+    # запись с размещением, измененная строка записывается в память при вытеснении
+    assert (back.misses.total(), back.writebacks, back.stall_ticks) == (2, 1, 10 + 1 + 1 + 10 + 10)
+
+    through = run_accesses(Cache(lines=1, line_size=1, hit_ticks=1, miss_ticks=10, write_policy="through"), accesses)
+    # каждая запись идет в память, промах записи не размещает строку
+    assert (through.misses.total(), through.writebacks, through.stall_ticks) == (4, 0, 10 + 10 + 10 + 10)
+
+
+def test_cache_adds_stall_ticks():
+    source = read_algorithm("hello_username")
+    data, code = translator.translate(source)
+    results = {}
+    for model, engine in [("hw", engine) for engine in machine_hw.ENGINES] + [("mc", "compiled"), ("mc", "interpret")]:
+        for cache in (None, Cache(lines=4, line_size=2, miss_ticks=5)):
+            data_path = DataPath(list(data), "Alice\n", cache=cache)
+            control_unit = models.make_control_unit(model, code, data_path, engine)
+            output, instr_counter, ticks = control_unit.run(stop=StopConditions(max_instructions=None))
+            results[model, engine, cache is not None] = (output, instr_counter, ticks, data_path.stall_ticks())
+
+    for (model, engine, cached), (output, instr_counter, ticks, stall_ticks) in results.items():
+        if cached:
+            plain = results[model, engine, False]
+            assert (output, instr_counter) == plain[:2]
+            assert stall_ticks > 0
+            assert ticks == plain[2] + stall_ticks
+
+
+def test_prefetch():
+    cache = run_accesses(Cache(lines=4, line_size=2, prefetch=True), [(address, False) for address in range(8)])
+    # промах загружает и следующую строку, поэтому промахивается каждая вторая строка
+    assert (cache.misses.total(), cache.prefetches) == (2, 2)
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_instruction_cache(prefetch):
+    source = read_algorithm("hello_username")
+    data, code = translator.translate(source)
+    stats = set()
+    for model, engine in [("hw", engine) for engine in machine_hw.ENGINES] + [("mc", "compiled"), ("mc", "interpret")]:
+        results = []
+        for icache in (None, Cache(lines=8, line_size=4, ways=2, miss_ticks=3, prefetch=prefetch)):
+            control_unit = make_control_unit(model, engine, data, code, "Alice\n", instruction_cache=icache)
+            results.append(control_unit.run(stop=StopConditions(max_instructions=None)))
+        (output, instr_counter, ticks), (icache_output, icache_instr_counter, icache_ticks) = results
+        assert (icache_output, icache_instr_counter) == (output, instr_counter)
+        assert icache_ticks == ticks + icache.stall_ticks
+        stats.add((icache.stall_ticks, tuple(icache.address_stats().items())))
+
+    # все движки обеих моделей выбирают одни и те же инструкции
+    assert len(stats) == 1
@@ -0,0 +1,127 @@
+import logging
+
+import machine_hw
+import pytest
+import translator
+from checkpoint import (
+    decode_snapshot,
+    encode_snapshot,
+    read_snapshot,
+    restore_snapshot,
+    run_with_checkpoints,
+    take_snapshot,
+)
+from data_path import DataPath
+from memory import SparseMemory
+from stop_conditions import StopConditions
+
+from tests.conftest import make_control_unit, read_algorithm
+
+MODELS = [("hw", "interpret"), ("hw", "dispatch"), ("hw", "jit"), ("mc", "compiled"), ("mc", "interpret")]
+
+
+def run(control_unit, limit=None):
+    return control_unit.run(stop=StopConditions(max_instructions=limit))
+
+
+def translate(name):
+    return translator.translate(read_algorithm(name, prob1_bound=50))
+
+
+@pytest.mark.parametrize(("model", "engine"), MODELS)
+@pytest.mark.parametrize(("name", "split"), [("hello_username", 300), ("prob1", 1000)])
+def test_restore_continues_run(name, split, model, engine):
+    data, code = translate(name)
+    uninterrupted = make_control_unit(model, engine, data, code, "Alice\n")
+    expected = run(uninterrupted)
+
+    first = make_control_unit(model, engine, data, code, "Alice\n")
+    _, instructions, _ = run(first, split)
+    snapshot = decode_snapshot(encode_snapshot(take_snapshot(first, instructions)))
+
+    second = make_control_unit(model, engine, data, code, "Alice\n")
+    assert restore_snapshot(second, snapshot) == split
+    output, executed, ticks = run(second)
+    assert (output, split + executed, ticks) == expected
+    assert take_snapshot(second) == take_snapshot(uninterrupted)
+
+
+@pytest.mark.parametrize("name", ["hello_username", "prob1"])
+def test_switch_from_fast_model_to_microcode(name):
+    data, code = translate(name)
+    expected_output, _, _ = run(make_control_unit("mc", "compiled", data, code, "Alice\n"))
+
+    fast = make_control_unit("hw", "jit", data, code, "Alice\n")
+    run(fast, 500)
+    detailed = make_control_unit("mc", "compiled", data, code, "Alice\n")
+    restore_snapshot(detailed, take_snapshot(fast))
+    output, _, ticks = run(detailed)
+    assert output == expected_output
+    assert ticks > fast.current_tick()
+
+
+def test_snapshot_encoding():
+    data, code = translator.translate("1 2 3")
+    control_unit = make_control_unit("hw", "dispatch", data, code, "")
+    run(control_unit)
+    control_unit.data_path.tos = -(1 << 70)  # zigzag LEB128 кодирует и числа шире слова
+    control_unit.data_path.output_buffer.write("вывод")
+    snapshot = take_snapshot(control_unit, 3)
+    encoded = encode_snapshot(snapshot)
+    assert encoded.startswith(b"FTHS")
+    assert decode_snapshot(encoded) == snapshot
+
+
+def test_restore_checks_program():
+    data, code = translator.translate("1 2 +")
+    other_data, other_code = translator.translate("1 2 -")
+    snapshot = take_snapshot(make_control_unit("hw", "dispatch", data, code, ""))
+    with pytest.raises(AssertionError, match="Snapshot of another program"):
+        restore_snapshot(make_control_unit("hw", "dispatch", other_data, other_code, ""), snapshot)
+
+
+def test_periodic_checkpoints_resume(tmp_path):
+    data, code = translate("prob1")
+    expected = run(make_control_unit("hw", "dispatch", data, code, ""))
+    path = str(tmp_path / "prob1.snapshot")
+
+    # прерванный запуск: контрольные точки каждые 1000 инструкций и в момент остановки
+    interrupted = make_control_unit("hw", "dispatch", data, code, "")
+    run_with_checkpoints(interrupted, path, interval=1000, limit=2500)
+    snapshot = read_snapshot(path)
+    assert snapshot.instructions == 2500
+
+    resumed = make_control_unit("hw", "jit", data, code, "")
+    instructions = restore_snapshot(resumed, snapshot)
+    assert run_with_checkpoints(resumed, path, interval=1000, instructions=instructions) == expected
+
+
+def test_checkpoints_do_not_log_limit(tmp_path, caplog):
+    # промежуточные контрольные точки -- паузы, предупреждение только при остановке по лимиту
+    data, code = translate("hello_world")
+    path = str(tmp_path / "hello_world.snapshot")
+    with caplog.at_level(logging.WARNING):
+        output, _, _ = run_with_checkpoints(make_control_unit("hw", "dispatch", data, code, ""), path, interval=20)
+    assert output == "Hello World!"
+    assert not caplog.records
+
+    with caplog.at_level(logging.WARNING):
+        run_with_checkpoints(make_control_unit("mc", "compiled", data, code, ""), path, interval=20, limit=50)
+    assert [record.getMessage() for record in caplog.records] == ["Limit exceeded!"]
+    assert read_snapshot(path).instructions == 50
+
+
+def test_sparse_memory_snapshot():
+    data, code = translator.translate("1 2 3")
+    memory = SparseMemory(data)
+    memory[(1 << 32) - 1] = 7
+    control_unit = machine_hw.ControlUnit(code, DataPath(memory, ""), "dispatch")
+    run(control_unit)
+    snapshot = decode_snapshot(encode_snapshot(take_snapshot(control_unit)))
+    # сохраняются только выделенные страницы
+    assert [(start, len(values)) for start, values in snapshot.memory] == [(0, 1024), ((1 << 32) - 1024, 1024)]
+
+    restored = machine_hw.ControlUnit(code, DataPath(SparseMemory([5] * 2000), ""), "dispatch")
+    restore_snapshot(restored, snapshot)
+    assert len(restored.data_path.data_memory.pages) == 2
+    assert take_snapshot(restored) == take_snapshot(control_unit)
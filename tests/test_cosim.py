@@ -0,0 +1,56 @@
+import machine_hw
+import machine_mc
+import pytest
+import translator
+from cosim import cosimulate, lockstep
+from data_path import DataPath
+from isa import Opcode
+from memory import WriteTrackingMemory
+
+from tests.conftest import read_algorithm
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("hw_engine", machine_hw.ENGINES)
+@pytest.mark.parametrize("name", ["cat", "hello_world", "hello_username", "prob1"])
+def test_models_agree(name, hw_engine, fuse):
+    data, code = translator.translate(read_algorithm(name), fuse=fuse)
+    result = cosimulate(data, code, "Alice\n", max_instructions=None, hw_engine=hw_engine)
+    assert result.divergence is None
+    assert result.outcome == "halt"
+
+
+def test_first_divergence_is_reported():
+    data, code, source_map = translator.translate("1 2 + 3 + 0 ! 4 0 !", source_map=True)
+    # microcoded модель получает программу, в которой изменен литерал 3
+    broken = list(code)
+    address = next(i for i, instr in enumerate(broken) if instr.opcode is Opcode.LIT and instr.arg == 3)
+    broken[address] = broken[address]._replace(arg=5)
+
+    hw = machine_hw.ControlUnit(code, DataPath(WriteTrackingMemory(data)), "dispatch")
+    mc = machine_mc.ControlUnit(broken, DataPath(WriteTrackingMemory(data)))
+    result = lockstep(hw, mc, max_instructions=None, source_map=source_map)
+
+    assert result.divergence.instruction == address + 1
+    assert result.divergence.fields == ("tos", "stack")
+    report = result.divergence.report()
+    assert "Models diverged at instruction" in report
+    assert "source: 1:7 '3' in main" in report
+    assert "tos: hw=3 mc=5" in report
+    assert "machine_mc trace:" in report
+
+
+def test_memory_divergence_shows_written_cells():
+    data, code = translator.translate("variable x variable y 5 x +! 1 .", fuse=True)
+    # microcoded модель прибавляет к соседней переменной: регистры после ADD_STORE совпадают, память -- нет
+    broken = list(code)
+    address = next(i for i, instr in enumerate(broken) if instr.opcode is Opcode.ADD_STORE)
+    broken[address] = broken[address]._replace(arg=broken[address].arg + 1)
+
+    hw = machine_hw.ControlUnit(code, DataPath(WriteTrackingMemory(data)), "dispatch")
+    mc = machine_mc.ControlUnit(broken, DataPath(WriteTrackingMemory(data)))
+    result = lockstep(hw, mc, max_instructions=None)
+    assert result.divergence.instruction == address + 1
+    assert result.divergence.fields == ("data_memory",)
+    x = code[address].arg
+    assert f"data_memory: hw={{{x}: 5, {x + 1}: 0}} mc={{{x}: 0, {x + 1}: 5}}" in result.divergence.report()
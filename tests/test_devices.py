@@ -0,0 +1,107 @@
+import io
+
+import machine_hw
+import pytest
+import translator
+from data_path import DataPath
+from devices import InputDevice, OutputDevice
+from stop_conditions import StopConditions, StopReason
+
+from tests.conftest import read_algorithm
+
+
+def read_all(device):
+    chars = []
+    while code := device.read():
+        chars.append(chr(code))
+    return "".join(chars)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "héllo\nёж",
+        list("héllo\nёж"),
+        "héllo\nёж".encode(),
+        io.StringIO("héllo\nёж"),
+        io.BytesIO("héllo\nёж".encode()),
+        iter(["hé", "", "llo\nё", "ж"]),
+    ],
+)
+def test_input_device_sources(source):
+    device = InputDevice(source, chunk_size=3)
+
+    assert read_all(device) == "héllo\nёж"
+    assert device.consumed == 8
+    assert device.read() == 0
+
+
+class FakeStreamWriter:
+    """Интерфейс asyncio.StreamWriter: write(bytes) и drain()."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def test_output_device_sinks():
+    text_file, binary_file, writer, chunks = io.StringIO(), io.BytesIO(), FakeStreamWriter(), []
+    for sink in (text_file, binary_file, writer, chunks.append):
+        device = OutputDevice(sink, buffer_size=4)
+        for text in ("hé", "l", "lo", "\n", "ё"):
+            device.write(text)
+        device.flush()
+        assert device.getvalue() == ""
+        assert device.written == 7
+
+    assert text_file.getvalue() == "héllo\nё"
+    assert binary_file.getvalue().decode() == "héllo\nё"
+    assert writer.data.decode() == "héllo\nё"
+    # буфер сбрасывается, когда в нем не меньше 4 символов, и в flush
+    assert chunks == ["héllo", "\nё"]
+
+
+def test_output_device_line_buffering():
+    chunks = []
+    device = OutputDevice(chunks.append, line_buffering=True)
+    for char in "ab\ncd":
+        device.write(char)
+    assert chunks == ["ab\n"]
+    assert device.getvalue() == "cd"
+
+
+def test_output_device_reset():
+    device = OutputDevice()
+    device.write("lost")
+    device.reset("kept", 10)
+    device.write("!")
+    assert (device.getvalue(), device.written) == ("kept!", 11)
+
+    chunks = []
+    device = OutputDevice(chunks.append, buffer_size=4)
+    device.reset("abc", 3)
+    assert chunks == []
+    # восстановленный несброшенный вывод учитывается при заполнении буфера
+    device.write("d")
+    assert chunks == ["abcd"]
+
+
+def test_streaming_output_and_pattern():
+    data, code = translator.translate(read_algorithm("cat"))
+    sink = io.StringIO()
+    data_path = DataPath(list(data), "foo\nbar\nbaz\n", OutputDevice(sink, buffer_size=2))
+    control_unit = machine_hw.ControlUnit(code, data_path, "dispatch")
+    stop = StopConditions(max_instructions=None, output_pattern="bar", check_interval=1)
+
+    output, _, _ = control_unit.run(stop=stop)
+
+    # вывод ушел в приемник, но шаблон найден
+    assert output == ""
+    assert control_unit.stop_reason == StopReason.OUTPUT_PATTERN
+    assert sink.getvalue().startswith("foo\nbar")
+    assert "baz" not in sink.getvalue()
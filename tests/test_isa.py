@@ -0,0 +1,56 @@
+import pytest
+import translator
+from isa import (
+    BinaryCode,
+    Instruction,
+    Opcode,
+    ProgramImage,
+    read_data_and_code,
+    write_binary_data_and_code,
+    write_data_and_code,
+)
+
+from tests.conftest import read_algorithm
+
+
+def test_binary_round_trip(tmp_path):
+    data, code = translator.translate(read_algorithm("prob1"), fuse=True)
+    write_binary_data_and_code(tmp_path / "prob1.bin", data, code)
+    write_data_and_code(tmp_path / "prob1.json", list(data), code)
+
+    binary_data, binary_code = read_data_and_code(tmp_path / "prob1.bin")
+    json_data, json_code = read_data_and_code(tmp_path / "prob1.json")
+
+    assert isinstance(binary_code, BinaryCode)
+    assert binary_data == json_data == data
+    assert [str(instr) for instr in binary_code] == [str(instr) for instr in json_code]
+    assert binary_code[3] is binary_code[3]
+    assert (tmp_path / "prob1.bin").stat().st_size < (tmp_path / "prob1.json").stat().st_size
+
+
+def test_binary_checksum(tmp_path):
+    write_binary_data_and_code(tmp_path / "code.bin", [1, 2, 3], [Instruction(Opcode.LIT, 2), Instruction(Opcode.HALT)])
+    raw = bytearray((tmp_path / "code.bin").read_bytes())
+    raw[-1] ^= 1
+    (tmp_path / "code.bin").write_bytes(raw)
+
+    with pytest.raises(AssertionError, match="checksum"):
+        read_data_and_code(tmp_path / "code.bin")
+
+
+def test_program_image(tmp_path):
+    code = [Instruction(Opcode.LIT, 2), Instruction(Opcode.JNZ, 0), Instruction(Opcode.HALT)]
+    image = ProgramImage.from_code(code)
+
+    assert image.opcodes == [Opcode.LIT, Opcode.JNZ, Opcode.HALT]
+    assert image.args == [2, 0, None]
+    assert list(image) == code
+    assert image[1] == Instruction(Opcode.JNZ, 0)
+    assert ProgramImage.from_code(image) is image
+    with pytest.raises(AttributeError):
+        image[0].arg = 3
+
+    write_binary_data_and_code(tmp_path / "code.bin", [], code)
+    _, binary_code = read_data_and_code(tmp_path / "code.bin")
+    binary_image = ProgramImage.from_code(binary_code)
+    assert (binary_image.opcodes, binary_image.args) == (image.opcodes, image.args)
@@ -2,15 +2,25 @@ import contextlib
 import io
 import logging
 import os
+import subprocess
+import sys
 import tempfile
 
 import machine_hw
+import machine_mc
 import pytest
 import translator
+from data_path import StackError
+from memory import MemoryAccessError
+from stop_conditions import StopConditions, StopReason
+from tracing import TraceLevel
+
+from tests.conftest import read_algorithm
 
 
 @pytest.mark.golden_test("golden/*.yml")
-def test_bar(golden, caplog):
+@pytest.mark.parametrize("engine", machine_hw.ENGINES)
+def test_bar(golden, caplog, engine):
     caplog.set_level(logging.DEBUG)
 
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -29,7 +39,7 @@ def test_bar(golden, caplog):
         with contextlib.redirect_stdout(io.StringIO()) as stdout:
             translator.main(source, target)
             print("=" * 60)
-            machine_hw.main(target, input_stream)
+            machine_hw.main(target, input_stream, engine, trace_level=TraceLevel.FULL)
 
         # Выходные данные также считываем в переменные.
         with open(target, encoding="utf-8") as file:
@@ -39,3 +49,154 @@ def test_bar(golden, caplog):
         assert code == golden.out["out_code"]
         assert stdout.getvalue() == golden.out["out_stdout"]
         assert caplog.text == golden.out["out_log"]
+
+
+@pytest.mark.parametrize("engine", machine_hw.ENGINES)
+def test_trace_ring_buffer(caplog, engine):
+    caplog.set_level(logging.DEBUG)
+    data, code = translator.translate("1 2 + .")
+
+    data_path = machine_hw.DataPath(data, [])
+    control_unit = machine_hw.ControlUnit(code, data_path, engine, TraceLevel.INSTRUCTION, trace_depth=2)
+    control_unit.run(1000)
+
+    # На уровне INSTRUCTION состояния не пишутся в журнал, но последние из них сохраняются
+    assert "TICK" not in caplog.text
+    assert control_unit.tracer.dump() == "\n".join(
+        [
+            "\tTICK:  18\tPC:   4\tTOS:   0\tTOS1:   3\tSP:   3\t\tstore",
+            "\tTICK:  25\tPC:   5\tTOS:   0\tTOS1:   0\tSP:   1\t\thalt",
+        ]
+    )
+
+
+@pytest.mark.parametrize("engine", machine_hw.ENGINES)
+def test_stop_conditions(engine):
+    data, code = translator.translate("begin 1 0 until")
+
+    # точка останова срабатывает перед исполнением инструкции по адресу
+    control_unit = machine_hw.ControlUnit(code, machine_hw.DataPath(list(data), []), engine)
+    _, instr_counter, _ = control_unit.run(stop=StopConditions(max_instructions=None, breakpoints=[3]))
+    assert (control_unit.stop_reason, control_unit.program_counter, instr_counter) == (StopReason.BREAKPOINT, 3, 3)
+
+    # лимит тактов проверяется пакетно, раз в check_interval инструкций
+    control_unit = machine_hw.ControlUnit(code, machine_hw.DataPath(list(data), []), engine)
+    stop = StopConditions(max_instructions=None, max_ticks=100, check_interval=10)
+    _, instr_counter, ticks = control_unit.run(stop=stop)
+    assert control_unit.stop_reason == StopReason.TICK_LIMIT
+    assert instr_counter % 10 == 0
+    assert ticks >= 100
+
+
+def machine_state(control_unit, result):
+    data_path = control_unit.data_path
+    return (
+        result,
+        control_unit.stop_reason,
+        control_unit.program_counter,
+        control_unit.return_stack[: control_unit.return_stack_pointer + 1],
+        (data_path.tos, data_path.tos1, data_path.stack_pointer),
+        data_path.stack[: data_path.stack_pointer + 1],
+        data_path.data_memory.tolist(),
+    )
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize(
+    "stop",
+    [
+        {"max_instructions": None},
+        {"max_instructions": 37},
+        {"max_instructions": None, "breakpoints": [20]},
+        {"max_instructions": None, "max_ticks": 500, "check_interval": 7},
+    ],
+)
+@pytest.mark.parametrize("name", ["cat", "hello_username", "prob1"])
+def test_jit_matches_dispatch(name, stop, fuse):
+    source = read_algorithm(name)
+    data, code = translator.translate(source, fuse=fuse)
+
+    states = []
+    for engine in ("dispatch", "jit"):
+        control_unit = machine_hw.ControlUnit(code, machine_hw.DataPath(list(data), list("Alice\n")), engine)
+        states.append(machine_state(control_unit, control_unit.run(stop=StopConditions(**stop))))
+    assert states[0] == states[1]
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("source", ["1 2 3 99999999 @ .", "variable x 5 x ! 1 2 99999999 ! 7 .", ": f 1 -1 @ ; 4 f"])
+def test_jit_state_after_memory_fault(source, fuse):
+    # исключение внутри блока не отменяет изменения состояния, сделанные блоком до него
+    data, code = translator.translate(source, fuse=fuse)
+    states = []
+    for engine in ("dispatch", "jit"):
+        control_unit = machine_hw.ControlUnit(code, machine_hw.DataPath(list(data), []), engine)
+        with pytest.raises(MemoryAccessError):
+            control_unit.run(stop=StopConditions(max_instructions=None))
+        states.append((*machine_state(control_unit, None), control_unit.current_tick()))
+    assert states[0] == states[1]
+
+
+@pytest.mark.parametrize(
+    ("source", "message", "high_water"),
+    [
+        ("begin 1 0 until", "Data stack overflow: pointer 16, depth 16", (15, 0)),
+        ("1 1 ! !", "Data stack underflow: pointer -1, depth 16", (3, 0)),
+        (": f f ; f", "Return stack overflow: pointer 8, depth 8", (1, 7)),
+    ],
+)
+def test_stack_faults(source, message, high_water):
+    data, code = translator.translate(source)
+    states = []
+    for engine in machine_hw.ENGINES:
+        data_path = machine_hw.DataPath(list(data), [], stack_depth=16)
+        control_unit = machine_hw.ControlUnit(code, data_path, engine, return_stack_depth=8)
+        with pytest.raises(StackError, match=message):
+            control_unit.run(stop=StopConditions(max_instructions=10_000))
+        assert (data_path.stack_high_water, control_unit.return_stack_high_water) == high_water
+        if engine != "interpret":
+            states.append(machine_state(control_unit, None))
+    # jit останавливается на той же инструкции и в том же состоянии, что и dispatch
+    assert states[0] == states[1]
+
+
+def step_ticks(control_unit):
+    """Такты каждой исполненной инструкции по кодам операций: {код операции: множество стоимостей}."""
+    costs = {}
+    with contextlib.suppress(StopIteration, EOFError):
+        for _ in range(5_000):
+            opcode = control_unit.program.opcodes[control_unit.program_counter]
+            start = control_unit.current_tick()
+            control_unit.step()
+            costs.setdefault(opcode, set()).add(control_unit.current_tick() - start)
+    return costs
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("name", ["cat", "hello_username", "prob1"])
+def test_tick_costs_match_models(name, fuse):
+    source = read_algorithm(name)
+    data, code = translator.translate(source, fuse=fuse)
+
+    # таблица hw совпадает с числом вызовов tick() в interpret, таблица mc -- с тактами микрокода
+    if not fuse:
+        hardwired = machine_hw.ControlUnit(code, machine_hw.DataPath(list(data), list("Alice\n")))
+        for opcode, costs in step_ticks(hardwired).items():
+            assert costs == {machine_hw.ControlUnit.TICK_COSTS[opcode]}, opcode
+    microcoded = machine_mc.ControlUnit(code, machine_hw.DataPath(list(data), list("Alice\n")))
+    for opcode, costs in step_ticks(microcoded).items():
+        assert costs == {machine_mc.ControlUnit.TICK_COSTS[opcode]}, opcode
+
+    stop = StopConditions(max_instructions=5_000)
+    output, _, ticks = machine_mc.ControlUnit(code, machine_hw.DataPath(list(data), list("Alice\n"))).run(stop=stop)
+    for engine in ("dispatch", "jit"):
+        data_path = machine_hw.DataPath(list(data), list("Alice\n"))
+        control_unit = machine_hw.ControlUnit(code, data_path, engine, tick_model="mc")
+        assert control_unit.run(stop=stop)[::2] == (output, ticks)
+
+
+def test_translator_does_not_build_microcode():
+    # таблица тактов microcoded модели нужна только при tick_model="mc"
+    script = "import sys, translator, machine_hw; print('machine_mc' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
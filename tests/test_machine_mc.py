@@ -0,0 +1,32 @@
+import machine_mc
+import pytest
+import translator
+from data_path import DataPath
+from stop_conditions import StopConditions
+from tracing import TraceLevel
+
+from tests.conftest import read_algorithm
+
+
+def run_mc(code, data, input_text, engine):
+    control_unit = machine_mc.ControlUnit(
+        code,
+        DataPath(list(data), list(input_text)),
+        trace_level=TraceLevel.MICROINSTRUCTION,
+        trace_depth=None,
+        engine=engine,
+    )
+    result = control_unit.run(stop=StopConditions(max_instructions=2000))
+    return result, control_unit.stop_reason, list(control_unit.tracer.states)
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("name", ["cat", "hello_world", "hello_username", "prob1"])
+def test_compiled_microcode_matches_interpreter(name, fuse):
+    source = read_algorithm(name)
+    data, code = translator.translate(source, fuse=fuse)
+
+    compiled = run_mc(code, data, "Alice\n", "compiled")
+    interpreted = run_mc(code, data, "Alice\n", "interpret")
+
+    assert compiled == interpreted
@@ -0,0 +1,94 @@
+import machine_hw
+import machine_mc
+import pytest
+import translator
+from data_path import DataPath
+from memory import BACKENDS, DenseMemory, Memory, MemoryAccessError, MmapMemory, SparseMemory, make_memory
+from stop_conditions import StopConditions
+
+from tests.conftest import make_control_unit, read_algorithm
+
+
+class GenericClearMemory(DenseMemory):
+    """DenseMemory с общей реализацией clear из Memory."""
+
+    clear = Memory.clear
+
+
+@pytest.mark.parametrize("memory_class", [DenseMemory, SparseMemory, MmapMemory, GenericClearMemory])
+def test_memory_semantics(memory_class):
+    memory = memory_class([1, 2, 3], size=4096)
+    assert memory.tolist() == [1, 2, 3]
+    assert memory[100] == 0
+
+    # запись за концом начальных данных расширяет память, значения циклически приводятся к слову
+    memory[5] = (1 << 31) - 1 + 1
+    memory[4] = -(1 << 31) - 1
+    assert memory.tolist() == [1, 2, 3, 0, (1 << 31) - 1, -(1 << 31)]
+    assert len(memory) == 6
+    assert memory.ranges() == [(0, [1, 2, 3, 0, (1 << 31) - 1, -(1 << 31)])]
+
+    for address in (-1, 4096):
+        with pytest.raises(MemoryAccessError):
+            memory[address] = 1
+        with pytest.raises(MemoryAccessError):
+            _ = memory[address]
+
+    memory.clear()
+    assert (len(memory), memory[5], memory.ranges()) == (0, 0, [])
+    memory.close()
+
+
+def test_sparse_memory_huge_address():
+    memory = SparseMemory()
+    memory[(1 << 32) - 1] = 1 << 31
+    assert memory[(1 << 32) - 1] == -(1 << 31)
+    assert len(memory.pages) == 1
+
+
+def test_mmap_memory_persists(tmp_path):
+    path = str(tmp_path / "memory.bin")
+    memory = MmapMemory([7, 8], size=1024, path=path)
+    memory[10] = 42
+    memory.snapshot(str(tmp_path / "snapshot.bin"))
+    memory[10] = 43
+    memory.close()
+
+    reopened = MmapMemory(size=1024, path=path)
+    assert reopened.tolist() == [7, 8, 0, 0, 0, 0, 0, 0, 0, 0, 43]
+    reopened.close()
+    snapshot = MmapMemory(size=1024, path=str(tmp_path / "snapshot.bin"))
+    assert snapshot[10] == 42
+    snapshot.close()
+
+
+def test_backends_run_same_program():
+    source = read_algorithm("hello_username")
+    data, code = translator.translate(source)
+    results = set()
+    for backend in BACKENDS:
+        data_path = DataPath(make_memory(backend, data), "Alice\n")
+        result = machine_hw.ControlUnit(code, data_path, "jit").run(stop=StopConditions(max_instructions=None))
+        results.add((result, tuple(data_path.data_memory.tolist())))
+        data_path.data_memory.close()
+    assert len(results) == 1
+
+
+@pytest.mark.parametrize(
+    ("model", "engine"),
+    [*(("hw", engine) for engine in machine_hw.ENGINES), *(("mc", engine) for engine in machine_mc.ENGINES)],
+)
+@pytest.mark.parametrize(
+    ("expression", "value"),
+    [
+        ("2147483647 1 +", "-2147483648"),
+        ("-2147483648 1 -", "2147483647"),
+        ("4294967297", "1"),
+        ("0 -2147483648 -", "-2147483648"),
+    ],
+)
+def test_machine_word_is_memory_word(model, engine, expression, value):
+    # значение на стеке и значение, прошедшее через память, -- одно и то же машинное слово
+    data, code = translator.translate(f"variable x {expression} dup x ! . 32 emit x @ . 32 emit 0 @ .")
+    output, _, _ = make_control_unit(model, engine, data, code).run(stop=StopConditions(max_instructions=None))
+    assert output == f"{value} {value} {value}"
@@ -0,0 +1,72 @@
+import machine_hw
+import pytest
+import translator
+from data_path import DataPath
+from profiler import Profile, main, profile_run, profile_source
+from stop_conditions import StopConditions, StopReason
+
+from tests.conftest import ALGORITHMS, make_control_unit, read_algorithm
+
+
+@pytest.mark.parametrize(
+    ("model", "engine"), [("hw", "interpret"), ("hw", "dispatch"), ("hw", "jit"), ("mc", "compiled")]
+)
+@pytest.mark.parametrize("name", ["hello_username", "prob1"])
+def test_profile_matches_run(name, model, engine):
+    source = read_algorithm(name, prob1_bound=100)
+    data, code = translator.translate(source)
+    expected_output, instructions, ticks = make_control_unit(model, engine, data, code, "Alice\n").run(
+        stop=StopConditions(max_instructions=None)
+    )
+
+    profile, output = profile_source(source, "Alice\n", model, engine, limit=None)
+    assert profile.outcome is StopReason.HALT
+    assert output == expected_output
+    # microcoded модель считает и выбранный HALT, профиль -- только завершенные инструкции
+    instructions -= model == "mc"
+    assert profile.total() == (instructions, ticks)
+    assert sum(count for count, _ in profile.by_word().values()) == instructions
+    assert sum(value for _, value in profile.by_line().values()) == ticks
+    if model == "mc":
+        assert sum(profile.microinstructions) == ticks
+
+    stacks = profile.collapsed_stacks()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in stacks) == ticks
+    assert all(line.startswith("main") for line in stacks)
+
+
+def test_collapsed_stacks_follow_calls():
+    profile, output = profile_source("variable x\n: leaf 1 x +! ;\n: outer leaf leaf ;\nouter leaf x @ .", limit=None)
+    assert output == "3"
+    words = profile.by_word()
+    assert set(words) == {"main", "leaf", "outer"}
+    # NOP на месте имени, LIT 1, LIT x, +! (LOAD, ADD, LIT, STORE) и RET -- по 8 инструкций на вызов
+    assert words["leaf"][0] == 3 * 8
+    stacks = dict(line.rsplit(" ", 1) for line in profile.collapsed_stacks("instructions"))
+    assert set(stacks) == {"main", "main;leaf", "main;outer", "main;outer;leaf"}
+    assert int(stacks["main;outer;leaf"]) == 2 * int(stacks["main;leaf"])
+
+
+def test_profile_without_source_map_and_limit():
+    data, code = translator.translate(": f 1 . ; f f f")
+    control_unit = machine_hw.ControlUnit(code, DataPath(data), "dispatch")
+    profile = profile_run(control_unit, Profile.for_control_unit(control_unit), limit=4)
+    assert profile.outcome is StopReason.INSTRUCTION_LIMIT
+    assert profile.total()[0] == 4
+    assert any(line.startswith("main;@") for line in profile.collapsed_stacks())
+    assert "by word:" not in profile.report()
+
+
+def test_profile_machine_code_with_sidecar(tmp_path, capsys):
+    target = tmp_path / "prob1.json"
+    translator.main(str(ALGORITHMS / "prob1.fth"), str(target), source_map=True)
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("", encoding="utf-8")
+    collapsed = tmp_path / "stacks.txt"
+    capsys.readouterr()
+
+    main(str(target), str(input_file), limit=None, collapsed=str(collapsed))
+    report = capsys.readouterr().out
+    assert report.startswith("233168\n")
+    assert "by word:\n  prob1 " in report
+    assert collapsed.read_text(encoding="utf-8").splitlines()[1].startswith("main;prob1 ")
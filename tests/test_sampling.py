@@ -0,0 +1,89 @@
+import logging
+
+import machine_hw
+import machine_mc
+import pytest
+import translator
+from data_path import DataPath
+from memory import WriteTrackingMemory
+from sampling import Sample, detailed_window, estimate_ticks, hand_off, simulate_sampled
+from stop_conditions import StopConditions, StopReason
+
+from tests.conftest import read_algorithm
+
+
+def exact_ticks(data, code, input_text):
+    control_unit = machine_mc.ControlUnit(code, DataPath(list(data), input_text))
+    return control_unit.run(stop=StopConditions(max_instructions=None))
+
+
+@pytest.mark.parametrize("name", ["hello_username", "prob1"])
+def test_full_coverage_is_exact(name):
+    data, code = translator.translate(read_algorithm(name))
+    output, _, ticks = exact_ticks(data, code, "Alice\n")
+    result = simulate_sampled(data, code, "Alice\n", period=700, window=700)
+    assert result.outcome is StopReason.HALT
+    assert result.output == output
+    assert result.ticks == ticks
+    assert sum(sample.instructions for sample in result.samples) == result.instructions
+
+
+def test_sampled_estimate_is_close():
+    data, code = translator.translate(read_algorithm("prob1"))
+    _, _, ticks = exact_ticks(data, code, "")
+    result = simulate_sampled(data, code, period=5000, window=500)
+    assert len(result.samples) == 12
+    assert result.ticks_low <= result.ticks <= result.ticks_high
+    assert abs(result.ticks - ticks) / ticks < 0.01
+    assert "samples: 12 sampled instructions: 6000" in result.report()
+
+
+def architectural_state(control_unit):
+    data_path = control_unit.data_path
+    rsp, sp = control_unit.return_stack_pointer, data_path.stack_pointer
+    return (
+        control_unit.program_counter,
+        control_unit.return_stack[: rsp + 1],
+        (data_path.tos, data_path.tos1, data_path.stack[: sp + 1]),
+        data_path.data_memory.tolist(),
+        data_path.input_buffer.consumed,
+    )
+
+
+def test_hand_off_transfers_architectural_state():
+    # окна короче периода: память и ввод, измененные быстрой моделью, передаются по частям
+    data, code = translator.translate(read_algorithm("hello_username"))
+    fast = machine_hw.ControlUnit(code, DataPath(WriteTrackingMemory(data), "Alice\n"), "jit")
+    detailed = machine_mc.ControlUnit(code, DataPath(list(data), "Alice\n"))
+    windows = 0
+    while fast.stop_reason in (None, StopReason.PAUSE):
+        hand_off(fast, detailed)
+        assert architectural_state(detailed) == architectural_state(fast)
+        detailed_window(detailed, 0, 3)
+        fast.run(stop=StopConditions(max_instructions=7, pause=True))
+        windows += 1
+    assert windows > 10
+    assert fast.data_path.input_buffer.consumed == len("Alice\n")
+
+
+def test_periods_end_silently(caplog):
+    data, code = translator.translate(read_algorithm("prob1"))
+    with caplog.at_level(logging.WARNING):
+        result = simulate_sampled(data, code, period=5000, window=500)
+    assert result.outcome is StopReason.HALT
+    assert not caplog.records
+    with caplog.at_level(logging.WARNING):
+        result = simulate_sampled(data, code, period=5000, window=500, limit=12000)
+    assert result.outcome is StopReason.INSTRUCTION_LIMIT
+    assert result.instructions == 12000
+    assert [record.getMessage() for record in caplog.records] == ["Limit exceeded!"]
+
+
+def test_estimate_ticks():
+    assert estimate_ticks([Sample(0, 10, 50)], 100) == (500, 500, 500)
+    estimate, low, high = estimate_ticks([Sample(0, 10, 40), Sample(50, 10, 60)], 100)
+    assert estimate == 500
+    assert low < estimate < high
+    _, wide_low, wide_high = estimate_ticks([Sample(0, 10, 40), Sample(50, 10, 60)], 100, confidence=0.99)
+    assert wide_low < low
+    assert high < wide_high
@@ -0,0 +1,204 @@
+import io
+
+import machine_hw
+import machine_mc
+import pytest
+import translator
+from data_path import DataPath
+from isa import FUSED_OPCODES, Instruction, Opcode
+from source_map import SourceMap, find_source_map, sidecar_path
+from stop_conditions import StopConditions
+
+from tests.conftest import ALGORITHMS, read_algorithm
+
+
+def run_hw(data, code, input_text, engine="dispatch", **kwargs):
+    control_unit = machine_hw.ControlUnit(code, DataPath(list(data), list(input_text)), engine, **kwargs)
+    return control_unit.run(stop=StopConditions(max_instructions=None))
+
+
+def run_mc(data, code, input_text):
+    control_unit = machine_mc.ControlUnit(code, DataPath(list(data), list(input_text)))
+    return control_unit.run(stop=StopConditions(max_instructions=None))
+
+
+@pytest.mark.parametrize("options", [{"fuse": True}, {"optimize": True}, {"fuse": True, "optimize": True}])
+@pytest.mark.parametrize("name", ["cat", "hello_world", "hello_username", "prob1"])
+def test_optimizations_keep_behaviour(name, options):
+    # prob1 сокращен, чтобы модель с микрокодом укладывалась в разумное время
+    source = read_algorithm(name, prob1_bound=100)
+    data, code = translator.translate(source)
+    new_data, new_code = translator.translate(source, **options)
+
+    assert len(new_code) < len(code)
+    if options.get("fuse"):
+        assert any(instr.opcode in FUSED_OPCODES for instr in new_code)
+    if options.get("optimize"):
+        assert all(instr.opcode is not Opcode.NOP for instr in new_code)
+
+    output, instr_counter, ticks = run_hw(data, code, "kirill\n")
+    for engine in machine_hw.ENGINES:
+        new_output, new_instr_counter, new_ticks = run_hw(new_data, new_code, "kirill\n", engine)
+        assert new_output == output
+        assert new_instr_counter < instr_counter
+        # по умолчанию суперинструкция стоит столько же тактов, сколько составляющие ее инструкции,
+        # а NOP в Hardwired модели не стоит тактов вовсе -- экономию дает только проброс переходов
+        assert new_ticks == ticks if not options.get("optimize") else new_ticks <= ticks
+
+    mc_output, _, mc_ticks = run_mc(data, code, "kirill\n")
+    new_mc_output, _, new_mc_ticks = run_mc(new_data, new_code, "kirill\n")
+    # в модели с микрокодом экономятся такты выборки
+    assert new_mc_output == mc_output == output
+    assert new_mc_ticks < mc_ticks
+
+
+def test_optimize_threads_jumps():
+    code = [
+        Instruction(Opcode.JMP, 3),
+        Instruction(Opcode.NOP),
+        Instruction(Opcode.JNZ, 1),
+        Instruction(Opcode.JMP, 1),
+        Instruction(Opcode.HALT),
+    ]
+    optimized = translator.optimize_code(code)
+    # NOP удален, JNZ на NOP и JMP на JMP ведут сразу к конечной цели
+    assert [(instr.opcode, instr.arg) for instr in optimized] == [
+        (Opcode.JMP, 1),
+        (Opcode.JNZ, 1),
+        (Opcode.JMP, 1),
+        (Opcode.HALT, None),
+    ]
+
+
+def test_optimize_threads_long_jump_chains():
+    # каждый JMP ведет на следующий: без запоминания адресов цепочка проходилась бы заново для каждого перехода
+    length = 50_000
+    code = [Instruction(Opcode.JMP, address + 1) for address in range(length)] + [Instruction(Opcode.HALT)]
+    optimized = translator.optimize_code(code)
+    assert all(instr.arg == length for instr in optimized[:length])
+
+
+def test_jump_destination_keeps_cycles():
+    code = [
+        Instruction(Opcode.JMP, 1),
+        Instruction(Opcode.NOP),
+        Instruction(Opcode.JMP, 1),
+        Instruction(Opcode.JZ, 0),
+        Instruction(Opcode.HALT),
+    ]
+    resolved = {}
+    # вход в цикл ведет на его первую инструкцию, инструкции цикла -- на самих себя
+    assert [translator.jump_destination(code, address, resolved) for address in range(5)] == [1, 1, 2, 3, 4]
+    assert resolved == {0: 1, 1: 1, 2: 2}
+
+
+@pytest.mark.parametrize("engine", machine_hw.ENGINES)
+def test_fused_tick_costs(engine):
+    data, code = translator.translate("1 2 < .", fuse=True)
+    assert [instr.opcode for instr in code].count(Opcode.LT) == 1
+
+    _, _, default_ticks = run_hw(data, code, "", engine)
+    output, _, ticks = run_hw(data, code, "", engine, fused_tick_costs={Opcode.LT: 1})
+    assert output == "-1"
+    tick_costs = machine_hw.ControlUnit.TICK_COSTS
+    assert ticks == default_ticks - tick_costs[Opcode.SUB] - tick_costs[Opcode.ISNEG] + 1
+
+
+def test_call_after_string_literal():
+    # строковый литерал занимает два набора инструкций, адрес процедуры после него не должен смещаться
+    data, code = translator.translate('."hi" : answer 42 . ; answer')
+    output, _, _ = run_hw(data, code, "")
+    assert output == "hi42"
+
+
+def test_lexer_tokens_and_locations():
+    source = ': hi ( -- ) ." a / b\nc" ; / comment ." x"\n  hi\n'
+    lexer = translator.Lexer(io.StringIO(source))
+    tokens = list(lexer)
+
+    assert [token.text for token in tokens] == [":", "hi", '." a / b\nc"', ";", "hi"]
+    assert [(token.line, token.column) for token in tokens] == [(1, 1), (1, 3), (1, 13), (2, 4), (3, 3)]
+    assert lexer.line_count == len(source.split("\n"))
+
+
+@pytest.mark.parametrize(
+    ("source", "message"),
+    [
+        ('1 ." abc\n2', "Unterminated string literal! (1:3)"),
+        ("1 ( a\n b", "Unbalanced ()! (1:3)"),
+        ("1\n  if 2", "Unbalanced pairs. (if 2:3)"),
+        ("begin\n then", "Unbalanced pairs. (begin 1:1 - then 2:2)!"),
+    ],
+)
+def test_lexer_diagnostics(source, message):
+    with pytest.raises(AssertionError, match=message.replace("(", r"\(").replace(")", r"\)")):
+        translator.text2terms(source)
+
+
+@pytest.mark.parametrize("options", [{}, {"fuse": True, "optimize": True}])
+def test_source_map(options):
+    source = "variable x\n: inc ( -- ) 1 x +! ;\ninc inc\nx @ .\n"
+    data, code, source_map = translator.translate(source, source_map=True, **options)
+    plain_data, plain_code = translator.translate(source, **options)
+    assert (data, list(code)) == (plain_data, list(plain_code))
+
+    assert source_map.variables == {"x": 3}
+    entry = source_map.functions["inc"]
+    if options:
+        assert code[entry].opcode is not Opcode.NOP
+    assert all(instr.arg == entry for instr in code if instr.opcode is Opcode.CALL)
+
+    # диапазоны не пересекаются, покрывают все инструкции, кроме NOP и HALT, и указывают на свои термы
+    covered = [address for source_range in source_map.ranges for address in range(source_range.start, source_range.end)]
+    assert covered == sorted(set(covered))
+    assert set(covered) | {len(code) - 1} >= {i for i, instr in enumerate(code) if instr.opcode is not Opcode.NOP}
+    lines = source.split("\n")
+    for source_range in source_map.ranges:
+        assert lines[source_range.line - 1][source_range.column - 1 :].startswith(source_range.term)
+
+    plus_store = next(r for r in source_map.ranges if r.term == "+!")
+    assert (plus_store.line, plus_store.column, plus_store.word) == (2, 18, "inc")
+    assert source_map.word(plus_store.start) == "inc"
+    assert source_map.word(len(code) - 2) == "main"
+    assert source_map.line(len(code) - 2) == 4
+    assert source_map.lookup(len(code) - 1) is None
+
+
+def test_source_map_sidecar(tmp_path, capsys):
+    source = ALGORITHMS / "hello_username.fth"
+    target = tmp_path / "hello_username.json"
+    translator.main(str(source), str(target), fuse=True, source_map=True)
+    capsys.readouterr()
+
+    _, _, expected = translator.translate(source.read_text(encoding="utf-8"), fuse=True, source_map=True)
+    loaded = SourceMap.read(sidecar_path(str(target)))
+    assert loaded.ranges == expected.ranges
+    assert loaded.functions == expected.functions == {"str_item": 1, "input_str": 6, "print_str": 37}
+    assert loaded.variables == expected.variables == {"str_length": 3}
+
+    # карта находится по имени файла машинного кода и читается при первом обращении
+    lazy = find_source_map(str(target))
+    assert "not loaded" in repr(lazy)
+    assert lazy.word(expected.functions["print_str"] + 1) == "print_str"
+    assert "not loaded" not in repr(lazy)
+    assert find_source_map(str(tmp_path / "missing.json")) is None
+
+
+def test_main_builds_source_map_only_on_request(tmp_path, capsys, monkeypatch):
+    def fail(*args):
+        pytest.fail("source map built without --source-map")
+
+    monkeypatch.setattr(translator, "source_ranges", fail)
+    target = tmp_path / "hello_username.json"
+    translator.main(str(ALGORITHMS / "hello_username.fth"), str(target))
+    capsys.readouterr()
+    assert target.exists()
+    assert find_source_map(str(target)) is None
+
+
+def test_tokens_are_checked_while_streaming():
+    # парность проверяется по мере чтения, токены не накапливаются
+    tokens = translator.balanced_tokens(translator.Lexer(io.StringIO("1 2 then 3")))
+    assert next(tokens).text == "1"
+    with pytest.raises(AssertionError, match="Unbalanced pairs"):
+        list(tokens)
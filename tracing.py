@@ -0,0 +1,63 @@
+"""Трассировка состояния модели процессора.
+
+Уровни трассировки (`TraceLevel`):
+
+- `OFF` -- трассировка отключена, цикл моделирования не снимает состояние вовсе;
+- `INSTRUCTION` -- состояние снимается на границе каждой инструкции;
+- `MICROINSTRUCTION` -- состояние снимается после каждой микроинструкции
+  (для `machine_hw` микроинструкций нет, поэтому совпадает с `INSTRUCTION`);
+- `FULL` -- как `MICROINSTRUCTION`, и каждое состояние дополнительно пишется в журнал
+  в формате golden-тестов.
+
+Состояние снимается в виде кортежа, а форматируется только при записи в журнал или при дампе.
+Последние состояния хранятся в кольцевом буфере и используются для post-mortem анализа.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import deque
+from enum import IntEnum
+
+DEFAULT_TRACE_DEPTH = 64
+
+
+class TraceLevel(IntEnum):
+    OFF = 0
+    INSTRUCTION = 1
+    MICROINSTRUCTION = 2
+    FULL = 3
+
+    def __str__(self):
+        return self.name.lower()
+
+    @classmethod
+    def parse(cls, name: str):
+        return cls[name.upper()]
+
+
+class Tracer:
+    level = None
+    states = None
+    formatter = None
+    log = None
+
+    def __init__(self, formatter, level: TraceLevel = TraceLevel.OFF, depth: int = DEFAULT_TRACE_DEPTH):
+        self.level: TraceLevel = TraceLevel(level)
+        self.states: deque[tuple] = deque(maxlen=depth)
+        self.formatter = formatter
+        self.log: bool = False
+
+    def start(self):
+        """Определяет один раз за запуск, нужно ли писать состояния в журнал."""
+        self.log = self.level >= TraceLevel.FULL and logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    def record(self, state: tuple):
+        self.states.append(state)
+        if self.log:
+            # stacklevel=2 -- в журнал попадает функция модели, а не трассировщика
+            logging.debug("%s", self.formatter(state), stacklevel=2)
+
+    def dump(self):
+        """Форматирует сохраненные в кольцевом буфере состояния, от старых к новым."""
+        return "\n".join(self.formatter(state) for state in self.states)
@@ -1,121 +1,186 @@
 from __future__ import annotations
 
-import sys
-
-from isa import Instruction, Opcode, write_data_and_code
-from machine_hw import DataPath
+import argparse
+import io
+import re
+from typing import NamedTuple
+
+from data_path import DataPath
+from isa import (
+    BRANCH_OPCODES,
+    FUSED_OPCODES,
+    Instruction,
+    Opcode,
+    ProgramImage,
+    write_binary_data_and_code,
+    write_data_and_code,
+)
+from memory import wrap_word
+from source_map import SourceMap, SourceRange, sidecar_path
+
+# Операторы исходного кода, которые тривиально отображаются в последовательность инструкций
+TERM_TO_INSTRUCTIONS: dict[str, tuple[tuple[Opcode, int | None], ...]] = {
+    "+": ((Opcode.ADD, None),),
+    "-": ((Opcode.SUB, None),),
+    "dup": ((Opcode.DUP, None),),
+    "over": ((Opcode.OVER, None),),
+    "key": ((Opcode.LIT, DataPath.READ_MEM_IO_MAPPING), (Opcode.LOAD, None)),
+    "emit": ((Opcode.LIT, DataPath.WRITE_MEM_IO_MAPPING_CHAR), (Opcode.STORE, None)),
+    ".": ((Opcode.LIT, DataPath.WRITE_MEM_IO_MAPPING_INT), (Opcode.STORE, None)),
+    "!": ((Opcode.STORE, None),),
+    "@": ((Opcode.LOAD, None),),
+    "<": ((Opcode.SUB, None), (Opcode.ISNEG, None)),
+    ">": ((Opcode.SUB, None), (Opcode.NEG, None), (Opcode.ISNEG, None)),
+    "=": ((Opcode.SUB, None), (Opcode.INV, None)),
+    "or": ((Opcode.OR, None),),
+    "and": ((Opcode.AND, None),),
+    "invert": ((Opcode.INV, None),),
+}
 
 
 def term2instructions(symbol):
     """Отображение операторов исходного кода в коды операций."""
-    return {
-        "+": [Instruction(Opcode.ADD)],
-        "-": [Instruction(Opcode.SUB)],
-        "dup": [Instruction(Opcode.DUP)],
-        "over": [Instruction(Opcode.OVER)],
-        "key": [Instruction(Opcode.LIT, arg=DataPath.READ_MEM_IO_MAPPING), Instruction(Opcode.LOAD)],
-        "emit": [Instruction(Opcode.LIT, arg=DataPath.WRITE_MEM_IO_MAPPING_CHAR), Instruction(Opcode.STORE)],
-        ".": [Instruction(Opcode.LIT, arg=DataPath.WRITE_MEM_IO_MAPPING_INT), Instruction(Opcode.STORE)],
-        "!": [Instruction(Opcode.STORE)],
-        "@": [Instruction(Opcode.LOAD)],
-        "<": [Instruction(Opcode.SUB), Instruction(Opcode.ISNEG)],
-        ">": [Instruction(Opcode.SUB), Instruction(Opcode.NEG), Instruction(Opcode.ISNEG)],
-        "=": [Instruction(Opcode.SUB), Instruction(Opcode.INV)],
-        "or": [Instruction(Opcode.OR)],
-        "and": [Instruction(Opcode.AND)],
-        "invert": [Instruction(Opcode.INV)],
-    }.get(symbol, None)
-
-
-def check_balance_in_terms(terms: list[str]):
-    """Проверяет закрыты ли условные операторы, операторы циклов, определения процедур"""
-    # но вообще надо проверять на "правильную скобочную последовательность"
+    if symbol not in TERM_TO_INSTRUCTIONS:
+        return None
+    return [Instruction(opcode, arg) for opcode, arg in TERM_TO_INSTRUCTIONS[symbol]]
 
-    pairs_to_check = [("begin", "until"), ("if", "then"), (":", ";")]
 
-    stack = []
-    for term in terms:
-        if term in ("begin", "if", ":"):
-            assert term != ":" or ":" not in stack, "Sub-functions not allowed"
-            stack.append(term)
-        if term in ("until", "then", ";"):
-            assert len(stack) >= 1, "Unbalanced pairs."
-            t = stack.pop()
-            assert (t, term) in pairs_to_check, f"Unbalanced pairs. ({t} - {term})!"
-    assert len(stack) == 0, "Unbalanced pairs."
+class Token(NamedTuple):
+    """Токен исходного кода с позицией начала (строка и столбец считаются с 1)."""
 
+    text: str
+    line: int
+    column: int
+
+    def location(self):
+        return f"{self.line}:{self.column}"
 
-def remove_brackets(terms: list[str]):
-    """Убирает то, что в скобах (например семантика функции)"""
-    new_terms = []
-    deep = 0
-    for term_num, term in enumerate(terms):
-        if term[0] == "(":
-            deep += 1
-        if deep == 0:
-            new_terms.append(term)
-        if term[-1] == ")":
-            deep -= 1
-    assert deep == 0, "Unbalanced ()!"
-    return new_terms
-
-
-def split_with_saving_string_literals(text: str):
-    """Разбивает на токены, причем ." " тоже считается токеном."""
-    string_literals = []
-    text_prep = [text]
-    while isinstance(text_prep[-1], str) and text_prep[-1].find('."'):
-        left = text_prep[-1].find('."')
-        right = text_prep[-1].find('"', left + 2)
-        if left != -1 and right != -1:
-            string_literals.append(text_prep[-1][left : right + 1])
-            raw = text_prep.pop()
-            text_prep.append(raw[0:left].split())
-            text_prep.append(raw[right + 1 : :])
-        else:
-            text_prep.append(text_prep.pop().split())
-    if isinstance(text_prep[-1], str):
-        raw = text_prep.pop()
-        text_prep.append(raw.split())
 
-    terms = []
-    for i in range(len(text_prep) - 1):
-        terms += text_prep[i]
-        terms.append(string_literals[i])
-    terms += text_prep[-1]
+class Lexer:
+    """Потоковый однопроходный лексер.
 
-    return terms
+    Читает исходный код построчно из файлового объекта (или строки) и выдает токены с позициями.
+    За один проход:
 
+    - отбрасывает комментарии (от `/` до конца строки, вне строковых литералов);
+    - собирает строковые литералы `."..."` в один токен (литерал может занимать несколько строк);
+    - отбрасывает блоки в скобках `( ... )` (например, сигнатуры процедур).
 
-def remove_comments(text: str):
-    """Убирает все в строке после /"""
-    result = []
-    skip = False
+    В памяти одновременно находится только текущая строка и незакрытый литерал.
+    """
 
-    for char in text:
-        if char == "/":
-            skip = True
-        elif char == "\n":
-            skip = False
-            result.append(char)
-        if not skip:
-            result.append(char)
+    source = None
+    line_count = None
+    _literal = None  # части и начальный токен незакрытого строкового литерала
+
+    WORD = re.compile(r"(/)|([^\s/]+)")
+
+    def __init__(self, source):
+        self.source = io.StringIO(source) if isinstance(source, str) else source
+        # количество строк в смысле text.split("\n"), известно после чтения всего потока
+        self.line_count: int = 1
+
+    def __iter__(self):
+        depth = 0
+        bracket = None  # токен, открывший внешний блок в скобках
+        self._literal = None
+        for line_num, line in enumerate(self.source, 1):
+            if line.endswith("\n"):
+                self.line_count += 1
+            for token in self._scan_line(line, line_num):
+                # блоки в скобках определяются по первому и последнему символу токена
+                if token.text[0] == "(":
+                    depth += 1
+                    bracket = bracket or token
+                if depth == 0:
+                    yield token
+                if token.text[-1] == ")":
+                    depth -= 1
+                    assert depth >= 0, f"Unbalanced ()! ({token.location()})"
+                    bracket = bracket if depth else None
+        assert self._literal is None, f"Unterminated string literal! ({self._literal[1].location()})"
+        assert depth == 0, f"Unbalanced ()! ({bracket.location()})"
+
+    def _scan_line(self, line: str, line_num: int):
+        """Выдает токены одной строки. Незакрытый литерал переносится на следующую строку в `_literal`."""
+        pos = 0
+        while True:
+            if self._literal is not None:
+                parts, start = self._literal
+                end = line.find('"', pos)
+                if end == -1:
+                    parts.append(line[pos:])
+                    return
+                parts.append(line[pos : end + 1])
+                self._literal = None
+                pos = end + 1
+                yield start._replace(text="".join(parts))
+                continue
+
+            match = self.WORD.search(line, pos)
+            if match is None or match.group(1) is not None:  # конец строки или комментарий
+                return
+            word, column = match.group(2), match.start() + 1
+            literal_start = word.find('."')
+            if literal_start == -1:
+                pos = match.end()
+                yield Token(word, line_num, column)
+                continue
+            if literal_start > 0:
+                yield Token(word[:literal_start], line_num, column)
+            pos = match.start() + literal_start + 2
+            self._literal = (['."'], Token('."', line_num, column + literal_start))
+
+
+def balanced_tokens(tokens):
+    """Выдает токены по мере чтения, проверяя, закрыты ли условные операторы, операторы циклов, определения процедур"""
+    pairs_to_check = [("begin", "until"), ("if", "then"), (":", ";")]
 
-    return "".join(result)
+    stack: list[Token] = []
+    for token in tokens:
+        if token.text in ("begin", "if", ":"):
+            assert token.text != ":" or all(t.text != ":" for t in stack), (
+                f"Sub-functions not allowed ({token.location()})"
+            )
+            stack.append(token)
+        if token.text in ("until", "then", ";"):
+            assert len(stack) >= 1, f"Unbalanced pairs. ({token.location()})"
+            t = stack.pop()
+            assert (t.text, token.text) in pairs_to_check, (
+                f"Unbalanced pairs. ({t.text} {t.location()} - {token.text} {token.location()})!"
+            )
+        yield token
+    assert len(stack) == 0, f"Unbalanced pairs. ({stack[-1].text} {stack[-1].location()})"
 
 
-def text2terms(text) -> list[str]:
-    """Трансляция текста в последовательность операторов языка (токенов).
+def read_terms(source, keep_tokens=False):
+    """Читает термы программы потоком: (термы, токены с позициями или None, если keep_tokens не задан).
 
     Включает в себя:
 
     - отсеивание всех незначимых символов (считаются комментариями);
     - проверка формальной корректности программы (парность оператора цикла).
+
+    `source` -- строка, файловый объект или `Lexer`. Токены хранятся, только если нужны их позиции.
     """
-    text = remove_comments(text)
-    terms = split_with_saving_string_literals(text)
-    check_balance_in_terms(terms)
-    return remove_brackets(terms)
+    lexer = source if isinstance(source, Lexer) else Lexer(source)
+    terms: list[str] = []
+    tokens: list[Token] | None = [] if keep_tokens else None
+    for token in balanced_tokens(lexer):
+        terms.append(token.text)
+        if tokens is not None:
+            tokens.append(token)
+    return terms, tokens
+
+
+def text2tokens(source) -> list[Token]:
+    """Последовательность токенов с позициями списком (см. `read_terms`)."""
+    return read_terms(source, keep_tokens=True)[1]
+
+
+def text2terms(source) -> list[str]:
+    """Трансляция текста в последовательность операторов языка (токенов)."""
+    return read_terms(source)[0]
 
 
 def find_variables(terms: list[str]):
@@ -141,14 +206,20 @@ def find_variables(terms: list[str]):
     return variables, last_free_address
 
 
-def remove_term_var(terms: list[str]):
-    while "variable" in terms:
-        i = terms.index("variable")
-        terms = terms[0:i:] + terms[i + 2 : :]
-    while "allot" in terms:
-        i = terms.index("allot")
-        terms = terms[0 : i - 1 :] + terms[i + 1 : :]
-    return terms
+def term_var_free_indices(terms: list[str]):
+    """Номера термов, которые остаются после удаления объявлений переменных и выделений памяти"""
+    indices = []
+    skip_name = False
+    for i, term in enumerate(terms):
+        if skip_name:
+            skip_name = False
+        elif term == "variable":
+            skip_name = True
+        elif term == "allot":
+            indices.pop()
+        else:
+            indices.append(i)
+    return indices
 
 
 def find_functions(terms: list[str]):
@@ -162,25 +233,176 @@ def find_functions(terms: list[str]):
     return functions
 
 
-def translate(text):  # noqa: C901
-    terms = text2terms(text)
+def enclosing_words(terms: list[str]):
+    """Для каждого терма -- имя процедуры, внутри которой он находится (None -- вне процедур).
+
+    Имя и `;` относятся к процедуре, а `:` -- нет: переход через тело процедуры исполняется снаружи.
+    """
+    words: list[str | None] = []
+    word = None
+    for i, term in enumerate(terms):
+        if i > 0 and terms[i - 1] == ":":
+            word = term
+        words.append(word)
+        if term == ";":
+            word = None
+    return words
+
+
+def fuse_instructions(instructions: list[Instruction]):
+    """Peephole-проход: заменяет типовые последовательности инструкций суперинструкциями (см. isa.FUSED_OPCODES)."""
+    # более длинные последовательности проверяются первыми
+    patterns = sorted(FUSED_OPCODES.items(), key=lambda item: -len(item[1]))
+    fused = []
+    i = 0
+    while i < len(instructions):
+        for opcode, sequence in patterns:
+            window = instructions[i : i + len(sequence)]
+            if tuple(instr.opcode for instr in window) == sequence:
+                args = [instr.arg for instr in window if instr.arg is not None]
+                fused.append(Instruction(opcode, args[0] if args else None))
+                i += len(sequence)
+                break
+        else:
+            fused.append(instructions[i])
+            i += 1
+    return fused
+
+
+def instruction_list_addresses(terms_to_instruction_lists: list[list[Instruction]]):
+    """Адреса начала наборов инструкций (префиксные суммы длин) и адрес сразу за последним набором."""
+    addresses = [0]
+    for instructions in terms_to_instruction_lists:
+        addresses.append(addresses[-1] + len(instructions))
+    return addresses
+
+
+def relocate(terms_to_instruction_lists: list[list[Instruction]]):
+    """Склеивает наборы инструкций термов в код и заменяет номера наборов в аргументах переходов на адреса.
+
+    Адрес начала каждого набора берется из таблицы префиксных сумм, поэтому пересчет линейный.
+    """
+    code: list[Instruction] = []
+    for instructions in terms_to_instruction_lists:
+        code += instructions
+    term_address = instruction_list_addresses(terms_to_instruction_lists)
+
+    # В машинном коде инструкций больше, чем токенов. Обновляем аргумент
+    for address, instr in enumerate(code):
+        if instr.opcode in BRANCH_OPCODES:
+            code[address] = instr._replace(arg=term_address[instr.arg])
+    return code
+
+
+def jump_destination(code: list[Instruction], address: int, resolved: dict[int, int] | None = None):
+    """Конечный адрес перехода: NOP и цепочки безусловных переходов проходятся насквозь.
+
+    resolved -- конечные адреса, найденные для других переходов того же кода. Конечный адрес запоминается
+    для каждой инструкции пройденной цепочки, поэтому все переходы кода разрешаются за линейное время.
+    """
+    resolved = {} if resolved is None else resolved
+    path: dict[int, int] = {}  # адрес -> номер в цепочке
+    while address not in resolved and address not in path and code[address].opcode in (Opcode.NOP, Opcode.JMP):
+        path[address] = len(path)
+        address = address + 1 if code[address].opcode is Opcode.NOP else code[address].arg
+    chain = list(path)
+    if address in path:
+        # бесконечный цикл из JMP и NOP: переход на инструкцию цикла остается на ней самой
+        cycle = path[address]
+        resolved.update((member, member) for member in chain[cycle:])
+        chain = chain[:cycle]
+    destination = resolved.get(address, address)
+    resolved.update((member, destination) for member in chain)
+    return destination
+
+
+def nop_free_addresses(code: list[Instruction]):
+    """Адрес каждой инструкции после удаления NOP и адрес сразу за концом кода.
+
+    Адрес NOP -- адрес следующей за ним сохраняемой инструкции.
+    """
+    new_address = []
+    kept = 0
+    for instr in code:
+        new_address.append(kept)
+        if instr.opcode is not Opcode.NOP:
+            kept += 1
+    new_address.append(kept)
+    return new_address
+
+
+def optimize_code(code: list[Instruction]):
+    """Удаляет NOP и пробрасывает переходы, ведущие на NOP или JMP.
+
+    Адреса всех переходов пересчитываются за один проход по таблице новых адресов,
+    цепочки переходов проходятся один раз (см. `jump_destination`).
+    """
+    new_address = nop_free_addresses(code)
+    resolved: dict[int, int] = {}
+    optimized = []
+    for instr in code:
+        if instr.opcode is Opcode.NOP:
+            continue
+        if instr.opcode in BRANCH_OPCODES:
+            instr = instr._replace(arg=new_address[jump_destination(code, instr.arg, resolved)])
+        optimized.append(instr)
+    return optimized
+
+
+def source_ranges(tokens: list[Token], words: list[str | None], list_terms: list[int], list_addresses: list[int]):
+    """Диапазоны адресов термов. Соседние наборы инструкций одного терма объединяются, пустые -- пропускаются."""
+    ranges: list[SourceRange] = []
+    last_term = None
+    for index, term_num in enumerate(list_terms):
+        start, end = list_addresses[index], list_addresses[index + 1]
+        if start == end:
+            continue
+        if term_num == last_term and ranges[-1].end == start:
+            ranges[-1] = ranges[-1]._replace(end=end)
+            continue
+        token = tokens[term_num]
+        ranges.append(SourceRange(start, end, token.line, token.column, token.text, words[term_num]))
+        last_term = term_num
+    return ranges
+
+
+def translate(text, fuse=False, optimize=False, source_map=False):  # noqa: C901
+    """Трансляция текста программы в память данных и машинный код.
+
+    `text` -- строка, файловый объект или `Lexer` (исходный код читается потоково).
+
+    При `fuse=True` типовые последовательности инструкций заменяются суперинструкциями.
+    Слияние выполняется внутри набора инструкций одного терма, поэтому адреса переходов не затрагиваются.
+
+    Машинный код возвращается в виде `ProgramImage`.
+
+    При `optimize=True` из готового кода удаляются NOP и пробрасываются переходы (см. `optimize_code`).
+
+    При `source_map=True` третьим значением возвращается `SourceMap` -- связь адресов кода с термами.
+    """
+    terms, tokens = read_terms(text, keep_tokens=source_map)
     variables, last_free_address = find_variables(terms)
-    terms = remove_term_var(terms)
+    kept = term_var_free_indices(terms)
+    if source_map:
+        tokens = [tokens[i] for i in kept]
+    terms = [terms[i] for i in kept]
     functions = find_functions(terms)
 
     data: list[int | str] = [0] * last_free_address  # инициализируем выделенную память
-    code: list[Instruction] = []
 
     # Транслируем термы в машинный код.
     terms_to_instruction_lists: list[list[Instruction]] = []
     jmp_stack: list[int] = []
     func_addr: dict[str, int] = dict()
-    for term_num in range(len(terms)):
-        if terms[term_num] == "begin":
+    # номер терма, породившего каждый набор инструкций (для карты исходного кода)
+    list_terms: list[int] = []
+    for term_num, term in enumerate(terms):
+        instructions = term2instructions(term)
+        if term == "begin":
             # оставляем placeholder, который будет заменён в конце цикла
             terms_to_instruction_lists.append([None])
             jmp_stack.append(len(terms_to_instruction_lists) - 1)
-        elif terms[term_num] == "until":
+        elif term == "until":
             # формируем цикл с началом из jmp_stack
             begin_pc = jmp_stack.pop()
             begin = Instruction(Opcode.NOP)
@@ -188,23 +410,23 @@ def translate(text):  # noqa: C901
             terms_to_instruction_lists[begin_pc] = [begin]
             terms_to_instruction_lists.append(end)
 
-        elif terms[term_num] == "if":
+        elif term == "if":
             terms_to_instruction_lists.append([None])
             jmp_stack.append(len(terms_to_instruction_lists) - 1)
-        elif terms[term_num] == "then":
+        elif term == "then":
             terms_to_instruction_lists.append([Instruction(Opcode.NOP)])
             terms_to_instruction_lists[jmp_stack.pop()] = [
                 Instruction(Opcode.INV),
                 Instruction(Opcode.JNZ, len(terms_to_instruction_lists)),
             ]
 
-        elif term2instructions(terms[term_num]) is not None:  # Обработка тривиально отображаемых операций
-            terms_to_instruction_lists.append(term2instructions(terms[term_num]))
+        elif instructions is not None:  # Обработка тривиально отображаемых операций
+            terms_to_instruction_lists.append(instructions)
 
-        elif terms[term_num] in variables:
+        elif term in variables:
             # обращение к переменной - положить ассоциированный адрес на вершину стека
-            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=variables[terms[term_num]])])
-        elif terms[term_num] == "+!":
+            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=variables[term])])
+        elif term == "+!":
             terms_to_instruction_lists.append(
                 [
                     Instruction(Opcode.LOAD),
@@ -214,28 +436,28 @@ def translate(text):  # noqa: C901
                 ]
             )
 
-        elif terms[term_num] == ":":  # если пришли к определению функции, то её надо перепрыгнуть
+        elif term == ":":  # если пришли к определению функции, то её надо перепрыгнуть
             terms_to_instruction_lists.append([None])
             # нужно будет поставить JUMP с переходом сразу за функцию
             jmp_stack.append(len(terms_to_instruction_lists) - 1)
-        elif terms[term_num] in functions:
+        elif term in functions:
             if terms[term_num - 1] != ":":
-                terms_to_instruction_lists.append([Instruction(Opcode.CALL, arg=func_addr[terms[term_num]])])
+                terms_to_instruction_lists.append([Instruction(Opcode.CALL, arg=func_addr[term])])
             else:
-                # записываем номер терма с началом функции (указываем на NOP)
-                func_addr[terms[term_num]] = term_num
+                # записываем номер набора инструкций с началом функции (указываем на NOP)
+                func_addr[term] = len(terms_to_instruction_lists)
                 # чтобы не ломать адресацию замещаем токен с именем функции на NOP
                 terms_to_instruction_lists.append([Instruction(Opcode.NOP)])
-        elif terms[term_num] == ";":
+        elif term == ";":
             terms_to_instruction_lists.append([Instruction(Opcode.RET)])
             terms_to_instruction_lists[jmp_stack.pop()] = [Instruction(Opcode.JMP, len(terms_to_instruction_lists))]
 
-        elif terms[term_num][0:2:] == '."' and terms[term_num][-1] == '"':
+        elif term[0:2:] == '."' and term[-1] == '"':
             # Записываем строку в память по одному символу на ячейку. Причем храним Unicode коды.
-            data += [ord(char) for char in terms[term_num][2:-1:]]
+            data += [ord(char) for char in term[2:-1:]]
             # Инициализация указателя на ячейку памяти отдельным токеном
             # (чтобы при смене номеров токенов в аргументах на адреса инструкций не трогать эту инструкцию)
-            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=len(data) - len(terms[term_num][2:-1:]))])
+            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=len(data) - len(term[2:-1:]))])
 
             # цикл вывода строки
             terms_to_instruction_lists.append(
@@ -255,38 +477,60 @@ def translate(text):  # noqa: C901
                     Instruction(Opcode.JNZ, arg=len(terms_to_instruction_lists)),
                 ]
             )
-        elif terms[term_num].isdigit() or terms[term_num][0] == "-" and terms[term_num][1::].isdigit():
-            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=int(terms[term_num]))])
+        elif term.isdigit() or term[0] == "-" and term[1::].isdigit():
+            # число -- машинное слово, переполнение циклическое, как в АЛУ
+            terms_to_instruction_lists.append([Instruction(Opcode.LIT, arg=wrap_word(int(term)))])
         else:
             pass
+        list_terms.extend([term_num] * (len(terms_to_instruction_lists) - len(list_terms)))
 
-    for term_num in range(len(terms_to_instruction_lists)):
-        code += terms_to_instruction_lists[term_num]
+    if fuse:
+        terms_to_instruction_lists = [fuse_instructions(instructions) for instructions in terms_to_instruction_lists]
 
-    # В машинном коде инструкций больше, чем токенов. Обновляем аргумент
-    for c in range(len(code)):
-        if code[c].opcode in (Opcode.CALL, Opcode.JMP, Opcode.JNZ):
-            term_num = code[c].arg
-            pc = sum([len(i) for i in terms_to_instruction_lists[0:term_num]])
-            code[c].arg = pc
+    code = relocate(terms_to_instruction_lists)
 
     # Добавляем инструкцию остановки процессора в конец программы.
     code.append(Instruction(Opcode.HALT))
-    return data, code
+    list_addresses = instruction_list_addresses(terms_to_instruction_lists)
+    if optimize:
+        new_address = nop_free_addresses(code)
+        list_addresses = [new_address[address] for address in list_addresses]
+        code = optimize_code(code)
+    if not source_map:
+        return data, ProgramImage.from_code(code)
 
+    functions_entry = {name: list_addresses[index] for name, index in func_addr.items()}
+    ranges = source_ranges(tokens, enclosing_words(terms), list_terms, list_addresses)
+    return data, ProgramImage.from_code(code), SourceMap(ranges, functions_entry, variables)
 
-def main(source, target):
-    """Функция запуска транслятора. Параметры -- исходный и целевой файлы."""
-    with open(source, encoding="utf-8") as f:
-        source = f.read()
 
-    data, code = translate(source)
+def main(source, target, fuse=False, optimize=False, binary=False, source_map=False):
+    """Функция запуска транслятора. Параметры -- исходный и целевой файлы.
+
+    При `binary` машинный код записывается в компактном бинарном формате, иначе -- в JSON.
+    При `source_map` рядом с машинным кодом записывается карта исходного кода (`<target>.map`).
+    """
+    with open(source, encoding="utf-8") as f:
+        lexer = Lexer(f)
+        translated = translate(lexer, fuse, optimize, source_map)
+    data, code = translated[:2]
 
-    write_data_and_code(target, data, code)
-    print("source LoC:", len(source.split("\n")), "code instr:", len(code))
+    if binary:
+        write_binary_data_and_code(target, data, code)
+    else:
+        write_data_and_code(target, data, code)
+    if source_map:
+        translated[2].write(sidecar_path(target))
+    print("source LoC:", lexer.line_count, "code instr:", len(code))
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 3, "Wrong arguments: translator.py <input_file> <target_file>"
-    _, source, target = sys.argv
-    main(source, target)
+    parser = argparse.ArgumentParser(description="Транслятор Forth в машинный код стекового процессора")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--fuse", action="store_true", help="replace common sequences with superinstructions")
+    parser.add_argument("--optimize", action="store_true", help="remove NOPs and thread jumps")
+    parser.add_argument("--binary", action="store_true", help="write compact binary machine code instead of JSON")
+    parser.add_argument("--source-map", action="store_true", help="write a source map next to the target (.map)")
+    args = parser.parse_args()
+    main(args.source, args.target, args.fuse, args.optimize, args.binary, args.source_map)